@@ -0,0 +1,189 @@
+"""
+Admission control
+Keeps synthesis work within fixed limits so that overload degrades
+latency instead of the whole server. Requests beyond the global and
+per-voice concurrency limits wait in a bounded first-come-first-served
+queue; when the queue is full, or a request has waited too long, it is
+turned away at once with a Retry-After estimate. A token bucket per
+client limits how fast any one client can submit requests.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+# Client buckets idle for this long are forgotten once they are full again
+BUCKET_IDLE_SECONDS = 600
+
+
+class Overloaded(Exception):
+    """The request cannot be admitted now; retry after retry_after seconds
+
+    reason is 'queue_full', 'queue_timeout' or 'rate_limited'.
+    """
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def _retry_seconds(seconds):
+    """Whole seconds for a Retry-After header, within 1 to 120"""
+    return max(1, min(120, math.ceil(seconds)))
+
+
+class _Ticket:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+
+class AdmissionController:
+    """Bounded queue in front of global and per-key concurrency limits
+
+    max_active requests run at once, at most max_active_per_key of them
+    for the same key (a voice). Up to max_queued more wait for a slot, at
+    most max_wait seconds each. max_active or max_active_per_key of 0 means
+    no limit; with max_queued of 0 requests are turned away instead of waiting.
+    """
+
+    def __init__(self, max_active, max_active_per_key=0, max_queued=0, max_wait=10.0):
+        self.max_active = max_active
+        self.max_active_per_key = max_active_per_key
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_key = {}
+        self._waiting = deque()
+        # Moving average of how long a request holds its slot, for Retry-After
+        self._hold_seconds = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _can_run(self, key):
+        if self.max_active and self._active >= self.max_active:
+            return False
+        if self.max_active_per_key and self._active_by_key.get(key, 0) >= self.max_active_per_key:
+            return False
+        return True
+
+    def _next_runnable(self):
+        """The longest waiting ticket that has a free slot"""
+        for ticket in self._waiting:
+            if self._can_run(ticket.key):
+                return ticket
+        return None
+
+    def _retry_after(self):
+        """Rough time until the queue ahead of a new request has drained"""
+        slots = self.max_active or max(1, self._active)
+        return _retry_seconds(self._hold_seconds * (len(self._waiting) + 1) / slots)
+
+    def acquire(self, key):
+        """Wait for a slot and return a function that releases it; raises Overloaded"""
+        with self._cond:
+            # Waiting requests go first unless they are all held back by their own voice's limit
+            if self._next_runnable() is None and self._can_run(key):
+                return self._admit(key)
+            if len(self._waiting) >= self.max_queued:
+                self.rejected += 1
+                raise Overloaded("Server is busy, try again later", self._retry_after(), 'queue_full')
+            ticket = _Ticket(key)
+            self._waiting.append(ticket)
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self._next_runnable() is not ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise Overloaded("Server is busy, timed out waiting in the queue", self._retry_after(),
+                                         'queue_timeout')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # Whoever is next may be able to run now that this ticket has left
+                self._cond.notify_all()
+            return self._admit(key)
+
+    def _admit(self, key):
+        self._active += 1
+        self._active_by_key[key] = self._active_by_key.get(key, 0) + 1
+        self.admitted += 1
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            with self._cond:
+                if released:
+                    return
+                released = True
+                self._active -= 1
+                count = self._active_by_key[key] - 1
+                if count:
+                    self._active_by_key[key] = count
+                else:
+                    del self._active_by_key[key]
+                self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.monotonic() - started)
+                self._cond.notify_all()
+
+        return release
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'queued': len(self._waiting),
+                'max_active': self.max_active,
+                'max_active_per_voice': self.max_active_per_key,
+                'max_queued': self.max_queued,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out
+            }
+
+
+class RateLimiter:
+    """Token bucket per client: rate requests per second, bursts of up to burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets = {}  # client -> (tokens, last update)
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        self.limited = 0
+
+    def check(self, client, cost=1):
+        """Take cost tokens for client; raises Overloaded when it has none left
+
+        A cost larger than what is left is still allowed while the client has
+        a token; the bucket then goes into debt, so a request worth many
+        (a batch) is paid for by a longer wait before the next one.
+        """
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                self.limited += 1
+                raise Overloaded("Too many requests, slow down", _retry_seconds((1 - tokens) / self.rate),
+                                 'rate_limited')
+            self._buckets[client] = (tokens - cost, now)
+            if now - self._last_prune > BUCKET_IDLE_SECONDS:
+                self._prune(now)
+
+    def _prune(self, now):
+        self._last_prune = now
+        for client, (tokens, updated) in list(self._buckets.items()):
+            # Buckets still in debt are kept however long they have been idle
+            if now - updated > BUCKET_IDLE_SECONDS and tokens + (now - updated) * self.rate >= self.burst:
+                del self._buckets[client]
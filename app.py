@@ -10,17 +10,92 @@ import sys
 import platform
 import subprocess
 import tempfile
+import shutil
 import json
+import io
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file, flash
+from flask import Flask, Response, render_template, request, jsonify, send_file, flash, g
 import threading
 import time
-import re
+import atexit
+import asyncio
+import contextvars
+import functools
+import hmac
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from piper_pool import PiperPool, PiperWorker
+from synthesis_cache import SynthesisCache
+from segmentation import split_sentences, iter_sentences
+from extraction import DocumentText, ExtractionError, peek_text
+from wav_utils import read_wav, wav_header, silence, pcm_params, wav_bytes
+from jobs import JobStore, JobQueue, QUEUED, CANCELLED
+from audio_store import AudioStore
+from voice_registry import VoiceRegistry, read_voice_config
+from language_detect import LanguageDetector
+from onnx_engine import OnnxEngine
+from phoneme_cache import PhonemeCache
+from profiling import RequestProfiler
+from admission import AdmissionController, RateLimiter, Overloaded
+from archive_stream import stream_archive, ARCHIVE_TYPES
+import metrics
+import wave
 
 app = Flask(__name__)
 
+# Override the bundled piper binary and voices directory, e.g. to benchmark against a stand-in
+PIPER_PATH = os.environ.get('KASANOMA_PIPER_PATH', '')
+VOICES_DIR = os.environ.get('KASANOMA_VOICES_DIR', '')
+
+# Persistent Piper workers per voice; set KASANOMA_POOL_SIZE=0 to spawn one process per request
+PIPER_POOL_SIZE = int(os.environ.get('KASANOMA_POOL_SIZE', str(min(4, os.cpu_count() or 2))))
+PIPER_TIMEOUT = float(os.environ.get('KASANOMA_PIPER_TIMEOUT', '30'))
+# Extra seconds allowed per character of text, so long texts are not cut off by a fixed timeout
+TIMEOUT_PER_CHAR = float(os.environ.get('KASANOMA_TIMEOUT_PER_CHAR', '0.1'))
+PIPER_HEALTH_INTERVAL = float(os.environ.get('KASANOMA_HEALTH_INTERVAL', '30'))
+# Load the default voice at startup so the first request does not pay for it
+WARM_UP = os.environ.get('KASANOMA_WARM_UP', 'true').lower() == 'true'
+
+# Synthesis backend: 'piper' runs the piper binary, 'onnx' runs voices in-process with onnxruntime
+BACKEND = os.environ.get('KASANOMA_BACKEND', 'piper').lower()
+ONNX_INTRA_OP_THREADS = int(os.environ.get('KASANOMA_ONNX_INTRA_THREADS', '1'))
+ONNX_INTER_OP_THREADS = int(os.environ.get('KASANOMA_ONNX_INTER_THREADS', '1'))
+# Sentences of one voice run together in batches of up to this size, waiting at most the delay (1 disables)
+ONNX_BATCH_SIZE = int(os.environ.get('KASANOMA_ONNX_BATCH_SIZE', '1'))
+ONNX_BATCH_DELAY = float(os.environ.get('KASANOMA_ONNX_BATCH_DELAY_MS', '5')) / 1000
+# Phoneme ids of recently seen texts (0 disables), optionally persisted to a directory
+PHONEME_CACHE_SIZE = int(os.environ.get('KASANOMA_PHONEME_CACHE_SIZE', '10000'))
+PHONEME_CACHE_DIR = os.environ.get('KASANOMA_PHONEME_CACHE_DIR', '')
+PHONEME_CACHE_DISK_ENTRIES = int(os.environ.get('KASANOMA_PHONEME_CACHE_DISK_ENTRIES', '200000'))
+
+# Silence inserted between sentences when long texts are synthesized in segments
+SEGMENT_SILENCE = float(os.environ.get('KASANOMA_SEGMENT_SILENCE', '0.25'))
+
+# Shared on-disk cache of synthesized audio; set KASANOMA_CACHE_MAX_BYTES=0 to disable
+CACHE_DIR = os.environ.get('KASANOMA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'kasanoma-cache'))
+CACHE_MAX_BYTES = int(os.environ.get('KASANOMA_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Audio of single sentences of long texts, kept apart so whole documents never evict it (0 disables)
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('KASANOMA_SEGMENT_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# Voice index persisted between runs and polled for added/removed voices (0 disables polling)
+VOICE_INDEX_PATH = os.environ.get('KASANOMA_VOICE_INDEX', os.path.join(tempfile.gettempdir(), 'kasanoma-voice-index.json'))
+VOICE_RELOAD_INTERVAL = float(os.environ.get('KASANOMA_VOICE_RELOAD_INTERVAL', '10'))
+
+# Detect the language of requests that name neither a language nor a voice
+AUTO_DETECT_DEFAULT = os.environ.get('KASANOMA_AUTO_DETECT', 'true').lower() == 'true'
+
+# Immutable voice selection for a single request; path is the .onnx model
+VoiceSpec = namedtuple('VoiceSpec', ['language', 'name', 'path'])
+
+def voice_sample_rate(config):
+    """Sample rate declared in a voice's model.onnx.json"""
+    return config.get('audio', {}).get('sample_rate', 22050)
+
 class PiperTTS:
-    def __init__(self, default_language="English"):
+    def __init__(self, default_language="English", pool_size=PIPER_POOL_SIZE, timeout=PIPER_TIMEOUT,
+                 cache_dir=CACHE_DIR, cache_max_bytes=CACHE_MAX_BYTES,
+                 segment_cache_max_bytes=SEGMENT_CACHE_MAX_BYTES, backend=BACKEND, warm_up=WARM_UP):
         self.system = platform.system().lower()
         self.base_path = Path(__file__).parent
         self.default_language = default_language  # User configurable default language (full name)
@@ -31,45 +106,113 @@ class PiperTTS:
         else:
             self.piper_path = self.base_path / "piper-linux" / "piper"
             self.voice_base_path = self.base_path / "piper-linux" / "voices"
+        if PIPER_PATH:
+            self.piper_path = Path(PIPER_PATH)
+        if VOICES_DIR:
+            self.voice_base_path = Path(VOICES_DIR)
         
-        self.available_languages = self._get_available_languages()
-        self.available_voices = self._get_available_voices()
-        self.current_language = None
-        self.current_voice = None
+        self._default_voice = None
+        # Voices are indexed once and then kept current by a background watcher
+        self.registry = VoiceRegistry(self.voice_base_path, index_path=VOICE_INDEX_PATH,
+                                      reload_interval=VOICE_RELOAD_INTERVAL,
+                                      on_change=self._on_voices_changed)
+        self.language_detector = self._build_language_detector(self.registry.index)
+        self.registry.start_watching()
+        # Server-wide default voice, swapped atomically as a whole VoiceSpec
         self._set_default_language_and_voice()
+        
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.onnx = None
+        if backend == 'onnx':
+            phoneme_cache = None
+            if PHONEME_CACHE_SIZE > 0:
+                phoneme_cache = PhonemeCache(PHONEME_CACHE_SIZE, disk_dir=PHONEME_CACHE_DIR or None,
+                                             max_disk_entries=PHONEME_CACHE_DISK_ENTRIES)
+            try:
+                self.onnx = OnnxEngine(intra_op_threads=ONNX_INTRA_OP_THREADS,
+                                       inter_op_threads=ONNX_INTER_OP_THREADS,
+                                       espeak_data_path=self._espeak_data_path(),
+                                       load_config=self.get_voice_config,
+                                       max_batch_size=ONNX_BATCH_SIZE, max_batch_delay=ONNX_BATCH_DELAY,
+                                       batch_workers=max(1, pool_size), phoneme_cache=phoneme_cache)
+            except ImportError as e:
+                print(f"Warning: ONNX backend not available ({e}); falling back to the piper binary")
+        
+        self.pool = None
+        if self.onnx is None and pool_size > 0 and self.piper_path.exists():
+            self.pool = PiperPool(self.piper_path, size=pool_size, timeout=timeout,
+                                  health_interval=PIPER_HEALTH_INTERVAL)
+            self.pool.start_health_checks()
+        
+        self.cache = None
+        if cache_max_bytes > 0:
+            self.cache = SynthesisCache(cache_dir, max_bytes=cache_max_bytes)
+        self.segment_cache = None
+        if segment_cache_max_bytes > 0:
+            self.segment_cache = SynthesisCache(Path(cache_dir) / 'segments', max_bytes=segment_cache_max_bytes)
+        self._voice_configs = {}
+        self._piper_version = None
+        
+        # Threads that drive segment synthesis; the real work happens in Piper processes
+        # or in onnxruntime, which releases the GIL while a session runs
+        self.executor = ThreadPoolExecutor(max_workers=max(4, pool_size * 4),
+                                           thread_name_prefix='kasanoma-synth')
+        if warm_up:
+            self.executor.submit(self.warm_up)
     
-    def _get_available_languages(self):
-        """Get list of available languages from folder structure"""
-        languages = {}
-        if self.voice_base_path.exists():
-            # Look for language folders (using full names)
-            for lang_dir in self.voice_base_path.iterdir():
-                if lang_dir.is_dir():
-                    # Check if directory contains .onnx files
-                    onnx_files = list(lang_dir.glob("*.onnx"))
-                    if onnx_files:
-                        folder_name = lang_dir.name
-                        # Normalize folder name for consistent display
-                        display_name = folder_name.replace('_', ' ').replace('-', ' ').title()
-                        
-                        languages[folder_name] = {
-                            'folder_name': folder_name,
-                            'display_name': display_name,
-                            'path': str(lang_dir),
-                            'voice_count': len(onnx_files)
-                        }
-            
-            # Also check for voices directly in the voices folder (backward compatibility)
-            direct_voices = list(self.voice_base_path.glob("*.onnx"))
-            if direct_voices and 'Default' not in languages:
-                languages['Default'] = {
-                    'folder_name': 'Default',
-                    'display_name': 'Default',
-                    'path': str(self.voice_base_path),
-                    'voice_count': len(direct_voices)
-                }
-        
-        return languages
+    def warm_up(self):
+        """Start the default voice's Piper worker, or load its ONNX session, ahead of the first request"""
+        voice = self._default_voice
+        if voice is None:
+            return
+        try:
+            if self.pool is not None:
+                self.pool.warm_up([voice.path])
+            elif self.onnx is not None:
+                self.onnx.load_voice(voice.path)
+        except Exception as e:
+            print(f"Warning: could not warm up {voice.path}: {e}")
+    
+    def _espeak_data_path(self):
+        """espeak-ng data shipped next to the piper binary, if any"""
+        path = self.piper_path.parent / "espeak-ng-data"
+        return path if path.exists() else None
+    
+    @property
+    def backend_ready(self):
+        """Whether synthesis can run at all"""
+        return self.onnx is not None or self.piper_path.exists()
+    
+    @property
+    def concurrency(self):
+        """Utterances of one voice that can be synthesized at the same time"""
+        if self.pool is not None:
+            return self.pool.size
+        if self.onnx is not None:
+            return max(1, self.pool_size)
+        return 1
+    
+    @property
+    def available_languages(self):
+        """Languages with at least one voice, keyed by folder name"""
+        return self.registry.index.languages
+    
+    @property
+    def available_voices(self):
+        """Voices organized by language folder name"""
+        return self.registry.index.voices
+    
+    def _build_language_detector(self, index):
+        """Build trigram profiles for the installed languages"""
+        return LanguageDetector({name: info['path'] for name, info in index.languages.items()})
+    
+    def _on_voices_changed(self, index):
+        """Keep the default voice and language detector in line with the installed voices"""
+        self.language_detector = self._build_language_detector(index)
+        spec = self._default_voice
+        if spec is None or spec.path not in index.by_path:
+            self._set_default_language_and_voice()
     
     def _get_language_display_name(self, lang_code):
         """Convert language code to display name"""
@@ -148,154 +291,184 @@ class PiperTTS:
         # If not found, return a formatted version of the code
         return lang_code.replace('-', ' ').replace('_', ' ').title()
     
-    def _get_available_voices(self):
-        """Get list of available voice models organized by language"""
-        voices_by_language = {}
-        
-        for folder_name, lang_info in self.available_languages.items():
-            voice_path = Path(lang_info['path'])
-            voices = []
-            
-            for voice_file in voice_path.glob("*.onnx"):
-                voice_name = voice_file.stem
-                voices.append({
-                    'name': voice_name,
-                    'path': str(voice_file),
-                    'display_name': voice_name.replace('_', ' ').replace('-', ' ').title(),
-                    'language': folder_name
-                })
-            
-            if voices:
-                voices_by_language[folder_name] = voices
-        
-        return voices_by_language
+    @property
+    def current_language(self):
+        """Language of the server-wide default voice"""
+        spec = self._default_voice
+        return spec.language if spec else None
+    
+    @property
+    def current_voice(self):
+        """Model path of the server-wide default voice"""
+        spec = self._default_voice
+        return spec.path if spec else None
     
     def _set_default_language_and_voice(self):
         """Set the default language and voice"""
+        language = None
         # Try to set the user-specified default language
         if self.default_language in self.available_languages and self.default_language in self.available_voices:
-            self.current_language = self.default_language
+            language = self.default_language
         # Fallback to English if available
         elif 'English' in self.available_languages and 'English' in self.available_voices:
-            self.current_language = 'English'
+            language = 'English'
         # Fallback to first available language
         elif self.available_voices:
-            self.current_language = list(self.available_voices.keys())[0]
+            language = list(self.available_voices.keys())[0]
         
         # Set default voice for the selected language
-        if self.current_language and self.current_language in self.available_voices:
-            if self.available_voices[self.current_language]:
-                self.current_voice = self.available_voices[self.current_language][0]['path']
+        self._default_voice = self.resolve_voice(language=language) if language else None
+    
+    def _spec_for(self, voice):
+        """Build a VoiceSpec from a voice entry"""
+        return VoiceSpec(voice['language'], voice['name'], voice['path'])
+    
+    def resolve_voice(self, language=None, voice_name=None):
+        """Resolve a language and/or voice name to a VoiceSpec without changing any state"""
+        index = self.registry.index
+        if language and language not in index.voices:
+            return None
+        
+        if voice_name or language:
+            voice = index.voice(language, voice_name)
+            return self._spec_for(voice) if voice else None
+        
+        return self._default_voice
+    
+    def select_voice(self, text, language=None, voice_name=None, auto_detect_language=False):
+        """Pick the voice for one request; returns None if the selection is invalid"""
+        spec = self.resolve_voice(language, voice_name)
+        if spec is None:
+            return None
+        
+        # Auto-detect only overrides the language, never an explicitly requested voice
+        if auto_detect_language and not voice_name:
+            detected_lang = self.detect_text_language(text, fallback=spec.language)
+            if detected_lang != spec.language and detected_lang in self.available_voices:
+                spec = self.resolve_voice(language=detected_lang) or spec
+        return spec
     
     def set_language(self, language_name):
-        """Set the language to use for TTS"""
-        if language_name in self.available_voices:
-            self.current_language = language_name
-            # Set the first voice in the language as current voice
-            if self.available_voices[language_name]:
-                self.current_voice = self.available_voices[language_name][0]['path']
-                return True
-        return False
+        """Set the server-wide default language"""
+        spec = self.resolve_voice(language=language_name) if language_name else None
+        if spec is None:
+            return False
+        self._default_voice = spec
+        return True
     
     def set_voice(self, voice_name, language_name=None):
-        """Set the voice to use for TTS"""
-        # If language is specified, look only in that language
-        if language_name:
-            if language_name in self.available_voices:
-                for voice in self.available_voices[language_name]:
-                    if voice['name'] == voice_name:
-                        self.current_language = language_name
-                        self.current_voice = voice['path']
-                        return True
-        else:
-            # Search across all languages
-            for lang_name, voices in self.available_voices.items():
-                for voice in voices:
-                    if voice['name'] == voice_name:
-                        self.current_language = lang_name
-                        self.current_voice = voice['path']
-                        return True
-        return False
+        """Set the server-wide default voice"""
+        spec = self.resolve_voice(language=language_name, voice_name=voice_name) if voice_name else None
+        if spec is None:
+            return False
+        self._default_voice = spec
+        return True
     
     def get_voices_for_language(self, language_name):
         """Get voices available for a specific language"""
         return self.available_voices.get(language_name, [])
     
-    def detect_text_language(self, text):
-        """Basic text language detection based on character sets and return folder name"""
-        # Simple language detection - can be enhanced with proper language detection libraries
-        
-        # Count character frequencies for different scripts
-        latin_chars = len(re.findall(r'[a-zA-ZÀ-ÿ]', text))
-        cyrillic_chars = len(re.findall(r'[а-яё]', text, re.IGNORECASE))
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        japanese_chars = len(re.findall(r'[\u3040-\u309f\u30a0-\u30ff]', text))
-        korean_chars = len(re.findall(r'[\uac00-\ud7af]', text))
-        arabic_chars = len(re.findall(r'[\u0600-\u06ff]', text))
-        thai_chars = len(re.findall(r'[\u0e00-\u0e7f]', text))
-        
-        total_chars = len(re.sub(r'\s+', '', text))
-        
-        if total_chars == 0:
-            return self.current_language or self.default_language
-        
-        # Determine script based on character frequency and match to available folder names
-        detected_script = None
-        if chinese_chars / total_chars > 0.3:
-            detected_script = 'Chinese'
-        elif japanese_chars / total_chars > 0.1:
-            detected_script = 'Japanese'
-        elif korean_chars / total_chars > 0.3:
-            detected_script = 'Korean'
-        elif cyrillic_chars / total_chars > 0.3:
-            detected_script = 'Russian'
-        elif arabic_chars / total_chars > 0.3:
-            detected_script = 'Arabic'
-        elif thai_chars / total_chars > 0.3:
-            detected_script = 'Thai'
-        elif latin_chars / total_chars > 0.3:
-            detected_script = 'English'  # Default for Latin script
-        
-        # Check if detected language folder exists
-        if detected_script and detected_script in self.available_languages:
-            return detected_script
-        
-        # If no specific script detected or folder doesn't exist, use current language
-        return self.current_language or self.default_language
-    
-    def text_to_speech(self, text, output_path, auto_detect_language=False):
-        """Convert text to speech using Piper TTS"""
-        if not self.current_voice:
+    def detect_text_language(self, text, fallback=None):
+        """Detect the language of a text and return its folder name
+        
+        Only a bounded sample of the text is inspected, so this stays cheap
+        for whole documents.
+        """
+        with metrics.stage('language_detection'):
+            detected = self.language_detector.detect(text)
+        if detected and detected in self.available_languages:
+            return detected
+        
+        # If no language was detected or its folder doesn't exist, use current language
+        return fallback or self.current_language or self.default_language
+    
+    def text_to_speech(self, text, output_path, auto_detect_language=False, voice=None):
+        """Convert text to speech using Piper TTS
+        
+        voice is a VoiceSpec chosen for this request; the engine itself is never
+        mutated here, so concurrent requests with different voices are safe.
+        """
+        if voice is None:
+            voice = self.select_voice(text, auto_detect_language=auto_detect_language)
+        if not voice:
             return False, "No voice selected"
         
-        if not self.piper_path.exists():
+        if not self.backend_ready:
             return False, f"Piper executable not found at {self.piper_path}"
         
-        # Auto-detect language if requested
-        if auto_detect_language:
-            detected_lang = self.detect_text_language(text)
-            if detected_lang != self.current_language and detected_lang in self.available_languages:
-                self.set_language(detected_lang)
+        output_file = Path(output_path)
+        
+        # Serve repeated prompts straight from the cache
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self._cache_key(text, voice.path)
+            if self.cache.get(cache_key, output_file):
+                return True, str(output_file)
+        
+        success, result = self._synthesize(voice.path, text, output_file)
+        if success and cache_key is not None:
+            with metrics.stage('file_write'):
+                self.cache.put(cache_key, output_file)
+        return success, result
+    
+    def _voice_label(self, voice_path):
+        """Short language/name label of a voice for metrics"""
+        voice = self.registry.index.by_path.get(voice_path)
+        if voice is None:
+            return Path(voice_path).stem
+        return f"{voice['language']}/{voice['name']}"
+    
+    def _synthesize(self, voice_path, text, output_file):
+        """Synthesize one utterance to a file, recording timing and audio length"""
+        started = time.perf_counter()
+        success, result = self._run_backend(voice_path, text, output_file)
+        self._record_result(voice_path, output_file, success, result, time.perf_counter() - started)
+        return success, result
+    
+    def _record_result(self, voice_path, output_file, success, result, seconds):
+        """Account a finished synthesis call in the metrics"""
+        if not success:
+            metrics.record_failure(result)
+            return
+        try:
+            with wave.open(str(output_file), 'rb') as wav_file:
+                audio_seconds = wav_file.getnframes() / wav_file.getframerate()
+        except (OSError, wave.Error, ZeroDivisionError):
+            audio_seconds = 0.0
+        metrics.record_synthesis(self._voice_label(voice_path), seconds, audio_seconds)
+    
+    def _piper_command(self, voice_path, output_file):
+        """Command line of a one-off Piper process writing output_file"""
+        return [
+            str(self.piper_path),
+            "--model", voice_path,
+            "--output_file", str(output_file)
+        ]
+    
+    def timeout_for(self, text):
+        """Seconds allowed to synthesize text, growing with its length"""
+        return self.timeout + TIMEOUT_PER_CHAR * len(text)
+    
+    def _run_backend(self, voice_path, text, output_file):
+        """Run Piper for one utterance, in-process or via the worker pool when enabled"""
+        if self.onnx is not None:
+            with metrics.stage('synthesis'):
+                return self.onnx.synthesize(voice_path, text, output_file)
+        
+        # Reuse a persistent worker so the voice is only loaded once
+        if self.pool is not None:
+            return self.pool.synthesize(voice_path, text, output_file, timeout=self.timeout_for(text))
         
         try:
-            # Create temporary output file
-            output_file = Path(output_path)
-            
-            # Build command
-            cmd = [
-                str(self.piper_path),
-                "--model", self.current_voice,
-                "--output_file", str(output_file)
-            ]
-            
-            # Run Piper TTS
-            result = subprocess.run(
-                cmd,
-                input=text,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            # Run Piper TTS; a fresh process loads the model every time
+            with metrics.stage('synthesis'):
+                result = subprocess.run(
+                    self._piper_command(voice_path, output_file),
+                    input=text,
+                    capture_output=True,
+                    text=True,
+                    timeout=self.timeout_for(text)
+                )
             
             if result.returncode == 0 and output_file.exists():
                 return True, str(output_file)
@@ -306,11 +479,542 @@ class PiperTTS:
             return False, "TTS operation timed out"
         except Exception as e:
             return False, f"TTS error: {str(e)}"
+    
+    def get_voice_config(self, voice_path):
+        """Get the parsed model.onnx.json of a voice from the registry"""
+        config = self.registry.index.configs.get(voice_path)
+        if config is None:
+            config = self._voice_configs.get(voice_path)
+        if config is None:
+            # Voices outside the indexed tree are read once and memoized
+            config = read_voice_config(f"{voice_path}.json")
+            self._voice_configs[voice_path] = config
+        return config
+    
+    def get_piper_version(self):
+        """Get the Piper binary version, falling back to its size and mtime"""
+        if self._piper_version is None:
+            version = ''
+            try:
+                result = subprocess.run([str(self.piper_path), "--version"],
+                                        capture_output=True, text=True, timeout=10)
+                version = result.stdout.strip()
+            except Exception:
+                pass
+            if not version and self.piper_path.exists():
+                stat = self.piper_path.stat()
+                version = f"{stat.st_size}-{int(stat.st_mtime)}"
+            self._piper_version = version
+        return self._piper_version
+    
+    def _cache_key(self, text, voice_path):
+        """Build the synthesis cache key for text spoken by a voice"""
+        config = self.get_voice_config(voice_path)
+        inference = {
+            'inference': config.get('inference', {}),
+            'sample_rate': config.get('audio', {}).get('sample_rate'),
+            'model_piper_version': config.get('piper_version')
+        }
+        version = self.onnx.version if self.onnx is not None else self.get_piper_version()
+        return SynthesisCache.make_key(text, voice_path, inference, version)
+    
+    def _synthesize_segment(self, text, voice):
+        """Synthesize one segment and return (success, (params, pcm) or error)
+        
+        Segments are cached on their own, keyed by their text and voice, so a
+        document that differs from an earlier one in a few sentences only
+        synthesizes those sentences and splices in the rest.
+        """
+        cache_key = None
+        if self.segment_cache is not None:
+            cache_key = self._cache_key(text, voice.path)
+            data = self.segment_cache.read(cache_key)
+            if data is not None:
+                return True, read_wav(io.BytesIO(data))
+        if self.onnx is not None:
+            success, result = self._synthesize_segment_pcm(text, voice)
+        else:
+            success, result = self._synthesize_segment_file(text, voice)
+        if success and cache_key is not None:
+            with metrics.stage('file_write'):
+                self.segment_cache.put_bytes(cache_key, wav_bytes(*result))
+        return success, result
+    
+    def _synthesize_segment_file(self, text, voice):
+        """Synthesize one segment with Piper through a temporary file"""
+        if not self.backend_ready:
+            return False, f"Piper executable not found at {self.piper_path}"
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
+            segment_path = tmp_file.name
+        try:
+            success, result = self._synthesize(voice.path, text, Path(segment_path))
+            if not success:
+                return False, result
+            return True, read_wav(segment_path)
+        except Exception as e:
+            return False, f"TTS error: {str(e)}"
+        finally:
+            try:
+                os.unlink(segment_path)
+            except OSError:
+                pass
+    
+    def _synthesize_segment_pcm(self, text, voice):
+        """Synthesize one segment in-process, keeping its audio in memory"""
+        try:
+            started = time.perf_counter()
+            with metrics.stage('synthesis'):
+                audio, sample_rate = self.onnx.synthesize_pcm(voice.path, text)
+            pcm = audio.tobytes()
+            params = pcm_params(sample_rate, pcm)
+            metrics.record_synthesis(self._voice_label(voice.path), time.perf_counter() - started,
+                                     params.nframes / sample_rate)
+            return True, (params, pcm)
+        except Exception as e:
+            self.onnx.failures += 1
+            metrics.record_failure(e)
+            return False, f"TTS error: {str(e)}"
+    
+    def synthesize_segments(self, segments, voice, lookahead=2):
+        """Yield (success, (params, pcm) or error) for each segment, in order
+        
+        Up to lookahead segments are synthesized ahead of the consumer so the
+        next sentence is usually ready by the time the current one is sent.
+        """
+        segments = iter(segments)
+        pending = deque()
+        
+        def submit_next():
+            for segment in segments:
+                # Run in a copy of the caller's context so stage timings reach its request
+                pending.append(self.executor.submit(contextvars.copy_context().run,
+                                                    self._synthesize_segment, segment, voice))
+                return
+        
+        try:
+            for _ in range(max(1, lookahead)):
+                submit_next()
+            while pending:
+                result = pending.popleft().result()
+                submit_next()
+                yield result
+        finally:
+            # The client went away or a segment failed: drop queued work
+            for future in pending:
+                future.cancel()
+    
+    def batch_to_speech(self, items, admit=None):
+        """Synthesize many (text, voice, output_path) items, yielding (index, success, result) as each finishes
+        
+        Items are grouped by voice. With the worker pool or onnxruntime each
+        item is submitted on its own and each voice's group shares its loaded
+        workers; one-off Piper runs would load the voice for every item, so
+        there each group goes through a single Piper process instead.
+        
+        admit(voice), if given, is called before each item (or group) is
+        started and returns the function that releases its slot; when it
+        raises Overloaded those items fail with its message.
+        """
+        groups = {}
+        for index, (text, voice, output_path) in enumerate(items):
+            groups.setdefault(voice.path, []).append((index, text, voice, output_path))
+        
+        if self.pool is None and self.onnx is None:
+            units = [(self._synthesize_group, (group,), group) for group in groups.values()]
+        else:
+            units = [(self._synthesize_batch_item, item, [item]) for group in groups.values() for item in group]
+        
+        futures = set()
+        try:
+            for function, args, unit_items in units:
+                # Hand back what has finished while later items wait for a slot
+                done = {future for future in futures if future.done()}
+                futures -= done
+                for future in done:
+                    yield from future.result()
+                
+                release = None
+                if admit is not None:
+                    try:
+                        release = admit(unit_items[0][2])
+                    except Overloaded as e:
+                        for index, *_ in unit_items:
+                            yield index, False, str(e)
+                        continue
+                future = self.executor.submit(contextvars.copy_context().run, function, *args)
+                if release is not None:
+                    future.add_done_callback(lambda _, release=release: release())
+                futures.add(future)
+            for future in as_completed(futures):
+                futures.discard(future)
+                yield from future.result()
+        finally:
+            # The client went away: drop items that have not started
+            for future in futures:
+                future.cancel()
+    
+    def _synthesize_batch_item(self, index, text, voice, output_path):
+        try:
+            success, result = self.text_to_speech(text, output_path, voice=voice)
+        except Exception as e:
+            success, result = False, f"TTS error: {str(e)}"
+        return [(index, success, result)]
+    
+    def _synthesize_group(self, group):
+        """Synthesize the items of one voice with a single temporary Piper process"""
+        results = []
+        worker = None
+        work_dir = tempfile.mkdtemp(prefix='kasanoma-batch-')
+        try:
+            for index, text, voice, output_path in group:
+                output_file = Path(output_path)
+                cache_key = None
+                if self.cache is not None:
+                    cache_key = self._cache_key(text, voice.path)
+                    if self.cache.get(cache_key, output_file):
+                        results.append((index, True, str(output_file)))
+                        continue
+                
+                started = time.perf_counter()
+                try:
+                    if worker is None or not worker.is_alive():
+                        # A timed-out worker is stopped; carry on with a fresh one
+                        if worker is not None:
+                            worker.stop()
+                        worker = PiperWorker(self.piper_path, voice.path, work_dir)
+                    stage = 'model_load' if worker.served_since_start == 0 else 'synthesis'
+                    with metrics.stage(stage):
+                        success, result = worker.synthesize(text, output_file, timeout=self.timeout_for(text))
+                except Exception as e:
+                    success, result = False, f"TTS error: could not start Piper ({e})"
+                self._record_result(voice.path, output_file, success, result, time.perf_counter() - started)
+                if success and cache_key is not None:
+                    with metrics.stage('file_write'):
+                        self.cache.put(cache_key, output_file)
+                results.append((index, success, result))
+        finally:
+            if worker is not None:
+                worker.stop()
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return results
+    
+    def _run_in_executor(self, fn, *args, **kwargs):
+        """Run a blocking call on the synthesis executor from the event loop, in the caller's context"""
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return asyncio.get_running_loop().run_in_executor(self.executor, call)
+    
+    async def text_to_speech_async(self, text, output_path, voice, process_limit=None):
+        """text_to_speech for the event loop
+        
+        Waiting for synthesis holds no thread: one-off Piper processes run as
+        asyncio subprocesses, at most process_limit (a Semaphore) at a time,
+        and calls into the worker pool or onnxruntime queue up for the fixed
+        size synthesis executor.
+        """
+        if self.pool is not None or self.onnx is not None or not self.backend_ready:
+            return await self._run_in_executor(self.text_to_speech, text, output_path, voice=voice)
+        
+        output_file = Path(output_path)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = await self._run_in_executor(self._cache_key, text, voice.path)
+            if await self._run_in_executor(self.cache.get, cache_key, output_file):
+                return True, str(output_file)
+        
+        started = time.perf_counter()
+        if process_limit is None:
+            success, result = await self._run_piper_async(voice.path, text, output_file)
+        else:
+            async with process_limit:
+                success, result = await self._run_piper_async(voice.path, text, output_file)
+        self._record_result(voice.path, output_file, success, result, time.perf_counter() - started)
+        if success and cache_key is not None:
+            with metrics.stage('file_write'):
+                await self._run_in_executor(self.cache.put, cache_key, output_file)
+        return success, result
+    
+    async def _run_piper_async(self, voice_path, text, output_file):
+        """Run a one-off Piper process as an asyncio subprocess"""
+        try:
+            with metrics.stage('synthesis'):
+                process = await asyncio.create_subprocess_exec(
+                    *self._piper_command(voice_path, output_file),
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                try:
+                    _, stderr = await asyncio.wait_for(process.communicate(text.encode('utf-8')),
+                                                       timeout=self.timeout_for(text))
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    return False, "TTS operation timed out"
+            
+            if process.returncode == 0 and output_file.exists():
+                return True, str(output_file)
+            return False, f"TTS failed: {stderr.decode('utf-8', 'replace')}"
+        except Exception as e:
+            return False, f"TTS error: {str(e)}"
+    
+    async def synthesize_segments_async(self, segments, voice, lookahead=2):
+        """Async counterpart of synthesize_segments, awaiting segments on the event loop"""
+        segments = iter(segments)
+        pending = deque()
+        
+        def submit_next():
+            for segment in segments:
+                pending.append(self._run_in_executor(self._synthesize_segment, segment, voice))
+                return
+        
+        try:
+            for _ in range(max(1, lookahead)):
+                submit_next()
+            while pending:
+                result = await pending.popleft()
+                submit_next()
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    def document_to_speech(self, text, output_path, voice, segment_silence=SEGMENT_SILENCE,
+                           parallelism=None, progress=None, fraction_read=None):
+        """Convert a long text by synthesizing its sentences in parallel
+        
+        text is an iterable of text chunks (pages, paragraphs) that is
+        consumed lazily, so documents never need to be held in memory whole.
+        Segments are spread over the voice's Piper workers and stitched back
+        together in order into a single WAV, with segment_silence seconds of
+        silence between them. Each segment gets the normal per-call timeout.
+        Repeated documents are served sentence by sentence from the segment
+        cache rather than as a whole.
+        
+        progress(done, total) is called after each segment; returning False
+        stops the conversion. total is estimated from fraction_read(), the
+        share of the source consumed so far.
+        """
+        if not self.backend_ready:
+            return False, f"Piper executable not found at {self.piper_path}"
+        
+        output_file = Path(output_path)
+        segments = iter_sentences(text)
+        
+        # Keep every worker of the voice busy, plus one segment queued behind them
+        if parallelism is None:
+            parallelism = self.concurrency + 1
+        chunks = self.synthesize_segments(segments, voice, lookahead=parallelism)
+        done = 0
+        try:
+            with open(output_file, 'wb') as raw_out, wave.open(raw_out, 'wb') as out:
+                gap = b''
+                for success, result in chunks:
+                    if not success:
+                        return False, f"Segment {done + 1}: {result}"
+                    params, pcm = result
+                    if done == 0:
+                        out.setnchannels(params.nchannels)
+                        out.setsampwidth(params.sampwidth)
+                        out.setframerate(params.framerate)
+                        gap = silence(params.framerate, segment_silence, params.nchannels, params.sampwidth)
+                    with metrics.stage('file_write'):
+                        if done > 0:
+                            out.writeframes(gap)
+                        out.writeframes(pcm)
+                    done += 1
+                    
+                    if progress is not None:
+                        estimate = None
+                        if fraction_read is not None and fraction_read() > 0:
+                            estimate = max(done, round(done / fraction_read()))
+                        if progress(done, estimate) is False:
+                            return False, "Conversion cancelled"
+                
+                if done == 0:
+                    # Nothing was synthesized; give the writer valid parameters to close with
+                    out.setnchannels(1)
+                    out.setsampwidth(2)
+                    out.setframerate(voice_sample_rate(self.get_voice_config(voice.path)))
+                    return False, "No text provided"
+        except ExtractionError as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"TTS error: {str(e)}"
+        finally:
+            chunks.close()
+        
+        if progress is not None:
+            progress(done, done)
+        return True, str(output_file)
+    
+    def shutdown(self):
+        """Stop any persistent Piper workers"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.onnx is not None:
+            self.onnx.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+# Generated audio is kept here for AUDIO_TTL seconds, within AUDIO_MAX_BYTES in total
+AUDIO_DIR = os.environ.get('KASANOMA_AUDIO_DIR', os.path.join(tempfile.gettempdir(), 'kasanoma-audio'))
+AUDIO_TTL = float(os.environ.get('KASANOMA_AUDIO_TTL', str(24 * 3600)))
+AUDIO_MAX_BYTES = int(os.environ.get('KASANOMA_AUDIO_MAX_BYTES', str(1024 * 1024 * 1024)))
+AUDIO_SWEEP_INTERVAL = float(os.environ.get('KASANOMA_AUDIO_SWEEP_INTERVAL', '300'))
+
+# Document types accepted by /api/upload and /api/jobs
+ALLOWED_EXTENSIONS = {'.txt', '.md', '.doc', '.docx', '.pdf'}
+
+# Worker processes for extracting large PDFs in parallel (0 extracts pages in the request thread)
+PDF_WORKERS = int(os.environ.get('KASANOMA_PDF_WORKERS', '0'))
+
+# Background document jobs; JOB_PARALLELISM leaves Piper workers free for interactive requests
+JOB_DIR = os.environ.get('KASANOMA_JOB_DIR', os.path.join(tempfile.gettempdir(), 'kasanoma-jobs'))
+JOB_WORKERS = int(os.environ.get('KASANOMA_JOB_WORKERS', '1'))
+JOB_QUEUE_SIZE = int(os.environ.get('KASANOMA_JOB_QUEUE_SIZE', '100'))
+JOB_PARALLELISM = int(os.environ.get('KASANOMA_JOB_PARALLELISM', str(max(1, PIPER_POOL_SIZE - 1))))
+
+# Admin endpoints are disabled unless a token is set; profiles of sampled requests go to PROFILE_DIR
+ADMIN_TOKEN = os.environ.get('KASANOMA_ADMIN_TOKEN', '')
+PROFILE_DIR = os.environ.get('KASANOMA_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'kasanoma-profiles'))
+
+# Endpoints whose responses carry a Server-Timing breakdown and may be profiled
+TIMED_ENDPOINTS = {'text_to_speech', 'text_to_speech_batch', 'upload_file'}
+
+# Synthesis requests running at once, in total and per voice; more wait in a bounded queue
+MAX_CONCURRENT = int(os.environ.get('KASANOMA_MAX_CONCURRENT', str(os.cpu_count() or 2)))
+MAX_CONCURRENT_PER_VOICE = int(os.environ.get('KASANOMA_MAX_CONCURRENT_PER_VOICE', str(max(1, PIPER_POOL_SIZE))))
+MAX_QUEUED = int(os.environ.get('KASANOMA_MAX_QUEUED', '32'))
+MAX_QUEUE_WAIT = float(os.environ.get('KASANOMA_MAX_QUEUE_WAIT', '15'))
+
+# Requests per minute per client address, with bursts of RATE_LIMIT_BURST (0 disables the limit)
+RATE_LIMIT = float(os.environ.get('KASANOMA_RATE_LIMIT', '0'))
+RATE_LIMIT_BURST = int(os.environ.get('KASANOMA_RATE_LIMIT_BURST', '20'))
+# /api/tts/batch is charged one request per item by its handler
+RATE_LIMITED_ENDPOINTS = {'text_to_speech', 'upload_file', 'create_job'}
+
+# Most items accepted by one /api/tts/batch request
+BATCH_MAX_ITEMS = int(os.environ.get('KASANOMA_BATCH_MAX_ITEMS', '100'))
+
+# Largest text accepted by /api/tts and largest upload, in megabytes (0 for no limit)
+MAX_TEXT_CHARS = int(os.environ.get('KASANOMA_MAX_TEXT_CHARS', '20000'))
+MAX_UPLOAD_MB = float(os.environ.get('KASANOMA_MAX_UPLOAD_MB', '100'))
 
 # Initialize TTS engine with configurable default language
 # Change this to your preferred default language (use full folder name)
 DEFAULT_LANGUAGE = "English"  # <-- CHANGE THIS TO SET YOUR DEFAULT LANGUAGE (e.g., "Spanish", "French", "German")
 tts_engine = PiperTTS(default_language=DEFAULT_LANGUAGE)
+atexit.register(tts_engine.shutdown)
+
+audio_store = AudioStore(AUDIO_DIR, ttl=AUDIO_TTL, max_bytes=AUDIO_MAX_BYTES,
+                         sweep_interval=AUDIO_SWEEP_INTERVAL)
+audio_store.sweep()
+audio_store.start_sweeper()
+
+profiler = RequestProfiler(PROFILE_DIR)
+
+admission = AdmissionController(MAX_CONCURRENT, MAX_CONCURRENT_PER_VOICE,
+                                max_queued=MAX_QUEUED, max_wait=MAX_QUEUE_WAIT)
+rate_limiter = RateLimiter(RATE_LIMIT / 60, RATE_LIMIT_BURST)
+if MAX_UPLOAD_MB > 0:
+    app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+def parse_auto_detect(form, language, voice):
+    """Read auto_detect_language from form data, defaulting on when no language or voice is given"""
+    if 'auto_detect_language' in form:
+        return form['auto_detect_language'].lower() == 'true'
+    return AUTO_DETECT_DEFAULT and not language and not voice
+
+def resolve_request_voice(text, language, voice, auto_detect):
+    """Resolve request parameters to a VoiceSpec, returning (spec, error)"""
+    if language and tts_engine.resolve_voice(language=language) is None:
+        return None, 'Invalid language'
+    
+    voice_spec = tts_engine.select_voice(text, language or None, voice or None, auto_detect)
+    if voice_spec is None:
+        return None, 'Invalid voice' if voice else 'No voice selected'
+    return voice_spec, None
+
+def overloaded_response(error):
+    """Fast rejection telling the client when to come back"""
+    metrics.REJECTED_REQUESTS.inc(reason=error.reason)
+    status_code = 429 if error.reason == 'rate_limited' else 503
+    return jsonify({'success': False, 'error': str(error)}), status_code, {'Retry-After': str(error.retry_after)}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+    if request.endpoint in TIMED_ENDPOINTS:
+        g.request_timings = metrics.start_request_timings()
+        g.profile = profiler.start(request.endpoint)
+
+@app.before_request
+def limit_request_rate():
+    if request.endpoint in RATE_LIMITED_ENDPOINTS:
+        try:
+            rate_limiter.check(request.remote_addr or 'unknown')
+        except Overloaded as e:
+            return overloaded_response(e)
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    metrics.REJECTED_REQUESTS.inc(reason='too_large')
+    return jsonify({'success': False, 'error': f'File too large, the limit is {MAX_UPLOAD_MB:g} MB'}), 413
+
+@app.after_request
+def mark_handler_done(response):
+    g.handler_done = time.perf_counter()
+    profile = g.pop('profile', None)
+    if profile is not None:
+        # The file name is for admins only; it is listed by /api/admin/profiler
+        app.logger.info("Profiled %s %s into %s", request.method, request.path, profiler.finish(profile))
+    timings = g.get('request_timings')
+    if timings is not None:
+        # Streamed responses only account for the work done before the first byte
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+@app.teardown_request
+def record_request_time(exc=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile)
+    if g.pop('request_timings', None) is not None:
+        metrics.end_request_timings()
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    now = time.perf_counter()
+    metrics.IN_FLIGHT.dec()
+    metrics.REQUEST_SECONDS.observe(now - started, endpoint=request.endpoint or 'unknown')
+    handler_done = g.pop('handler_done', None)
+    if handler_done is not None:
+        # Sending the body, which for streamed audio includes synthesis
+        metrics.STAGE_SECONDS.observe(now - handler_done, stage='response')
+
+def collect_cache_metrics():
+    """Refresh cache gauges from the caches' own counters"""
+    caches = {}
+    if tts_engine.cache is not None:
+        caches['synthesis'] = tts_engine.cache.stats()
+    if tts_engine.segment_cache is not None:
+        caches['segment'] = tts_engine.segment_cache.stats()
+    if tts_engine.onnx is not None and tts_engine.onnx.phoneme_cache is not None:
+        phoneme_stats = tts_engine.onnx.phoneme_cache.stats()
+        caches['phoneme'] = dict(phoneme_stats, hits=phoneme_stats['hits'] + phoneme_stats['disk_hits'])
+    for name, stats in caches.items():
+        metrics.CACHE_LOOKUPS.set(stats['hits'], cache=name, result='hit')
+        metrics.CACHE_LOOKUPS.set(stats['misses'], cache=name, result='miss')
+        metrics.CACHE_HIT_RATE.set(stats['hit_rate'], cache=name)
+
+metrics.REGISTRY.add_collector(collect_cache_metrics)
+
+def collect_admission_metrics():
+    stats = admission.stats()
+    metrics.ADMISSION_REQUESTS.set(stats['active'], state='active')
+    metrics.ADMISSION_REQUESTS.set(stats['queued'], state='queued')
+
+metrics.REGISTRY.add_collector(collect_admission_metrics)
 
 @app.route('/')
 def index():
@@ -360,49 +1064,252 @@ def set_language():
     else:
         return jsonify({'success': False, 'error': 'Invalid language'}), 400
 
-@app.route('/api/tts', methods=['POST'])
-def text_to_speech():
-    """Convert text to speech"""
-    data = request.get_json()
+TTSRequest = namedtuple('TTSRequest', ['text', 'voice', 'stream', 'audio_format'])
+
+def non_string_field(data, fields):
+    """Error message for the first of fields present in data that is not a string, or None"""
+    for field in fields:
+        if not isinstance(data.get(field, ''), str):
+            return f"'{field}' must be a string"
+    return None
+
+def parse_tts_request(data, stream=False):
+    """Validate a /api/tts body, returning (TTSRequest, None) or (None, (error, status code))"""
+    error = non_string_field(data, ('text', 'voice', 'language', 'format'))
+    if error:
+        return None, (error, 400)
     text = data.get('text', '').strip()
     voice = data.get('voice', '')
     language = data.get('language', '')
-    auto_detect = data.get('auto_detect_language', False)
+    auto_detect = data.get('auto_detect_language', AUTO_DETECT_DEFAULT and not language and not voice)
+    stream = data.get('stream', False) or stream
+    audio_format = data.get('format', 'wav')
     
     if not text:
-        return jsonify({'success': False, 'error': 'No text provided'}), 400
+        return None, ('No text provided', 400)
     
-    # Set language if specified
-    if language:
-        if not tts_engine.set_language(language):
-            return jsonify({'success': False, 'error': 'Invalid language'}), 400
+    if MAX_TEXT_CHARS and len(text) > MAX_TEXT_CHARS:
+        metrics.REJECTED_REQUESTS.inc(reason='too_large')
+        return None, (f'Text too long ({len(text)} characters, the limit is {MAX_TEXT_CHARS})', 413)
+    
+    if stream and audio_format not in ('wav', 'pcm'):
+        return None, ('Invalid format. Use: wav, pcm', 400)
     
-    # Set voice if specified
-    if voice:
-        if not tts_engine.set_voice(voice, language):
-            return jsonify({'success': False, 'error': 'Invalid voice'}), 400
+    # Pick the voice for this request only; the server default is left untouched
+    voice_spec, error = resolve_request_voice(text, language, voice, auto_detect)
+    if error:
+        return None, (error, 400)
+    return TTSRequest(text, voice_spec, stream, audio_format), None
+
+def tts_success(audio_file, voice_spec):
+    """Body of a successful /api/tts response"""
+    return {
+        'success': True,
+        'audio_file': audio_file,
+        'message': 'TTS conversion successful',
+        'language_used': voice_spec.language,
+        'voice_used': voice_spec.path
+    }
+
+def stream_headers(params, voice_spec):
+    """Headers of a streamed /api/tts response"""
+    return {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-Sample-Rate': str(params.framerate),
+        'X-Channels': str(params.nchannels),
+        'X-Sample-Width': str(params.sampwidth),
+        'X-Language-Used': voice_spec.language,
+        'X-Voice-Used': voice_spec.name
+    }
+
+@app.route('/api/tts', methods=['POST'])
+def text_to_speech():
+    """Convert text to speech"""
+    tts_request, error = parse_tts_request(request.get_json(), stream=request.args.get('stream') == '1')
+    if error:
+        message, status_code = error
+        return jsonify({'success': False, 'error': message}), status_code
+    text, voice_spec = tts_request.text, tts_request.voice
+    
+    try:
+        with metrics.stage('admission_wait'):
+            release = admission.acquire(voice_spec.path)
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    if tts_request.stream:
+        # The slot is held until the last byte of the stream has been sent
+        try:
+            response = app.make_response(stream_speech(text, voice_spec, tts_request.audio_format))
+        except Exception:
+            release()
+            raise
+        response.call_on_close(release)
+        return response
     
-    # Create temporary output file
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        output_path = tmp_file.name
+    # Reserve a file in the audio store
+    output_path = audio_store.new_path()
     
     try:
         # Convert text to speech
-        success, result = tts_engine.text_to_speech(text, output_path, auto_detect_language=auto_detect)
+        success, result = tts_engine.text_to_speech(text, output_path, voice=voice_spec)
         
         if success:
-            return jsonify({
-                'success': True,
-                'audio_file': result,
-                'message': 'TTS conversion successful',
-                'language_used': tts_engine.current_language,
-                'voice_used': tts_engine.current_voice
-            })
+            return jsonify(tts_success(result, voice_spec))
         else:
             return jsonify({'success': False, 'error': result}), 500
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        release()
+
+@app.route('/api/tts/batch', methods=['POST'])
+def text_to_speech_batch():
+    """Convert many short texts at once
+    
+    Returns a manifest of audio files, or with "format": "zip" or "tar" a
+    streamed archive of the audio plus manifest.json. An item that fails
+    is reported in the manifest without failing the others.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({'success': False, 'error': 'No items provided'}), 400
+    items = data['items']
+    if len(items) > BATCH_MAX_ITEMS:
+        metrics.REJECTED_REQUESTS.inc(reason='too_large')
+        return jsonify({'success': False,
+                        'error': f'Too many items ({len(items)}, the limit is {BATCH_MAX_ITEMS})'}), 413
+    try:
+        # Each item counts as one request, as if it had been sent to /api/tts
+        rate_limiter.check(request.remote_addr or 'unknown', cost=len(items))
+    except Overloaded as e:
+        return overloaded_response(e)
+    output_format = data.get('format', 'json')
+    if output_format != 'json' and output_format not in ARCHIVE_TYPES:
+        return jsonify({'success': False, 'error': f'Invalid format. Use: json, {", ".join(ARCHIVE_TYPES)}'}), 400
+    
+    # Invalid items are reported in the manifest; the rest are synthesized
+    manifest = []
+    accepted = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            manifest.append({'index': index, 'success': False, 'error': 'Item must be an object'})
+            continue
+        tts_request, error = parse_tts_request(dict(item, stream=False))
+        if error:
+            manifest.append({'index': index, 'success': False, 'error': error[0]})
+            continue
+        entry = {'index': index}
+        if 'id' in item:
+            entry['id'] = item['id']
+        manifest.append(entry)
+        accepted.append((entry, tts_request))
+    
+    if output_format == 'json':
+        outputs = [audio_store.new_path() for _ in accepted]
+        jobs = [(tts_request.text, tts_request.voice, output_path)
+                for (_, tts_request), output_path in zip(accepted, outputs)]
+        for position, success, result in tts_engine.batch_to_speech(jobs, admit=admit_batch_item):
+            entry, tts_request = accepted[position]
+            entry.update(batch_item_result(success, result, tts_request.voice))
+            if success:
+                entry['audio_file'] = result
+                entry['audio_url'] = f"/api/audio/{Path(result).name}"
+        return jsonify(batch_summary(manifest))
+    
+    def members():
+        work_dir = tempfile.mkdtemp(prefix='kasanoma-batch-')
+        jobs = [(tts_request.text, tts_request.voice, os.path.join(work_dir, f"{entry['index']:04d}.wav"))
+                for entry, tts_request in accepted]
+        results = tts_engine.batch_to_speech(jobs, admit=admit_batch_item)
+        try:
+            for position, success, result in results:
+                entry, tts_request = accepted[position]
+                entry.update(batch_item_result(success, result, tts_request.voice))
+                if success:
+                    entry['file'] = Path(result).name
+                    yield entry['file'], Path(result).read_bytes()
+                    os.unlink(result)
+            yield 'manifest.json', json.dumps(batch_summary(manifest), ensure_ascii=False, indent=2).encode('utf-8')
+        finally:
+            # Releases the slots of items still running once the client has gone
+            results.close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return Response(stream_archive(output_format, members()), mimetype=ARCHIVE_TYPES[output_format], headers={
+        'Content-Disposition': f'attachment; filename=kasanoma-batch.{output_format}',
+        'X-Accel-Buffering': 'no'
+    })
+
+def admit_batch_item(voice_spec):
+    """Admission slot for one batch item, under the same per-voice limit as /api/tts"""
+    with metrics.stage('admission_wait'):
+        return admission.acquire(voice_spec.path)
+
+def batch_item_result(success, result, voice_spec):
+    """Manifest fields for one synthesized batch item"""
+    if not success:
+        return {'success': False, 'error': result}
+    return {
+        'success': True,
+        'language_used': voice_spec.language,
+        'voice_used': voice_spec.path
+    }
+
+def batch_summary(manifest):
+    """Body of a /api/tts/batch manifest"""
+    succeeded = sum(1 for entry in manifest if entry.get('success'))
+    return {
+        'success': True,
+        'items': manifest,
+        'succeeded': succeeded,
+        'failed': len(manifest) - succeeded
+    }
+
+def stream_speech(text, voice_spec, audio_format='wav'):
+    """Stream audio sentence by sentence as each one finishes synthesizing"""
+    chunks = tts_engine.synthesize_segments(split_sentences(text), voice_spec)
+    
+    # Synthesize the first sentence before committing to a 200 response
+    success, first = next(chunks, (False, 'No text provided'))
+    if not success:
+        chunks.close()
+        return jsonify({'success': False, 'error': first}), 500
+    params, pcm = first
+    
+    def generate():
+        try:
+            if audio_format == 'wav':
+                yield wav_header(params.framerate, params.nchannels, params.sampwidth)
+            yield pcm
+            gap = silence(params.framerate, SEGMENT_SILENCE, params.nchannels, params.sampwidth)
+            for success, result in chunks:
+                if not success:
+                    # Headers are already sent; end the stream early
+                    app.logger.warning("Streaming TTS stopped: %s", result)
+                    break
+                yield gap + result[1]
+        finally:
+            chunks.close()
+    
+    return Response(generate(), mimetype='audio/wav' if audio_format == 'wav' else 'audio/L16',
+                    headers=stream_headers(params, voice_spec))
+
+def open_document(path, file_ext):
+    """Open a document on disk for streamed extraction, returning (success, DocumentText or error)"""
+    try:
+        return True, DocumentText(path, file_ext, pdf_workers=PDF_WORKERS)
+    except ExtractionError as e:
+        return False, str(e)
+
+def spool_upload(file, suffix):
+    """Save an uploaded file to a temporary file on disk instead of holding it in memory"""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp_file:
+        # Werkzeug copies the upload stream across in fixed-size blocks
+        file.save(tmp_file)
+        return tmp_file.name
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
@@ -413,79 +1320,157 @@ def upload_file():
     file = request.files['file']
     voice = request.form.get('voice', '')
     language = request.form.get('language', '')
-    auto_detect = request.form.get('auto_detect_language', 'false').lower() == 'true'
+    auto_detect = parse_auto_detect(request.form, language, voice)
     
     if file.filename == '':
         return jsonify({'success': False, 'error': 'No file selected'}), 400
     
     # Check file type
-    allowed_extensions = {'.txt', '.md', '.doc', '.docx', '.pdf'}
     file_ext = Path(file.filename).suffix.lower()
     
-    if file_ext not in allowed_extensions:
-        return jsonify({'success': False, 'error': f'File type {file_ext} not supported. Use: {", ".join(allowed_extensions)}'}), 400
+    if file_ext not in ALLOWED_EXTENSIONS:
+        return jsonify({'success': False, 'error': f'File type {file_ext} not supported. Use: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
     
+    upload_path = spool_upload(file, file_ext)
     try:
-        # Read file content
-        if file_ext == '.pdf':
-            try:
-                import PyPDF2
-                pdf_reader = PyPDF2.PdfReader(file)
-                content = ""
-                for page in pdf_reader.pages:
-                    content += page.extract_text() + "\n"
-            except ImportError:
-                return jsonify({'success': False, 'error': 'PDF support not available. Please install PyPDF2.'}), 400
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'PDF reading error: {str(e)}'}), 400
-        elif file_ext in {'.doc', '.docx'}:
-            try:
-                import docx
-                doc = docx.Document(file)
-                content = ""
-                for paragraph in doc.paragraphs:
-                    content += paragraph.text + "\n"
-            except ImportError:
-                return jsonify({'success': False, 'error': 'Word document support not available. Please install python-docx.'}), 400
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'Word document reading error: {str(e)}'}), 400
-        else:
-            # Text files
-            content = file.read().decode('utf-8')
-    
-        if not content.strip():
-            return jsonify({'success': False, 'error': 'File is empty'}), 400
+        # Text is extracted lazily, page by page, as synthesis consumes it
+        success, document = open_document(upload_path, file_ext)
+        if not success:
+            return jsonify({'success': False, 'error': document}), 400
         
-        # Set language if specified
-        if language:
-            if not tts_engine.set_language(language):
-                return jsonify({'success': False, 'error': 'Invalid language'}), 400
+        sample, content = peek_text(metrics.timed_iter(document, 'extraction'))
+        if not sample.strip():
+            return jsonify({'success': False, 'error': 'File is empty'}), 400
         
-        # Set voice if specified
-        if voice:
-            if not tts_engine.set_voice(voice, language):
-                return jsonify({'success': False, 'error': 'Invalid voice'}), 400
+        # Pick the voice for this request only; the server default is left untouched
+        voice_spec, error = resolve_request_voice(sample, language, voice, auto_detect)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        # Create temporary output file
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-            output_path = tmp_file.name
+        # Reserve a file in the audio store
+        output_path = audio_store.new_path()
         
-        # Convert text to speech
-        success, result = tts_engine.text_to_speech(content, output_path, auto_detect_language=auto_detect)
+        # Convert text to speech, sentence segments in parallel
+        with metrics.stage('admission_wait'):
+            release = admission.acquire(voice_spec.path)
+        try:
+            success, result = tts_engine.document_to_speech(content, output_path, voice_spec)
+        finally:
+            release()
         
         if success:
             return jsonify({
                 'success': True,
                 'audio_file': result,
                 'message': 'File converted to speech successfully',
-                'language_used': tts_engine.current_language,
-                'voice_used': tts_engine.current_voice
+                'language_used': voice_spec.language,
+                'voice_used': voice_spec.path
             })
         else:
             return jsonify({'success': False, 'error': result}), 500
             
+    except ExtractionError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': f'File processing error: {str(e)}'}), 500
+    finally:
+        os.unlink(upload_path)
+
+def job_response(job):
+    """Public view of a job record"""
+    total = job.get('segments_total')
+    done = job.get('segments_done', 0)
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job.get('filename'),
+        'segments_done': done,
+        'segments_total': total,
+        'progress': round(done / total, 3) if total else 0.0,
+        'eta_seconds': job.get('eta_seconds'),
+        'cancel_requested': job.get('cancel_requested', False),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error'],
+        'result': job['result']
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a document or text for background conversion"""
+    if 'file' in request.files:
+        file = request.files['file']
+        params = request.form
+        if file.filename == '':
+            return jsonify({'success': False, 'error': 'No file selected'}), 400
+        filename = file.filename
+        file_ext = Path(filename).suffix.lower()
+        if file_ext not in ALLOWED_EXTENSIONS:
+            return jsonify({'success': False, 'error': f'File type {file_ext} not supported. Use: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+        auto_detect = parse_auto_detect(params, params.get('language'), params.get('voice'))
+    else:
+        params = request.get_json(silent=True) or {}
+        if not isinstance(params, dict):
+            return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
+        error = non_string_field(params, ('text', 'language', 'voice'))
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        text = params.get('text', '').strip()
+        if not text:
+            return jsonify({'success': False, 'error': 'No file uploaded or text provided'}), 400
+        filename = None
+        file_ext = '.txt'
+        auto_detect = params.get('auto_detect_language',
+                                 AUTO_DETECT_DEFAULT and not params.get('language') and not params.get('voice'))
+    
+    language = params.get('language', '')
+    voice = params.get('voice', '')
+    if language and tts_engine.resolve_voice(language=language) is None:
+        return jsonify({'success': False, 'error': 'Invalid language'}), 400
+    if voice and tts_engine.resolve_voice(language=language or None, voice_name=voice) is None:
+        return jsonify({'success': False, 'error': 'Invalid voice'}), 400
+    
+    job = job_store.create(filename=filename, input_ext=file_ext, language=language,
+                           voice=voice, auto_detect_language=auto_detect)
+    input_path = job_store.input_path(job['id'], file_ext)
+    if filename is None:
+        input_path.write_text(text, encoding='utf-8')
+    else:
+        file.save(str(input_path))
+    
+    if not job_queue.submit(job['id']):
+        input_path.unlink()
+        job_store.update(job['id'], status=CANCELLED, error='Job queue is full', finished_at=time.time())
+        return jsonify({'success': False, 'error': 'Job queue is full, try again later'}), 503
+    
+    return jsonify({'success': True, **job_response(job)}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the progress of a background job"""
+    job = job_store.load(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, **job_response(job)})
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    job = job_store.load(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    job_store.request_cancel(job_id)
+    # Jobs still waiting in the queue are cancelled right away
+    if job['status'] == QUEUED and job_store.claim(job_id):
+        try:
+            job = job_store.update(job_id, status=CANCELLED, finished_at=time.time())
+        finally:
+            job_store.release(job_id)
+    return jsonify({'success': True, **job_response(job_store.load(job_id))})
 
 @app.route('/api/audio/<filename>')
 def get_audio(filename):
@@ -494,11 +1479,48 @@ def get_audio(filename):
     if not filename.endswith('.wav'):
         return jsonify({'error': 'Invalid file type'}), 400
     
-    file_path = Path(tempfile.gettempdir()) / filename
-    if file_path.exists():
-        return send_file(str(file_path), mimetype='audio/wav')
-    else:
+    # Only names issued by the audio store resolve, so nothing else on disk is reachable
+    file_path = audio_store.resolve(filename)
+    if file_path is None:
         return jsonify({'error': 'File not found'}), 404
+    
+    # Stored files never change, so clients may cache them until they expire.
+    # conditional=True answers Range requests with 206 and If-None-Match with 304.
+    response = send_file(str(file_path), mimetype='audio/wav', conditional=True, etag=True,
+                         max_age=int(AUDIO_TTL) if AUDIO_TTL else None)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if AUDIO_TTL:
+        response.headers['Cache-Control'] = f'public, max-age={int(AUDIO_TTL)}, immutable'
+    return response
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Expose metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def require_admin():
+    """Return an error response unless the request carries the admin token"""
+    if not ADMIN_TOKEN:
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    return None
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST'])
+def configure_profiler():
+    """Show or switch the sampling profiler for /api/tts and /api/upload"""
+    denied = require_admin()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.configure(bool(data.get('enabled', True)), mode=data.get('mode'),
+                               sample_rate=data.get('sample_rate'), count=data.get('count'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'profiler': profiler.stats()})
 
 @app.route('/api/status')
 def status():
@@ -512,12 +1534,62 @@ def status():
         'current_language': tts_engine.current_language,
         'current_voice': tts_engine.current_voice,
         'default_language': tts_engine.default_language,
-        'languages': tts_engine.available_languages
+        'languages': tts_engine.available_languages,
+        'voice_index_reloads': tts_engine.registry.reloads,
+        'piper_pool': tts_engine.pool.stats() if tts_engine.pool else None,
+        'onnx_backend': tts_engine.onnx.stats() if tts_engine.onnx else None,
+        'cache': tts_engine.cache.stats() if tts_engine.cache else None,
+        'segment_cache': tts_engine.segment_cache.stats() if tts_engine.segment_cache else None,
+        'admission': admission.stats(),
+        'queued_jobs': job_queue.qsize(),
+        'audio_store': audio_store.stats()
     })
 
+def run_document_job(job, report):
+    """Extract and synthesize the document of a background job"""
+    input_path = job_store.input_path(job['id'], job['input_ext'])
+    metrics.STAGE_SECONDS.observe(max(0.0, time.time() - job['created_at']), stage='job_queue_wait')
+    try:
+        success, document = open_document(input_path, job['input_ext'])
+        if not success:
+            return False, document
+        sample, content = peek_text(metrics.timed_iter(document, 'extraction'))
+        if not sample.strip():
+            return False, 'File is empty'
+        
+        voice_spec, error = resolve_request_voice(sample, job.get('language'), job.get('voice'),
+                                                  job.get('auto_detect_language', False))
+        if error:
+            return False, error
+        
+        output_path = audio_store.new_path()
+        success, result = tts_engine.document_to_speech(content, output_path, voice_spec,
+                                                        parallelism=JOB_PARALLELISM, progress=report,
+                                                        fraction_read=document.fraction_read)
+        if not success:
+            return False, result
+        return True, {
+            'audio_file': result,
+            'language_used': voice_spec.language,
+            'voice_used': voice_spec.path
+        }
+    finally:
+        try:
+            input_path.unlink()
+        except FileNotFoundError:
+            pass
+
+# Started last so resumed jobs never run before the helpers above exist
+# Finished jobs are forgotten when the audio they point to expires
+job_store = JobStore(JOB_DIR, ttl=AUDIO_TTL, sweep_interval=AUDIO_SWEEP_INTERVAL)
+job_store.sweep()
+job_store.start_sweeper()
+job_queue = JobQueue(job_store, run_document_job, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE)
+job_queue.resume()
+
 if __name__ == '__main__':
     # Check if Piper is available
-    if not tts_engine.piper_path.exists():
+    if not tts_engine.backend_ready:
         print(f"Warning: Piper executable not found at {tts_engine.piper_path}")
         print("Please ensure Piper is properly installed in the expected directory.")
     
@@ -536,6 +1608,8 @@ if __name__ == '__main__':
     print(f"Starting Kasanoma TTS Server...")
     print(f"System: {platform.system()}")
     print(f"Piper path: {tts_engine.piper_path}")
+    print(f"Synthesis backend: {'onnxruntime (in-process)' if tts_engine.onnx else 'piper binary'}")
+    print(f"Piper workers per voice: {tts_engine.pool.size if tts_engine.pool else 'disabled'}")
     print(f"Default language: {tts_engine.default_language}")
     print(f"Current language: {tts_engine.current_language}")
     print(f"Available languages: {len(tts_engine.available_languages)}")
@@ -0,0 +1,74 @@
+"""
+Streamed archives
+Builds a zip or tar archive incrementally, so a response can send each
+member as soon as it is ready without the archive ever being held whole
+in memory or written to disk.
+"""
+
+import io
+import tarfile
+import time
+import zipfile
+
+ARCHIVE_TYPES = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar'
+}
+
+
+class _Pipe(io.RawIOBase):
+    """Unseekable sink collecting whatever the archive writer has produced so far"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_archive(kind, members):
+    """Yield the bytes of a zip or tar archive of (name, data) members as they arrive
+
+    Audio barely compresses, so zip members are stored rather than deflated.
+    """
+    pipe = _Pipe()
+    if kind == 'zip':
+        archive = zipfile.ZipFile(pipe, mode='w', compression=zipfile.ZIP_STORED)
+
+        def add(name, data):
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            archive.writestr(info, data)
+    elif kind == 'tar':
+        archive = tarfile.open(fileobj=pipe, mode='w|', format=tarfile.USTAR_FORMAT)
+
+        def add(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            archive.addfile(info, io.BytesIO(data))
+    else:
+        raise ValueError(f"Invalid archive type. Use: {', '.join(ARCHIVE_TYPES)}")
+
+    members = iter(members)
+    try:
+        for name, data in members:
+            add(name, data)
+            chunk = pipe.drain()
+            if chunk:
+                yield chunk
+        archive.close()
+        yield pipe.drain()
+    finally:
+        # Stop the producer too when the client goes away mid-archive
+        close = getattr(members, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Kasanoma ASGI server
+Serves the same API as app.py from an event loop:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+POST /api/tts is answered natively. A request waiting for synthesis is a
+suspended coroutine rather than a blocked thread, so one process can hold
+hundreds of requests in flight while the synthesis itself runs in the
+fixed-size synthesis executor, or as asyncio subprocesses when the Piper
+worker pool is disabled. Requests take an admission slot first, so the
+same concurrency limits and bounded queue apply as under gunicorn. Every
+other route is the unchanged Flask app, each request run on its own thread
+from a pool of KASANOMA_ASYNC_WSGI_THREADS, as gunicorn's threads would.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+import app as server
+import metrics
+from admission import Overloaded
+from segmentation import split_sentences
+from wav_utils import wav_header, silence
+
+# Requests on /api/tts held at once before new ones are turned away with 503
+MAX_IN_FLIGHT = int(os.environ.get('KASANOMA_ASYNC_MAX_IN_FLIGHT', '1000'))
+# One-off Piper processes running at once when the worker pool is disabled
+MAX_PROCESSES = int(os.environ.get('KASANOMA_ASYNC_MAX_PROCESSES', str(os.cpu_count() or 2)))
+# Threads running the Flask routes other than POST /api/tts
+WSGI_THREADS = int(os.environ.get('KASANOMA_ASYNC_WSGI_THREADS', '8'))
+
+# Request bodies larger than this are spooled to a temporary file
+BODY_SPOOL_BYTES = 1024 * 1024
+
+
+async def read_body(receive, limit=None):
+    """Read a whole request body; returns None if the client went away"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit and size > limit:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+
+
+async def send_json(send, status_code, payload, headers=None):
+    """Send a JSON response the way Flask's jsonify would"""
+    body = (server.app.json.dumps(payload) + "\n").encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': encode_headers({'Content-Type': 'application/json', 'Content-Length': len(body),
+                                   **(headers or {})})
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_error(send, status_code, message, headers=None):
+    await send_json(send, status_code, {'success': False, 'error': message}, headers)
+
+
+async def send_overloaded(send, error):
+    metrics.REJECTED_REQUESTS.inc(reason=error.reason)
+    await send_error(send, 429 if error.reason == 'rate_limited' else 503, str(error),
+                     {'Retry-After': error.retry_after})
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope whose request body is in the file body"""
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The whole body is in the file, so chunked uploads without a Content-Length read to its end
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f"HTTP_{name}"
+        value = value.decode('latin-1')
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class ThreadedWsgi:
+    """ASGI wrapper running each request of a WSGI app on a thread from a bounded pool"""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='kasanoma-wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        with SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.run, wsgi_environ(scope, body), loop, send)
+
+    def run(self, environ, loop, send):
+        """Run the app on a pool thread, passing each message back to the event loop"""
+        response_start = None
+        started = False
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def write(data):
+            nonlocal started
+            if not started:
+                started = True
+                send_sync(response_start)
+            if data:
+                send_sync({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        def start_response(status, headers, exc_info=None):
+            nonlocal response_start
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            }
+            return write
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for data in result:
+                write(data)
+            write(b'')
+            send_sync({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Runs the response's close callbacks, such as releasing an admission slot
+            if hasattr(result, 'close'):
+                result.close()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncApp:
+    """ASGI application answering POST /api/tts on the event loop and the rest through Flask"""
+
+    def __init__(self, engine, wsgi_app):
+        self.engine = engine
+        self.fallback = ThreadedWsgi(wsgi_app, WSGI_THREADS)
+        self.in_flight = 0
+        self.process_limit = asyncio.Semaphore(MAX_PROCESSES)
+        # At most MAX_QUEUED requests wait inside acquire; the others return at once
+        self.admission_executor = ThreadPoolExecutor(max_workers=server.MAX_QUEUED + 4,
+                                                     thread_name_prefix='kasanoma-admission')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/api/tts':
+            await self.text_to_speech(scope, receive, send)
+        else:
+            await self.fallback(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.engine.shutdown()
+                self.fallback.shutdown()
+                self.admission_executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def acquire_slot(self, key):
+        """Wait for an admission slot without blocking the event loop; raises Overloaded"""
+        future = asyncio.get_running_loop().run_in_executor(self.admission_executor, server.admission.acquire, key)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The slot may still be granted after the request is gone; hand it straight back
+            future.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result()())
+            raise
+
+    async def text_to_speech(self, scope, receive, send):
+        """Convert text to speech"""
+        started = time.perf_counter()
+        self.in_flight += 1
+        metrics.IN_FLIGHT.inc()
+        # Each request runs in its own task, so these timings are its own
+        timings = metrics.start_request_timings()
+        try:
+            await self._text_to_speech(scope, receive, send, timings)
+        finally:
+            self.in_flight -= 1
+            metrics.IN_FLIGHT.dec()
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='text_to_speech')
+            metrics.end_request_timings()
+
+    async def _text_to_speech(self, scope, receive, send, timings):
+        try:
+            client = scope.get('client')
+            server.rate_limiter.check(client[0] if client else 'unknown')
+            if self.in_flight > MAX_IN_FLIGHT:
+                raise Overloaded("Server is busy, try again later", 1, 'queue_full')
+        except Overloaded as e:
+            await send_overloaded(send, e)
+            return
+
+        try:
+            body = await read_body(receive, server.app.config.get('MAX_CONTENT_LENGTH'))
+        except ValueError as e:
+            await send_error(send, 413, str(e))
+            return
+        if body is None:
+            return
+        try:
+            data = server.app.json.loads(body or b'null')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await send_error(send, 400, 'Request body must be a JSON object')
+            return
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        tts_request, error = server.parse_tts_request(data, stream=query.get('stream') == ['1'])
+        if error:
+            message, status_code = error
+            await send_error(send, status_code, message)
+            return
+
+        try:
+            with metrics.stage('admission_wait'):
+                release = await self.acquire_slot(tts_request.voice.path)
+        except Overloaded as e:
+            await send_overloaded(send, e)
+            return
+        try:
+            # The slot is held until the last byte of a stream has been sent
+            if tts_request.stream:
+                await self.stream_speech(receive, send, tts_request, timings)
+            else:
+                await self.synthesize_to_file(send, tts_request, timings)
+        finally:
+            release()
+
+    async def synthesize_to_file(self, send, tts_request, timings):
+        """Synthesize into the audio store and answer with its path"""
+        # Reserve a file in the audio store
+        output_path = server.audio_store.new_path()
+        try:
+            success, result = await self.engine.text_to_speech_async(tts_request.text, output_path,
+                                                                     tts_request.voice, self.process_limit)
+        except Exception as e:
+            await send_error(send, 500, str(e))
+            return
+        if not success:
+            await send_error(send, 500, result)
+            return
+        await send_json(send, 200, server.tts_success(result, tts_request.voice),
+                        {'Server-Timing': timings.server_timing()})
+
+    async def stream_speech(self, receive, send, tts_request, timings):
+        """Stream audio sentence by sentence as each one finishes synthesizing"""
+        chunks = self.engine.synthesize_segments_async(split_sentences(tts_request.text), tts_request.voice)
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            # Synthesize the first sentence before committing to a 200 response
+            try:
+                success, first = await chunks.__anext__()
+            except StopAsyncIteration:
+                success, first = False, 'No text provided'
+            if not success:
+                await send_error(send, 500, first)
+                return
+            params, pcm = first
+
+            audio_format = tts_request.audio_format
+            headers = server.stream_headers(params, tts_request.voice)
+            headers['Content-Type'] = 'audio/wav' if audio_format == 'wav' else 'audio/L16'
+            headers['Server-Timing'] = timings.server_timing()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+            response_started = time.perf_counter()
+
+            if audio_format == 'wav':
+                pcm = wav_header(params.framerate, params.nchannels, params.sampwidth) + pcm
+            await send({'type': 'http.response.body', 'body': pcm, 'more_body': True})
+            gap = silence(params.framerate, server.SEGMENT_SILENCE, params.nchannels, params.sampwidth)
+            async for success, result in chunks:
+                if disconnected.is_set():
+                    break
+                if not success:
+                    # Headers are already sent; end the stream early
+                    server.app.logger.warning("Streaming TTS stopped: %s", result)
+                    break
+                await send({'type': 'http.response.body', 'body': gap + result[1], 'more_body': True})
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - response_started, stage='response')
+        finally:
+            watcher.cancel()
+            await chunks.aclose()
+
+
+app = AsyncApp(server.tts_engine, server.app)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
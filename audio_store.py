@@ -0,0 +1,119 @@
+"""
+Audio artifact store
+Generated audio files live in one configurable directory instead of the
+system temp dir. Files expire after a TTL, the directory is kept under a
+total size quota by evicting the oldest files, and a background sweeper
+enforces both.
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# Names handed out by new_path(); anything else is never served
+FILENAME_PATTERN = re.compile(r'^[0-9a-f]{32}\.wav$')
+
+
+class AudioStore:
+    """Directory of generated audio with TTL expiry and a size quota"""
+
+    def __init__(self, root, ttl=24 * 3600, max_bytes=1024 * 1024 * 1024, sweep_interval=300):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def new_path(self, suffix='.wav'):
+        """Reserve a fresh, unguessable path for a new audio file"""
+        return self.root / f"{uuid.uuid4().hex}{suffix}"
+
+    def resolve(self, filename):
+        """Map a served filename back to a path, or None if unknown or expired"""
+        if not FILENAME_PATTERN.match(filename):
+            return None
+        path = self.root / filename
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        if self.ttl and time.time() - stat.st_mtime > self.ttl:
+            return None
+        return path
+
+    def _files(self):
+        """List (mtime, size, path) of stored files, oldest first"""
+        files = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or not FILENAME_PATTERN.match(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        files.sort()
+        return files
+
+    def _remove(self, path):
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            # Another worker sharing the directory got there first
+            return False
+
+    def sweep(self):
+        """Delete expired files, then the oldest files until under the quota"""
+        with self._lock:
+            now = time.time()
+            kept = []
+            for mtime, size, path in self._files():
+                if self.ttl and now - mtime > self.ttl:
+                    if self._remove(path):
+                        self.expired += 1
+                else:
+                    kept.append((mtime, size, path))
+
+            total = sum(size for _, size, _ in kept)
+            for mtime, size, path in kept:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    self.evicted += 1
+                total -= size
+            return total
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except OSError:
+                pass
+
+    def start_sweeper(self):
+        """Sweep periodically in a background thread"""
+        if self._sweeper is None and self.sweep_interval:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='kasanoma-audio-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def stats(self):
+        """Get the store's size and cleanup counters"""
+        files = self._files()
+        return {
+            'directory': str(self.root),
+            'files': len(files),
+            'size_bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
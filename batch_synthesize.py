@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Batch synthesis for speech datasets
+Streams a CSV of sentences through a pool of worker processes, each holding
+one persistent synthesizer (a Piper process or an in-process ONNX session),
+and writes the audio plus a metadata.csv as rows finish, either as one WAV
+per row or packed into tar shards. Finished rows are recorded in
+metadata.csv once their audio is safely on disk, so rerunning the same
+command after a crash picks up where it stopped.
+
+    python batch_synthesize.py sentences.csv --model piper-linux/voices/Twi/model.onnx --output-dir wavs
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from multiprocessing.util import Finalize
+from pathlib import Path
+
+from piper_pool import PiperWorker
+from shards import TarShardWriter
+from wav_utils import read_wav, pcm_params, wav_bytes
+
+BASE_PATH = Path(__file__).parent
+if platform.system().lower() == "windows":
+    DEFAULT_PIPER = BASE_PATH / "piper-windows" / "piper.exe"
+else:
+    DEFAULT_PIPER = BASE_PATH / "piper-linux" / "piper"
+
+# Seconds between progress lines
+REPORT_INTERVAL = 10
+
+# Rows handed out per worker before results come back, bounding memory
+ROWS_IN_FLIGHT_PER_WORKER = 4
+
+METADATA_FIELDS = ["wav_filename", "text"]
+SHARD_METADATA_FIELDS = ["wav_filename", "text", "shard"]
+
+
+class PiperSynthesizer:
+    """A persistent Piper process that returns PCM for each text"""
+
+    def __init__(self, piper_path, model_path, timeout):
+        self.timeout = timeout
+        self.work_dir = Path(tempfile.mkdtemp(prefix="kasanoma-batch-"))
+        self.output_path = self.work_dir / "utterance.wav"
+        self.worker = PiperWorker(piper_path, model_path, self.work_dir)
+
+    def synthesize(self, text):
+        """Return (success, (sample_rate, pcm) or error)"""
+        if not self.worker.is_alive():
+            self.worker.restart()
+        success, result = self.worker.synthesize(text, self.output_path, timeout=self.timeout)
+        if not success:
+            return False, result
+        params, pcm = read_wav(self.output_path)
+        self.output_path.unlink()
+        return True, (params.framerate, pcm)
+
+    def close(self):
+        self.worker.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class OnnxSynthesizer:
+    """An in-process ONNX session that returns PCM for each text"""
+
+    def __init__(self, model_path):
+        from onnx_engine import OnnxEngine
+        self.model_path = str(model_path)
+        # Parallelism comes from the worker processes, so each session stays single-threaded
+        self.engine = OnnxEngine(intra_op_threads=1, inter_op_threads=1)
+        self.engine.load_voice(self.model_path)
+
+    def synthesize(self, text):
+        """Return (success, (sample_rate, pcm) or error)"""
+        audio, sample_rate = self.engine.synthesize_pcm(self.model_path, text)
+        return True, (sample_rate, audio.tobytes())
+
+    def close(self):
+        self.engine.shutdown()
+
+
+# The synthesizer owned by this worker process
+_synthesizer = None
+
+
+def _init_worker(backend, piper_path, model_path, timeout):
+    global _synthesizer
+    # Ctrl-C is handled by the parent, which terminates the whole pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if backend == 'onnx':
+        _synthesizer = OnnxSynthesizer(model_path)
+    else:
+        _synthesizer = PiperSynthesizer(piper_path, model_path, timeout)
+    # Runs when the pool shuts the worker down
+    Finalize(_synthesizer, _synthesizer.close, exitpriority=10)
+
+
+def _synthesize_row(task):
+    """Synthesize one row in a worker; returns (index, text, success, result, seconds)"""
+    index, text = task
+    start = time.perf_counter()
+    try:
+        success, result = _synthesizer.synthesize(text)
+    except Exception as e:
+        success, result = False, f"TTS error: {str(e)}"
+    return index, text, success, result, time.perf_counter() - start
+
+
+class MetadataCheckpoint:
+    """metadata.csv of finished rows, which doubles as the checkpoint"""
+
+    def __init__(self, metadata_path, fieldnames):
+        self.metadata_path = Path(metadata_path)
+        self.metadata_path.parent.mkdir(parents=True, exist_ok=True)
+        self._done = self._read_completed()
+        new_file = not self.metadata_path.exists() or self.metadata_path.stat().st_size == 0
+        self._metadata = open(self.metadata_path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._metadata, fieldnames=fieldnames)
+        if new_file:
+            self._writer.writeheader()
+
+    def _read_completed(self):
+        """Row numbers already in metadata.csv, dropping a half-written last line"""
+        if not self.metadata_path.exists():
+            return set()
+        with open(self.metadata_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+        done = set()
+        with open(self.metadata_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                stem = Path(row.get("wav_filename") or "").stem
+                if stem.startswith("audio_") and stem[6:].isdigit():
+                    done.add(int(stem[6:]))
+        return done
+
+    def completed(self):
+        """Row numbers that do not need synthesizing again"""
+        return self._done
+
+    def record(self, index, row):
+        """Add a row whose audio is complete on disk"""
+        self._writer.writerow(row)
+        self._metadata.flush()
+        self._done.add(index)
+
+    def sync(self):
+        """Force written rows to disk"""
+        os.fsync(self._metadata.fileno())
+
+    def close(self):
+        self._metadata.flush()
+        self.sync()
+        self._metadata.close()
+
+
+class WavDirectoryWriter(MetadataCheckpoint):
+    """Writes one audio_<row>.wav file per row"""
+
+    def __init__(self, output_dir, metadata_path):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        super().__init__(metadata_path, METADATA_FIELDS)
+
+    def write(self, index, text, sample_rate, pcm):
+        """Store one finished row"""
+        output_file = self.output_dir / f"audio_{index}.wav"
+        tmp_file = output_file.with_name(f".{output_file.name}.tmp")
+        tmp_file.write_bytes(wav_bytes(pcm_params(sample_rate, pcm), pcm))
+        os.replace(tmp_file, output_file)
+        self.record(index, {"wav_filename": str(output_file), "text": text})
+
+
+class TarShardDatasetWriter(MetadataCheckpoint):
+    """Packs rows into WebDataset-style tar shards of audio_<row>.wav and .txt
+
+    Rows reach metadata.csv only when their shard is closed, so a rerun after
+    a crash redoes just the rows of the shard that was being written.
+    """
+
+    def __init__(self, output_dir, metadata_path, shard_bytes):
+        super().__init__(metadata_path, SHARD_METADATA_FIELDS)
+        self._texts = {}
+        self.shards = TarShardWriter(output_dir, shard_bytes=shard_bytes, on_shard_closed=self._shard_closed)
+
+    def write(self, index, text, sample_rate, pcm):
+        """Append one finished row to the current shard"""
+        key = f"audio_{index}"
+        self._texts[key] = (index, text)
+        self.shards.add(key, {
+            'wav': wav_bytes(pcm_params(sample_rate, pcm), pcm),
+            'txt': text.encode('utf-8')
+        })
+
+    def _shard_closed(self, path, keys):
+        for key in keys:
+            index, text = self._texts.pop(key)
+            self.record(index, {"wav_filename": f"{key}.wav", "text": text, "shard": path.name})
+
+    def close(self):
+        self.shards.close()
+        super().close()
+
+
+def iter_rows(csv_path, column, skip):
+    """Stream (row number, text) for rows that still need synthesizing"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for index, row in enumerate(csv.DictReader(f), start=1):
+            text = (row.get(column) or "").strip()
+            if not text or index in skip:
+                continue
+            yield index, text
+
+
+class Progress:
+    """Running totals for rows/s and real-time factor reporting"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.rows = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.synthesis_seconds = 0.0
+
+    def add(self, success, audio_seconds=0.0, synthesis_seconds=0.0):
+        if success:
+            self.rows += 1
+            self.audio_seconds += audio_seconds
+            self.synthesis_seconds += synthesis_seconds
+        else:
+            self.failed += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'rows': self.rows,
+            'failed': self.failed,
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(self.rows / elapsed, 2) if elapsed else 0.0,
+            'audio_seconds': round(self.audio_seconds, 2),
+            # Compute spent per second of audio, per worker, and wall time per second of audio overall
+            'rtf': round(self.synthesis_seconds / self.audio_seconds, 4) if self.audio_seconds else None,
+            'wall_rtf': round(elapsed / self.audio_seconds, 4) if self.audio_seconds else None
+        }
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_report < REPORT_INTERVAL:
+            return False
+        self.last_report = now
+        s = self.summary()
+        print(f"{s['rows']} rows ({s['failed']} failed) in {s['elapsed_seconds']}s: "
+              f"{s['rows_per_second']} rows/s, {s['audio_seconds']}s of audio, "
+              f"RTF {s['rtf']} per worker, {s['wall_rtf']} overall", flush=True)
+        return True
+
+
+def run(args, writer):
+    """Synthesize every remaining row of the CSV into writer"""
+    skip = writer.completed()
+    if skip:
+        print(f"Resuming: {len(skip)} rows already done", flush=True)
+
+    progress = Progress(args.workers)
+    tasks = iter_rows(args.csv, args.column, skip)
+    window = args.workers * ROWS_IN_FLIGHT_PER_WORKER
+    # Results and errors of submitted rows, in the order they finish
+    finished = queue.Queue()
+    pending = 0
+    pool = multiprocessing.Pool(args.workers, initializer=_init_worker,
+                                initargs=(args.backend, str(args.piper), str(args.model), args.timeout))
+    try:
+        while True:
+            # Rows are submitted from this thread, so nothing inside the pool ever waits on the window
+            while pending < window:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pool.apply_async(_synthesize_row, (task,), callback=finished.put, error_callback=finished.put)
+                pending += 1
+            if pending == 0:
+                break
+            outcome = finished.get()
+            pending -= 1
+            if isinstance(outcome, BaseException):
+                raise outcome
+            index, text, success, result, seconds = outcome
+            if success:
+                sample_rate, pcm = result
+                writer.write(index, text, sample_rate, pcm)
+                progress.add(True, len(pcm) / 2 / sample_rate, seconds)
+            else:
+                progress.add(False)
+                print(f"Row {index} failed: {result}", file=sys.stderr, flush=True)
+            if progress.report():
+                writer.sync()
+        pool.close()
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            print("Interrupted; rerun the same command to resume", file=sys.stderr)
+            # A second Ctrl-C must not leave the pool half torn down
+            previous = signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                pool.terminate()
+            finally:
+                signal.signal(signal.SIGINT, previous)
+        else:
+            pool.terminate()
+        raise
+    finally:
+        pool.join()
+        progress.report(force=True)
+    return progress.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthesize a CSV of sentences into a speech dataset")
+    parser.add_argument('csv', help="Input CSV with a header row")
+    parser.add_argument('--model', required=True, help="Voice model (.onnx) to speak with")
+    parser.add_argument('--column', default='sentence', help="CSV column holding the text (default: sentence)")
+    parser.add_argument('--output-dir', default='wavs', help="Directory for the audio (default: wavs)")
+    parser.add_argument('--metadata', default=None, help="Metadata CSV (default: <output-dir>/metadata.csv)")
+    parser.add_argument('--format', choices=['wav', 'tar'], default='wav',
+                        help="One WAV file per row, or WebDataset tar shards (default: wav)")
+    parser.add_argument('--shard-size', type=int, default=256,
+                        help="Approximate size of each tar shard in MB (default: 256)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes, each with its own synthesizer (default: CPU count)")
+    parser.add_argument('--backend', choices=['piper', 'onnx'], default='piper',
+                        help="Persistent piper process or in-process onnxruntime (default: piper)")
+    parser.add_argument('--piper', default=str(DEFAULT_PIPER), help="Path to the piper binary")
+    parser.add_argument('--timeout', type=float, default=60, help="Seconds allowed per row")
+    args = parser.parse_args(argv)
+
+    if args.backend == 'piper' and not Path(args.piper).exists():
+        parser.error(f"Piper executable not found at {args.piper}")
+    if not Path(args.model).exists():
+        parser.error(f"Voice model not found at {args.model}")
+    with open(args.csv, newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    if args.column not in header:
+        parser.error(f"Column '{args.column}' not found in {args.csv}")
+    args.workers = max(1, args.workers)
+
+    metadata = args.metadata or str(Path(args.output_dir) / "metadata.csv")
+    if args.format == 'tar':
+        writer = TarShardDatasetWriter(args.output_dir, metadata, args.shard_size * 1024 * 1024)
+    else:
+        writer = WavDirectoryWriter(args.output_dir, metadata)
+    try:
+        summary = run(args, writer)
+    finally:
+        writer.close()
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Micro-batching scheduler
+Collects work items that arrive close together for the same key (a voice)
+and hands them to a batch function in one call. A batch is dispatched as
+soon as it is full or its oldest item has waited max_delay seconds, so
+batching adds at most that much latency.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """Group items per key into batches of up to max_batch_size"""
+
+    def __init__(self, run_batch, max_batch_size=8, max_delay=0.005, workers=1):
+        """run_batch(key, items) must return one result per item, in order"""
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay
+        self.batches = 0
+        self.items = 0
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix='kasanoma-batch')
+        self._stopped = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='kasanoma-batcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, key, item):
+        """Queue an item and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Batcher is shut down")
+            queue = self._pending.setdefault(key, deque())
+            queue.append((time.monotonic() + self.max_delay, item, future))
+            if len(queue) == 1 or len(queue) >= self.max_batch_size:
+                self._cond.notify()
+        return future
+
+    def _take_ready(self):
+        """Pop the batches that are full or due; return them and the next deadline"""
+        # Once stopped, everything still queued is due
+        now = float('inf') if self._stopped else time.monotonic()
+        ready = []
+        next_deadline = None
+        for key in list(self._pending):
+            queue = self._pending[key]
+            while queue and (len(queue) >= self.max_batch_size or queue[0][0] <= now):
+                batch = [queue.popleft() for _ in range(min(self.max_batch_size, len(queue)))]
+                ready.append((key, batch))
+            if queue:
+                deadline = queue[0][0]
+                next_deadline = deadline if next_deadline is None else min(next_deadline, deadline)
+            else:
+                del self._pending[key]
+        return ready, next_deadline
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                ready, next_deadline = self._take_ready()
+                while not ready:
+                    if self._stopped:
+                        return
+                    timeout = None if next_deadline is None else max(0.0, next_deadline - time.monotonic())
+                    self._cond.wait(timeout)
+                    ready, next_deadline = self._take_ready()
+            for key, batch in ready:
+                self._executor.submit(self._run, key, batch)
+
+    def _run(self, key, batch):
+        futures = [future for _, _, future in batch]
+        # Every future must be marked running, so no short-circuiting any()
+        running = [future.set_running_or_notify_cancel() for future in futures]
+        if not any(running):
+            return
+        try:
+            results = self.run_batch(key, [item for _, item, _ in batch])
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        """Get batch counters"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_delay_ms': self.max_delay * 1000,
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0
+        }
+
+    def shutdown(self):
+        """Stop accepting items; those already queued still run"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for the piper binary
+Accepts the command lines the server uses (--output_file, --output_raw and
+--json-input with --output_dir), sleeps in proportion to the text length
+and writes a valid WAV of a tone whose length also follows the text, so
+benchmarks run anywhere and give repeatable numbers.
+
+Timing is tuned with FAKE_PIPER_LOAD_SECONDS (model load, once per
+process) and FAKE_PIPER_SECONDS_PER_CHAR (synthesis time per character).
+"""
+
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import time
+import wave
+
+LOAD_SECONDS = float(os.environ.get('FAKE_PIPER_LOAD_SECONDS', '0.2'))
+SECONDS_PER_CHAR = float(os.environ.get('FAKE_PIPER_SECONDS_PER_CHAR', '0.0002'))
+
+# Roughly the pace of natural speech
+AUDIO_SECONDS_PER_CHAR = 0.065
+
+
+def sample_rate_of(model_path):
+    try:
+        with open(f"{model_path}.json", encoding='utf-8') as f:
+            return json.load(f).get('audio', {}).get('sample_rate', 22050)
+    except (OSError, ValueError):
+        return 22050
+
+
+def tone(sample_rate):
+    """One second of a 220 Hz tone as 16-bit PCM"""
+    step = 2 * math.pi * 220 / sample_rate
+    return struct.pack(f'<{sample_rate}h', *(int(8000 * math.sin(i * step)) for i in range(sample_rate)))
+
+
+def render(text, sample_rate, second):
+    """Sleep like a real synthesis would and return 16-bit PCM"""
+    time.sleep(SECONDS_PER_CHAR * len(text))
+    size = 2 * int(sample_rate * AUDIO_SECONDS_PER_CHAR * max(1, len(text)))
+    return (second * (size // len(second) + 1))[:size]
+
+
+def write_wav(path, pcm, sample_rate):
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(pcm)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model')
+    parser.add_argument('--output_file')
+    parser.add_argument('--output_dir')
+    parser.add_argument('--output_raw', action='store_true')
+    parser.add_argument('--json-input', action='store_true')
+    parser.add_argument('--version', action='store_true')
+    args, _ = parser.parse_known_args()
+
+    if args.version:
+        print("fake-piper 1.0")
+        return 0
+
+    sample_rate = sample_rate_of(args.model)
+    second = tone(sample_rate)
+    time.sleep(LOAD_SECONDS)
+
+    if args.json_input:
+        for count, line in enumerate(sys.stdin):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output_file = request.get('output_file') or os.path.join(args.output_dir or '.', f"{count}.wav")
+            write_wav(output_file, render(request['text'], sample_rate, second), sample_rate)
+            print(output_file, flush=True)
+        return 0
+
+    pcm = render(sys.stdin.read().strip(), sample_rate, second)
+    if args.output_raw:
+        sys.stdout.buffer.write(pcm)
+    else:
+        write_wav(args.output_file, pcm, sample_rate)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark fixtures
+Deterministic texts and documents of a chosen size, generated on the fly
+so no large binaries have to live in the repository.
+"""
+
+import random
+
+WORDS = (
+    "the health survey asks every family about water food school work market "
+    "clinic children mother father village river road rain season harvest "
+    "doctor nurse medicine answer question morning evening today tomorrow "
+    "please thank you welcome community people language voice story"
+).split()
+
+
+def make_sentences(count, seed=0, min_words=6, max_words=18):
+    """Return count pseudo-random English sentences"""
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+
+def make_text(chars, seed=0):
+    """Return a text of about chars characters"""
+    sentences = []
+    total = 0
+    for sentence in make_sentences(chars // 40 + 1, seed=seed):
+        if total >= chars:
+            break
+        sentences.append(sentence)
+        total += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(path, pages, lines_per_page=40, seed=0):
+    """Write a plain text PDF of the given number of pages"""
+    sentences = make_sentences(pages * lines_per_page, seed=seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page in range(pages):
+        lines = sentences[page * lines_per_page:(page + 1) * lines_per_page]
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode('ascii')
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def make_docx(path, paragraphs, seed=0):
+    """Write a Word document of the given number of paragraphs (needs python-docx)"""
+    import docx
+    document = docx.Document()
+    sentences = make_sentences(paragraphs * 3, seed=seed)
+    for i in range(paragraphs):
+        document.add_paragraph(" ".join(sentences[i * 3:i * 3 + 3]))
+    document.save(path)
+
+
+def make_txt(path, chars, seed=0):
+    """Write a UTF-8 text file of about chars characters"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(make_text(chars, seed=seed))
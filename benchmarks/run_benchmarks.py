@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Kasanoma benchmark suite
+Starts the server in-process on a free port and measures /api/tts latency
+and throughput, /api/upload on large generated PDF, DOCX and text files,
+and the cost of language detection. Runs against a deterministic fake
+piper by default, or the real piper-linux binary with --piper real, and
+writes the results as JSON so runs can be compared over time.
+
+    python benchmarks/run_benchmarks.py --output results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+import fixtures  # noqa: E402
+
+
+def percentiles(samples):
+    """Summarize latencies in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 2),
+        'p50_ms': pick(0.50),
+        'p90_ms': pick(0.90),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 2)
+    }
+
+
+def prepare_environment(args, work_dir):
+    """Point the server at scratch directories (and the fake piper) before it is imported"""
+    os.environ.update({
+        'KASANOMA_AUDIO_DIR': str(work_dir / 'audio'),
+        'KASANOMA_JOB_DIR': str(work_dir / 'jobs'),
+        'KASANOMA_CACHE_DIR': str(work_dir / 'cache'),
+        'KASANOMA_VOICE_INDEX': str(work_dir / 'voice-index.json'),
+        'KASANOMA_VOICE_RELOAD_INTERVAL': '0',
+        'KASANOMA_AUDIO_SWEEP_INTERVAL': '0',
+    })
+    if not args.cache:
+        os.environ['KASANOMA_CACHE_MAX_BYTES'] = '0'
+        os.environ['KASANOMA_SEGMENT_CACHE_MAX_BYTES'] = '0'
+    if args.pool_size is not None:
+        os.environ['KASANOMA_POOL_SIZE'] = str(args.pool_size)
+
+    if args.piper == 'fake':
+        # The fake only needs each voice's model.onnx.json, not the model itself
+        voices = work_dir / 'voices'
+        for config in sorted((REPO_DIR / 'piper-linux' / 'voices').glob('*/*.onnx.json')):
+            language_dir = voices / config.parent.name
+            language_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copy(config, language_dir / config.name)
+            (language_dir / config.name[:-len('.json')]).touch()
+        os.environ['KASANOMA_PIPER_PATH'] = str(BENCH_DIR / 'fake_piper.py')
+        os.environ['KASANOMA_VOICES_DIR'] = str(voices)
+    elif args.piper != 'real':
+        os.environ['KASANOMA_PIPER_PATH'] = args.piper
+
+
+class Server:
+    """The Flask app served by werkzeug on a background thread"""
+
+    def __init__(self, flask_app):
+        from werkzeug.serving import make_server
+        # Per-request access logs would only slow the client down
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def post(url, body, content_type, timeout=600):
+    """POST a request body and return (status, seconds)"""
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def post_json(url, payload):
+    return post(url, json.dumps(payload).encode('utf-8'), 'application/json')
+
+
+def post_file(url, path, fields=None):
+    """POST a file as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+                 f'filename="{Path(path).name}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+    parts.append(Path(path).read_bytes())
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return post(url, b''.join(parts), f'multipart/form-data; boundary={boundary}')
+
+
+def bench_tts_latency(server, voice, requests):
+    """Sequential /api/tts requests of varied length"""
+    texts = [fixtures.make_text(length, seed=i) for i, length in
+             enumerate([40, 120, 300] * (requests // 3 + 1))][:requests]
+    # The first request pays for spawning the voice's worker, unless it is the warmed-up default voice
+    status, first = post_json(f"{server.url}/api/tts", {'text': texts[0], **voice})
+    latencies, errors = [], 0
+    for text in texts:
+        status, seconds = post_json(f"{server.url}/api/tts", {'text': text, **voice})
+        latencies.append(seconds)
+        errors += status != 200
+    return {'first_request_ms': round(first * 1000, 2), 'errors': errors, **percentiles(latencies)}
+
+
+def bench_tts_throughput(server, voice, requests, concurrency):
+    """/api/tts requests from a fixed number of concurrent clients"""
+    texts = [fixtures.make_text(120, seed=1000 + i) for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda text: post_json(f"{server.url}/api/tts", {'text': text, **voice}), texts))
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests_per_second': round(len(results) / elapsed, 2),
+        'errors': sum(status != 200 for status, _ in results),
+        **percentiles([seconds for _, seconds in results])
+    }
+
+
+def bench_upload(server, voice, work_dir, pdf_pages, docx_paragraphs, text_chars, repeat):
+    """/api/upload for large generated documents"""
+    documents = {}
+    pdf_path = work_dir / 'fixture.pdf'
+    fixtures.make_pdf(pdf_path, pdf_pages)
+    documents['pdf'] = (pdf_path, {'pages': pdf_pages})
+    docx_path = work_dir / 'fixture.docx'
+    try:
+        fixtures.make_docx(docx_path, docx_paragraphs)
+        documents['docx'] = (docx_path, {'paragraphs': docx_paragraphs})
+    except ImportError:
+        documents['docx'] = (None, {'skipped': 'python-docx is not installed'})
+    txt_path = work_dir / 'fixture.txt'
+    fixtures.make_txt(txt_path, text_chars)
+    documents['txt'] = (txt_path, {'chars': text_chars})
+
+    results = {}
+    for kind, (path, info) in documents.items():
+        if path is None:
+            results[kind] = info
+            continue
+        runs = [post_file(f"{server.url}/api/upload", path, voice) for _ in range(repeat)]
+        results[kind] = {
+            **info,
+            'bytes': path.stat().st_size,
+            'errors': sum(status != 200 for status, _ in runs),
+            **percentiles([seconds for _, seconds in runs])
+        }
+    return results
+
+
+def bench_language_detection(engine, loops, budget_us):
+    """Cost of detecting the language of short, medium and very long texts
+
+    Detection only reads a bounded sample, so every size should fit within budget_us.
+    """
+    samples = {
+        'short': fixtures.make_text(60),
+        'medium': fixtures.make_text(2000),
+        'long': fixtures.make_text(500000)
+    }
+    results = {}
+    for name, text in samples.items():
+        start = time.perf_counter()
+        for _ in range(loops):
+            engine.detect_text_language(text)
+        elapsed = time.perf_counter() - start
+        us_per_call = elapsed / loops * 1e6
+        results[name] = {'chars': len(text), 'us_per_call': round(us_per_call, 2),
+                         'within_budget': us_per_call <= budget_us}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Kasanoma TTS server")
+    parser.add_argument('--piper', default='fake',
+                        help="'fake' (default), 'real' for the bundled piper-linux binary, or a path")
+    parser.add_argument('--language', default=None, help="Language folder to synthesize with")
+    parser.add_argument('--requests', type=int, default=30, help="Requests per /api/tts benchmark")
+    parser.add_argument('--concurrency', type=int, default=8, help="Clients in the throughput benchmark")
+    parser.add_argument('--pdf-pages', type=int, default=50)
+    parser.add_argument('--docx-paragraphs', type=int, default=300)
+    parser.add_argument('--text-chars', type=int, default=50000)
+    parser.add_argument('--upload-repeat', type=int, default=3)
+    parser.add_argument('--detect-loops', type=int, default=200)
+    parser.add_argument('--detect-budget-us', type=float, default=1000,
+                        help="Fail the run if language detection takes longer per call (default: 1000)")
+    parser.add_argument('--pool-size', type=int, default=None, help="KASANOMA_POOL_SIZE for the run")
+    parser.add_argument('--cache', action='store_true', help="Keep the synthesis cache enabled")
+    parser.add_argument('--only', nargs='*', choices=['tts_latency', 'tts_throughput', 'upload', 'language_detection'],
+                        help="Run only these benchmarks")
+    parser.add_argument('--output', default=None, help="Write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    work_dir = Path(tempfile.mkdtemp(prefix='kasanoma-bench-'))
+    prepare_environment(args, work_dir)
+    import app  # configured from the environment prepared above
+
+    engine = app.tts_engine
+    language = args.language or engine.current_language
+    voice = {'language': language} if language else {}
+    selected = set(args.only or ['tts_latency', 'tts_throughput', 'upload', 'language_detection'])
+
+    server = Server(app.app)
+    results = {}
+    try:
+        if 'tts_latency' in selected:
+            results['tts_latency'] = bench_tts_latency(server, voice, args.requests)
+        if 'tts_throughput' in selected:
+            results['tts_throughput'] = bench_tts_throughput(server, voice, args.requests, args.concurrency)
+        if 'upload' in selected:
+            results['upload'] = bench_upload(server, voice, work_dir, args.pdf_pages, args.docx_paragraphs,
+                                             args.text_chars, args.upload_repeat)
+        if 'language_detection' in selected:
+            results['language_detection'] = bench_language_detection(engine, args.detect_loops,
+                                                                       args.detect_budget_us)
+    finally:
+        server.stop()
+        engine.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'piper': args.piper,
+        'backend': 'onnx' if engine.onnx is not None else 'piper',
+        'pool_size': engine.pool.size if engine.pool is not None else 0,
+        'cache': args.cache,
+        'language': language,
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding='utf-8')
+    print(output)
+    over_budget = [name for name, result in results.get('language_detection', {}).items()
+                   if not result['within_budget']]
+    if over_budget:
+        print(f"Language detection over {args.detect_budget_us:g} us per call for: {', '.join(over_budget)}",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,13 +6,16 @@ Voice-Only Health Diagnostic App with Piper TTS Integration
 import os
 import platform
 import subprocess
-import tempfile
 import json
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, Response, render_template, request, jsonify, session
+from werkzeug.wsgi import wrap_file
 import threading
 import time
 
+from prompt_bundle import PromptBundle, voice_fingerprint
+from prompt_pack import PromptPack
+
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Change this for production
 
@@ -30,6 +33,21 @@ READY_CHECK_TEXT = "Nsɛmmisa ennum a etoatoaso no fa wapomuden ho. Sɛ mebusa a
 SUMMARY_TEXT = "Y'afa wommuayɛ no nyinaa."
 END_TEXT = "Yeda wo ase."
 
+# Every prompt the app speaks, by the audio key the page asks for
+PROMPTS = {
+    'welcome': WELCOME_TEXT,
+    'ready_check': READY_CHECK_TEXT,
+    **{f'question_{i}': question for i, question in enumerate(QUESTIONS)},
+    'summary': SUMMARY_TEXT,
+    'end': END_TEXT
+}
+
+# Pause between the ready check and the first question, kept by the client rather than the server
+READY_PAUSE_SECONDS = 2.0
+
+# Synthesized prompts are kept here between runs; build it ahead with prompt_bundle.py
+PROMPT_BUNDLE_DIR = os.environ.get('HEALTH_PROMPT_BUNDLE_DIR', str(Path(__file__).parent / 'prompt_audio'))
+
 class PiperTTS:
     def __init__(self):
         self.system = platform.system().lower()
@@ -82,51 +100,18 @@ class PiperTTS:
 # Initialize TTS engine
 tts_engine = PiperTTS()
 
-def generate_audio_files():
-    """Pre-generate audio files for all states"""
-    audio_files = {}
-    
-    # Generate welcome message
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        output_path = tmp_file.name
-    success, result = tts_engine.text_to_speech(WELCOME_TEXT, output_path)
-    if success:
-        audio_files['welcome'] = result
-    
-    # Generate ready check message
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        output_path = tmp_file.name
-    success, result = tts_engine.text_to_speech(READY_CHECK_TEXT, output_path)
-    if success:
-        audio_files['ready_check'] = result
-    
-    # Generate question audio
-    for i, question in enumerate(QUESTIONS):
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-            output_path = tmp_file.name
-        success, result = tts_engine.text_to_speech(question, output_path)
-        if success:
-            audio_files[f'question_{i}'] = result
-    
-    # Generate summary audio
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        output_path = tmp_file.name
-    success, result = tts_engine.text_to_speech(SUMMARY_TEXT, output_path)
-    if success:
-        audio_files['summary'] = result
+PROMPT_BUNDLE = PromptBundle(PROMPT_BUNDLE_DIR, voice_fingerprint(tts_engine.voice_path))
 
-    # Generate end audio
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        output_path = tmp_file.name
-    success, result = tts_engine.text_to_speech(END_TEXT, output_path)
-    if success:
-        audio_files['end'] = result
-    
-    return audio_files
+def generate_audio_files():
+    """Load prompt audio from the bundle, synthesizing only prompts that are new or changed"""
+    return PROMPT_BUNDLE.ensure(PROMPTS, tts_engine.text_to_speech)
 
-# Pre-generate audio files at startup
+# Load audio files at startup
 AUDIO_FILES = generate_audio_files()
 
+# One read-only mapping of all prompt audio; its pages are shared by every worker on the host
+PROMPT_PACK = PromptPack(PROMPT_BUNDLE.pack(PROMPTS, AUDIO_FILES))
+
 @app.route('/')
 def index():
     """Main application page"""
@@ -138,10 +123,39 @@ def index():
 
 @app.route('/audio/<audio_key>')
 def get_audio(audio_key):
-    """Serve audio files"""
-    if audio_key in AUDIO_FILES:
-        return send_file(AUDIO_FILES[audio_key], mimetype='audio/wav')
-    return jsonify({'error': 'Audio not found'}), 404
+    """Serve audio files from the prompt pack"""
+    entry = PROMPT_PACK.entries.get(audio_key)
+    if entry is None:
+        return jsonify({'error': 'Audio not found'}), 404
+    
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        # Browsers fetch media in ranges; Safari will not play audio without them
+        start, stop = 0, entry.length
+        byte_range = request.range.range_for_length(entry.length) if request.range else None
+        if request.range and byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{entry.length}'
+            return response
+        if byte_range is not None:
+            start, stop = byte_range
+        body = wrap_file(request.environ, PROMPT_PACK.open(audio_key, start, stop))
+        response = Response(body, mimetype='audio/wav', direct_passthrough=True)
+        response.content_length = stop - start
+        if byte_range is not None:
+            response.status_code = 206
+            response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{entry.length}'
+    
+    response.set_etag(entry.etag)
+    response.accept_ranges = 'bytes'
+    # Clients revalidate every time; an unchanged prompt costs a 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def wait_ms():
+    """Milliseconds until the session's scheduled pause is over"""
+    return max(0, int((session.get('not_before', 0) - time.time()) * 1000))
 
 @app.route('/next_state')
 def next_state():
@@ -149,6 +163,11 @@ def next_state():
     state = session.get('current_state', 'welcome')
     idx = session.get('current_question_index', 0)
     
+    # Too early: tell the client how long to wait instead of holding the request
+    remaining = wait_ms()
+    if remaining:
+        return jsonify({'type': 'wait', 'wait_ms': remaining})
+    
     if state == 'welcome':
         # After welcome, move to ready check
         session['current_state'] = 'ready_check'
@@ -213,8 +232,8 @@ def record_answer():
     
     if state == 'ready_check':
         if answer == 'Yes':
-            # Add a 2-second delay here before sending the response
-            time.sleep(2)
+            # Pause before the first question; next_state holds back until then
+            session['not_before'] = time.time() + READY_PAUSE_SECONDS
             session['current_state'] = 'questions'
             session['current_question_index'] = 0
             session.modified = True
@@ -236,7 +255,7 @@ def record_answer():
             session['current_state'] = 'summary'
             session.modified = True
     
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'wait_ms': wait_ms()})
 
 @app.route('/responses')
 def get_responses():
@@ -259,6 +278,7 @@ if __name__ == '__main__':
     print(f"System: {platform.system()}")
     print(f"Piper path: {tts_engine.piper_path}")
     print(f"Voice path: {tts_engine.voice_path}")
-    print(f"Pre-generated audio files: {len(AUDIO_FILES)}")
+    print(f"Prompt audio: {len(AUDIO_FILES)} files in {PROMPT_BUNDLE.root} "
+          f"({PROMPT_BUNDLE.built} synthesized, {PROMPT_BUNDLE.reused} reused)")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
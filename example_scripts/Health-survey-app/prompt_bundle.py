@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Prompt audio bundle for the Health Diagnostic App
+Every prompt is synthesized once into a bundle directory, under a name
+derived from a hash of its text and the voice, so a prompt is only
+synthesized again when its text or the voice changes. Build the bundle
+ahead of starting the server:
+
+    python prompt_bundle.py            # synthesize missing prompts in parallel
+    python prompt_bundle.py --prune    # also delete audio of prompts no longer used
+
+The app loads the same bundle when it starts and only synthesizes the
+prompts that are not in it yet. The audio is then packed into a single
+prompts.pack (see prompt_pack.py) that the workers serve from.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from prompt_pack import read_index, write_pack
+
+# Bump when the audio format changes so that every prompt is synthesized again
+BUNDLE_VERSION = 1
+
+
+def voice_fingerprint(model_path):
+    """Identify a voice by its config and model size, without hashing the whole model"""
+    model_path = Path(model_path)
+    digest = hashlib.sha256()
+    try:
+        digest.update(Path(f"{model_path}.json").read_bytes())
+        digest.update(str(model_path.stat().st_size).encode('ascii'))
+    except OSError:
+        digest.update(str(model_path).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class PromptBundle:
+    """Directory of prompt audio files named by the hash of their text and voice"""
+
+    def __init__(self, root, voice_id):
+        self.root = Path(root)
+        self.audio_dir = self.root / 'audio'
+        self.manifest_path = self.root / 'manifest.json'
+        self.pack_path = self.root / 'prompts.pack'
+        self.voice_id = voice_id
+        self.built = 0
+        self.reused = 0
+        self.failed = {}
+        self.packed = False
+
+    def key(self, text):
+        return hashlib.sha256(f"{BUNDLE_VERSION}\0{self.voice_id}\0{text}".encode('utf-8')).hexdigest()[:24]
+
+    def path(self, text):
+        return self.audio_dir / f"{self.key(text)}.wav"
+
+    def _build(self, text, synthesize):
+        """Synthesize one prompt into place; returns (success, path or error)"""
+        path = self.path(text)
+        # Other workers may build the same prompt at the same time; whichever finishes last wins
+        tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        try:
+            success, result = synthesize(text, str(tmp_path))
+            if not success:
+                return False, result
+            os.replace(tmp_path, path)
+            return True, str(path)
+        finally:
+            try:
+                tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def ensure(self, prompts, synthesize, workers=None):
+        """Return {name: audio path} for prompts, synthesizing only those not in the bundle
+
+        prompts maps a prompt name to its text; synthesize(text, output_path)
+        returns (success, result). Missing prompts are synthesized in parallel.
+        """
+        self.audio_dir.mkdir(parents=True, exist_ok=True)
+        audio_files = {}
+        missing = {}
+        for name, text in prompts.items():
+            if self.path(text).exists():
+                audio_files[name] = str(self.path(text))
+                self.reused += 1
+            else:
+                missing.setdefault(text, []).append(name)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 2) as executor:
+                results = executor.map(lambda text: self._build(text, synthesize), missing)
+                for (text, names), (success, result) in zip(missing.items(), results):
+                    for name in names:
+                        if success:
+                            audio_files[name] = result
+                        else:
+                            self.failed[name] = result
+                    if success:
+                        self.built += 1
+            self.write_manifest(prompts)
+        return audio_files
+
+    def write_manifest(self, prompts):
+        """Record which file holds each prompt, for inspection and pruning"""
+        manifest = {
+            'version': BUNDLE_VERSION,
+            'voice': self.voice_id,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'prompts': {name: {'text': text, 'file': self.path(text).name} for name, text in prompts.items()}
+        }
+        tmp_path = self.manifest_path.with_name(f"manifest.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.manifest_path)
+
+    def pack(self, prompts, audio_files):
+        """Return the path of a prompt pack holding audio_files, rewritten only when a prompt changed"""
+        wanted = {name: (self.key(prompts[name]), path) for name, path in audio_files.items()}
+        entries = read_index(self.pack_path)
+        if entries is None or {name: entry.key for name, entry in entries.items()} != \
+                {name: key for name, (key, _) in wanted.items()}:
+            write_pack(self.pack_path, wanted)
+            self.packed = True
+        return self.pack_path
+
+    def prune(self, prompts):
+        """Delete audio files that no current prompt refers to"""
+        keep = {self.path(text).name for text in prompts.values()}
+        removed = 0
+        for path in self.audio_dir.glob('*.wav'):
+            if path.name not in keep:
+                path.unlink()
+                removed += 1
+        return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthesize the survey prompts into the audio bundle")
+    parser.add_argument('--prune', action='store_true', help="Delete audio of prompts that are no longer used")
+    args = parser.parse_args(argv)
+
+    # Loading the app builds whatever the bundle is missing
+    import app
+
+    bundle = app.PROMPT_BUNDLE
+    print(f"Bundle: {bundle.root} (voice {bundle.voice_id})")
+    print(f"Synthesized {bundle.built} prompts, {bundle.reused} already up to date")
+    print(f"Prompt pack: {bundle.pack_path} ({'rewritten' if bundle.packed else 'up to date'})")
+    for name, error in bundle.failed.items():
+        print(f"  {name}: {error}", file=sys.stderr)
+    if args.prune:
+        print(f"Removed {bundle.prune(app.PROMPTS)} unused audio files")
+    return 1 if bundle.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
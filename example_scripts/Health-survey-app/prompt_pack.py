@@ -0,0 +1,167 @@
+"""
+Prompt pack
+All prompt audio in one file behind a small offset index:
+
+    header   magic, format version, index length
+    index    JSON: name -> offset, length, etag and bundle key
+    data     each prompt's WAV, starting on a page boundary
+
+Every worker maps the pack read-only, so the audio sits in the page cache
+once however many workers serve it. Prompts are served from the mapping,
+or with sendfile by servers that support it (gunicorn).
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import uuid
+from collections import namedtuple
+from pathlib import Path
+
+PACK_MAGIC = b'KPPK'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('<4sHHI')  # magic, version, reserved, index length
+PAGE_SIZE = mmap.PAGESIZE
+
+PackEntry = namedtuple('PackEntry', ['offset', 'length', 'etag', 'key'])
+
+
+def _align(offset):
+    return -(-offset // PAGE_SIZE) * PAGE_SIZE
+
+
+def write_pack(path, prompts):
+    """Write a pack of prompts, a dict of name -> (bundle key, audio file path)"""
+    path = Path(path)
+    blobs = {name: (key, Path(audio_path).read_bytes()) for name, (key, audio_path) in prompts.items()}
+    index = {}
+    offset = 0
+    for name, (key, data) in blobs.items():
+        index[name] = {
+            'offset': offset,
+            'length': len(data),
+            'etag': hashlib.sha256(data).hexdigest()[:32],
+            'key': key
+        }
+        offset = _align(offset + len(data))
+    index_bytes = json.dumps(index, ensure_ascii=False).encode('utf-8')
+    data_start = _align(PACK_HEADER.size + len(index_bytes))
+
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, len(index_bytes)))
+            f.write(index_bytes)
+            for name, (_, data) in blobs.items():
+                f.seek(data_start + index[name]['offset'])
+                f.write(data)
+        # Workers that already mapped the previous pack keep reading it until they restart
+        os.replace(tmp_path, path)
+    finally:
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+    return path
+
+
+def read_index(path):
+    """Return {name: PackEntry} of a pack, or None if it is missing or not a pack"""
+    try:
+        with open(path, 'rb') as f:
+            return _parse_index(f)
+    except OSError:
+        return None
+
+
+def _parse_index(f):
+    header = f.read(PACK_HEADER.size)
+    if len(header) < PACK_HEADER.size:
+        return None
+    magic, version, _, index_length = PACK_HEADER.unpack(header)
+    if magic != PACK_MAGIC or version != PACK_VERSION:
+        return None
+    try:
+        index = json.loads(f.read(index_length).decode('utf-8'))
+    except ValueError:
+        return None
+    data_start = _align(PACK_HEADER.size + index_length)
+    return {name: PackEntry(data_start + entry['offset'], entry['length'], entry['etag'], entry['key'])
+            for name, entry in index.items()}
+
+
+class PackSlice:
+    """File-like view of a byte range of a pack
+
+    read() copies small chunks out of the shared mapping; fileno() gives
+    an OS file of the same mapped pack positioned at the start of the
+    range, so servers that use sendfile can send it straight from the
+    page cache.
+    """
+
+    def __init__(self, pack, start, stop):
+        self._pack = pack
+        self._pos = start
+        self._stop = stop
+        self._fd = None
+
+    def read(self, size=-1):
+        stop = self._stop if size is None or size < 0 else min(self._stop, self._pos + size)
+        data = self._pack._map[self._pos:stop]
+        self._pos = stop
+        return data
+
+    def fileno(self):
+        if self._fd is None:
+            # A file of its own, since servers position it with lseek
+            self._fd = self._pack.reopen()
+            os.lseek(self._fd, self._pos, os.SEEK_SET)
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class PromptPack:
+    """A prompt pack mapped read-only into memory
+
+    The pack stays open for as long as it is mapped, so rebuilding it with
+    os.replace does not change what this instance serves.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            with open(self._fd, 'rb', closefd=False) as f:
+                entries = _parse_index(f)
+            if entries is None:
+                raise ValueError(f"Not a prompt pack: {path}")
+            self.entries = entries
+            self._stat = os.fstat(self._fd)
+            self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ) if self._stat.st_size > 0 else None
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def reopen(self):
+        """A new file descriptor of the mapped pack, even if the path now names a newer one"""
+        proc_path = f"/proc/self/fd/{self._fd}"
+        fd = os.open(proc_path if os.path.exists(proc_path) else self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        stat = os.fstat(fd)
+        if (stat.st_dev, stat.st_ino) != (self._stat.st_dev, self._stat.st_ino):
+            os.close(fd)
+            # Servers fall back to read(), which still serves the mapped pack
+            raise io.UnsupportedOperation("The prompt pack was replaced since it was mapped")
+        return fd
+
+    def open(self, name, start=0, stop=None):
+        """File-like object over bytes start:stop of one prompt's audio"""
+        entry = self.entries[name]
+        stop = entry.length if stop is None else min(stop, entry.length)
+        return PackSlice(self, entry.offset + start, entry.offset + stop)
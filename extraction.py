@@ -0,0 +1,182 @@
+"""
+Document text extraction
+Reads uploaded documents from disk page by page or paragraph by paragraph
+so text can flow into synthesis without holding the whole document, or a
+concatenated copy of it, in memory. Large PDFs can optionally have their
+pages extracted in parallel worker processes.
+"""
+
+import codecs
+import itertools
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Text files are decoded in blocks of this many bytes
+TEXT_BLOCK_SIZE = 64 * 1024
+
+# Pages handed to a PDF worker process at a time
+PDF_PAGES_PER_TASK = 8
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be read"""
+
+
+def _get_pdf_executor(workers):
+    """Create the shared PDF extraction process pool on first use"""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(max_workers=workers)
+        return _pdf_executor
+
+
+def _extract_pdf_pages(path, start, stop):
+    """Extract the text of pages [start, stop) in a worker process"""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+class DocumentText:
+    """Lazily extracted text of a document stored on disk
+
+    Iterating yields one chunk of text per page, paragraph or text block.
+    units_done/units_total track how much of the document has been read so
+    callers can estimate progress before the whole text is known.
+    """
+
+    def __init__(self, path, file_ext, pdf_workers=0, parallel_min_pages=32):
+        self.path = str(path)
+        self.file_ext = file_ext
+        self.pdf_workers = pdf_workers
+        self.parallel_min_pages = parallel_min_pages
+        self.units_done = 0
+        self.units_total = None
+        self._reader = None
+        self._open()
+
+    def _open(self):
+        """Check the document can be read before any text is requested"""
+        if self.file_ext == '.pdf':
+            try:
+                import PyPDF2
+            except ImportError:
+                raise ExtractionError('PDF support not available. Please install PyPDF2.')
+            try:
+                self._reader = PyPDF2.PdfReader(self.path)
+                self.units_total = len(self._reader.pages)
+            except Exception as e:
+                raise ExtractionError(f'PDF reading error: {str(e)}')
+        elif self.file_ext in {'.doc', '.docx'}:
+            try:
+                import docx
+            except ImportError:
+                raise ExtractionError('Word document support not available. Please install python-docx.')
+            try:
+                # python-docx parses the whole XML part up front; paragraphs are still yielded one by one
+                self._reader = docx.Document(self.path)
+                self.units_total = len(self._reader.paragraphs)
+            except Exception as e:
+                raise ExtractionError(f'Word document reading error: {str(e)}')
+        else:
+            self.units_total = max(1, os.path.getsize(self.path))
+
+    def fraction_read(self):
+        """Fraction of the document consumed so far, between 0 and 1"""
+        if not self.units_total:
+            return 0.0
+        return min(1.0, self.units_done / self.units_total)
+
+    def __iter__(self):
+        if self.file_ext == '.pdf':
+            return self._iter_pdf()
+        if self.file_ext in {'.doc', '.docx'}:
+            return self._iter_docx()
+        return self._iter_text()
+
+    def _iter_pdf(self):
+        if self.pdf_workers and self.units_total >= self.parallel_min_pages:
+            yield from self._iter_pdf_parallel()
+            return
+        try:
+            for page in self._reader.pages:
+                text = page.extract_text() or ""
+                self.units_done += 1
+                yield text + "\n"
+        except Exception as e:
+            raise ExtractionError(f'PDF reading error: {str(e)}')
+
+    def _iter_pdf_parallel(self):
+        """Extract page ranges in worker processes, yielding pages in order"""
+        executor = _get_pdf_executor(self.pdf_workers)
+        ranges = ((start, min(start + PDF_PAGES_PER_TASK, self.units_total))
+                  for start in range(0, self.units_total, PDF_PAGES_PER_TASK))
+        pending = deque()
+        try:
+            # Bounded lookahead keeps at most a few batches of page text in memory
+            for start, stop in itertools.islice(ranges, self.pdf_workers * 2):
+                pending.append(executor.submit(_extract_pdf_pages, self.path, start, stop))
+            while pending:
+                pages = pending.popleft().result()
+                for start, stop in itertools.islice(ranges, 1):
+                    pending.append(executor.submit(_extract_pdf_pages, self.path, start, stop))
+                for text in pages:
+                    self.units_done += 1
+                    yield text + "\n"
+        except ExtractionError:
+            raise
+        except Exception as e:
+            raise ExtractionError(f'PDF reading error: {str(e)}')
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _iter_docx(self):
+        try:
+            for paragraph in self._reader.paragraphs:
+                self.units_done += 1
+                yield paragraph.text + "\n"
+        except Exception as e:
+            raise ExtractionError(f'Word document reading error: {str(e)}')
+
+    def _iter_text(self):
+        # Incremental decoding so multi-byte characters split across blocks survive
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    block = f.read(TEXT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    self.units_done += len(block)
+                    yield decoder.decode(block)
+                yield decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            raise ExtractionError(f'Text file reading error: {str(e)}')
+
+
+def peek_text(chunks, sample_chars=2000):
+    """Read ahead until some non-blank text is found
+
+    Returns (sample, chunks) where sample is up to sample_chars of leading
+    text (empty if the document has none) and chunks is an iterator that
+    still yields the whole document.
+    """
+    chunks = iter(chunks)
+    seen = []
+    sample_len = 0
+    has_text = False
+    for chunk in chunks:
+        seen.append(chunk)
+        sample_len += len(chunk)
+        has_text = has_text or bool(chunk.strip())
+        if has_text and sample_len >= sample_chars:
+            break
+    sample = "".join(seen)[:sample_chars] if has_text else ""
+    return sample, itertools.chain(seen, chunks)
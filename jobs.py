@@ -0,0 +1,322 @@
+"""
+Background synthesis jobs
+Long document conversions run as jobs on a small bounded worker queue so
+they do not tie up a request worker. Job records live on disk, one JSON
+file per job, so progress is visible from every server process and queued
+or interrupted jobs are picked up again after a restart. Finished jobs are
+deleted once they are older than a TTL, normally that of their audio.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: claims fall back to pid files
+    fcntl = None
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = {COMPLETED, FAILED, CANCELLED}
+
+
+def _pid_alive(pid):
+    """Check whether a process with the given pid is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class JobStore:
+    """Small on-disk store of job records, one JSON file per job
+
+    Cancellation is recorded as a separate marker file so a cancel request
+    from one process can never be lost to a progress update from another.
+    """
+
+    def __init__(self, root, ttl=0, sweep_interval=0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._claims = {}  # job id -> fd holding the claim's lock
+
+    def _record_path(self, job_id):
+        return self.root / f"{job_id}.json"
+
+    def _cancel_path(self, job_id):
+        return self.root / f"{job_id}.cancel"
+
+    def _claim_path(self, job_id):
+        return self.root / f"{job_id}.lock"
+
+    def input_path(self, job_id, suffix=''):
+        """Path where a job's input file is kept until the job finishes"""
+        return self.root / f"{job_id}.input{suffix}"
+
+    def _write(self, job):
+        tmp_path = self.root / f".{job['id']}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._record_path(job['id']))
+
+    def create(self, **fields):
+        """Create a new queued job record"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': QUEUED,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'segments_done': 0,
+            'segments_total': None,
+            'error': None,
+            'result': None
+        }
+        job.update(fields)
+        with self._lock:
+            self._write(job)
+        return job
+
+    def load(self, job_id):
+        """Load a job record, or None if it does not exist"""
+        # Job ids are hex uuids; reject anything that could escape the store
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._record_path(job_id), encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job['cancel_requested'] = self._cancel_path(job_id).exists()
+        return job
+
+    def update(self, job_id, **fields):
+        """Update fields of a job record and return it"""
+        with self._lock:
+            job = self.load(job_id)
+            if job is None:
+                return None
+            job.pop('cancel_requested', None)
+            job.update(fields)
+            self._write(job)
+        return job
+
+    def request_cancel(self, job_id):
+        """Mark a job as cancelled; running jobs stop at their next segment"""
+        self._cancel_path(job_id).touch()
+
+    def is_cancelled(self, job_id):
+        return self._cancel_path(job_id).exists()
+
+    def claim(self, job_id):
+        """Take exclusive ownership of a job across processes
+
+        The claim is a lock on the job's .lock file, which the kernel drops
+        when its owner exits, so a job interrupted by a crash or restart can
+        be claimed again even by a new process that was given the same pid.
+        """
+        if fcntl is None:
+            return self._claim_by_pid(job_id)
+        claim_path = self._claim_path(job_id)
+        while True:
+            fd = os.open(str(claim_path), os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            # The previous owner may have deleted the file between our open and lock
+            try:
+                if os.stat(claim_path).st_ino == os.fstat(fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        with self._lock:
+            self._claims[job_id] = fd
+        return True
+
+    def _claim_by_pid(self, job_id):
+        """Claim with a file holding the owner's pid, taken over once that pid has gone"""
+        claim_path = self._claim_path(job_id)
+        for _ in range(2):
+            try:
+                fd = os.open(str(claim_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # Reclaim jobs whose owner died mid-run
+                try:
+                    owner = int(claim_path.read_text() or 0)
+                except (OSError, ValueError):
+                    owner = 0
+                if owner and _pid_alive(owner):
+                    return False
+                try:
+                    claim_path.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def release(self, job_id):
+        """Give up ownership of a job"""
+        with self._lock:
+            fd = self._claims.pop(job_id, None)
+        # Delete the file before unlocking it, so nobody can lock a file that is on its way out
+        try:
+            self._claim_path(job_id).unlink()
+        except FileNotFoundError:
+            pass
+        if fd is not None:
+            os.close(fd)
+
+    def unfinished(self):
+        """List jobs that were queued or running, oldest first"""
+        jobs = []
+        for record_path in self.root.glob('*.json'):
+            job = self.load(record_path.stem)
+            if job and job['status'] not in FINISHED_STATES:
+                jobs.append(job)
+        return sorted(jobs, key=lambda job: job['created_at'])
+
+    def sweep(self):
+        """Delete finished jobs older than the TTL, with their cancel marker, claim and input files"""
+        if not self.ttl:
+            return 0
+        now = time.time()
+        removed = 0
+        for record_path in self.root.glob('*.json'):
+            job = self.load(record_path.stem)
+            if job is None or job['status'] not in FINISHED_STATES:
+                continue
+            if now - (job.get('finished_at') or job['created_at']) <= self.ttl:
+                continue
+            for path in self.root.glob(f"{job['id']}.*"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except OSError:
+                pass
+
+    def start_sweeper(self):
+        """Sweep periodically in a background thread"""
+        if self._sweeper is None and self.sweep_interval and self.ttl:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='kasanoma-job-sweeper', daemon=True)
+            self._sweeper.start()
+
+
+class JobQueue:
+    """Bounded queue of jobs processed by a fixed number of background threads"""
+
+    def __init__(self, store, handler, workers=1, max_queued=100):
+        self.store = store
+        self.handler = handler
+        self.max_queued = max_queued
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._work, name=f'kasanoma-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_id):
+        """Queue a job; returns False when the queue is full"""
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            return False
+        return True
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def resume(self):
+        """Requeue jobs left unfinished by a previous run"""
+        resumed = 0
+        for job in self.store.unfinished():
+            if self.submit(job['id']):
+                resumed += 1
+        return resumed
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = self.store.load(job_id)
+        if job is None or job['status'] in FINISHED_STATES:
+            return
+        if not self.store.claim(job_id):
+            # Another process is already running it
+            return
+        try:
+            if self.store.is_cancelled(job_id):
+                self.store.update(job_id, status=CANCELLED, finished_at=time.time())
+                return
+
+            started = time.time()
+            self.store.update(job_id, status=RUNNING, started_at=started, error=None)
+
+            def report(done, total):
+                """Record progress; returns False once the job should stop
+
+                total is None while the number of segments is not yet known.
+                """
+                elapsed = time.time() - started
+                eta = elapsed / done * (total - done) if done and total is not None else None
+                self.store.update(job_id, segments_done=done, segments_total=total,
+                                  eta_seconds=round(eta, 1) if eta is not None else None)
+                return not self.store.is_cancelled(job_id)
+
+            try:
+                success, result = self.handler(job, report)
+            except Exception as e:
+                success, result = False, f"Job error: {str(e)}"
+
+            if self.store.is_cancelled(job_id):
+                self.store.update(job_id, status=CANCELLED, finished_at=time.time(), eta_seconds=None)
+            elif success:
+                self.store.update(job_id, status=COMPLETED, result=result,
+                                  finished_at=time.time(), eta_seconds=0)
+            else:
+                self.store.update(job_id, status=FAILED, error=result,
+                                  finished_at=time.time(), eta_seconds=None)
+        finally:
+            self.store.release(job_id)
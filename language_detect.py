@@ -0,0 +1,219 @@
+"""
+Language detection
+Guesses the language of a text from a bounded sample, so the cost is the
+same for a sentence and a whole book. Non-Latin scripts are recognised
+from Unicode ranges; Latin-script text is scored against small character
+trigram profiles of the installed languages, so Twi, Chichewa and Makhuwa
+are told apart from English. Text that matches no profile well enough is
+left to the caller's fallback rather than given to the nearest language.
+"""
+
+import bisect
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+# Characters of a text that are ever looked at
+SAMPLE_CHARS = 600
+
+# Share of a sample's trigrams the best profile must know for a Latin-script
+# match; text in a language without a profile scores well below this
+MIN_COVERAGE = 0.28
+
+# Trigrams kept per language profile
+PROFILE_SIZE = 400
+
+# Optional extra training text dropped into a language folder
+SAMPLE_FILENAME = 'sample.txt'
+
+# (first code point, last code point, script), sorted by first code point
+SCRIPT_RANGES = [
+    (0x0041, 0x005A, 'Latin'),
+    (0x0061, 0x007A, 'Latin'),
+    (0x00C0, 0x024F, 'Latin'),
+    (0x0250, 0x02AF, 'Latin'),      # IPA letters such as ɛ and ɔ used by Akan orthography
+    (0x0370, 0x03FF, 'Greek'),
+    (0x0400, 0x04FF, 'Cyrillic'),
+    (0x0590, 0x05FF, 'Hebrew'),
+    (0x0600, 0x06FF, 'Arabic'),
+    (0x0900, 0x097F, 'Devanagari'),
+    (0x0E00, 0x0E7F, 'Thai'),
+    (0x1200, 0x139F, 'Ethiopic'),
+    (0x1E00, 0x1EFF, 'Latin'),
+    (0x3040, 0x30FF, 'Kana'),
+    (0x4E00, 0x9FFF, 'Han'),
+    (0xAC00, 0xD7AF, 'Hangul'),
+]
+_RANGE_STARTS = [start for start, _, _ in SCRIPT_RANGES]
+
+# Runs of anything that is not a letter
+_NON_LETTERS = re.compile(r'[\W\d_]+')
+
+# Language folder name expected for each non-Latin script, with the share of
+# letters that must be in that script
+SCRIPT_LANGUAGES = [
+    ('Kana', 'Japanese', 0.1),
+    ('Han', 'Chinese', 0.3),
+    ('Hangul', 'Korean', 0.3),
+    ('Cyrillic', 'Russian', 0.3),
+    ('Arabic', 'Arabic', 0.3),
+    ('Thai', 'Thai', 0.3),
+    ('Ethiopic', 'Amharic', 0.3),
+    ('Devanagari', 'Hindi', 0.3),
+    ('Greek', 'Greek', 0.3),
+    ('Hebrew', 'Hebrew', 0.3),
+]
+
+# Seed text for the Latin-script languages we ship or expect voices for.
+# A sample.txt in a language folder adds to (or provides) its profile.
+SEED_TEXTS = {
+    'English': (
+        "Welcome to the health survey. Please answer the following questions. "
+        "The quick brown fox jumps over the lazy dog. What is your name and where do you live? "
+        "Thank you for your time, we have recorded all of your answers. "
+        "This is a sample of ordinary English text with the most common words of the language."
+    ),
+    'Twi': (
+        "Me ma wo akwaaba. Twerɛ wo nsɛm na me nka no wɔ Asante kasa mu. "
+        "Me ma wo akwaaba ɛba apomuden nsɛmmisa afidie no so. Woho ayɛ hyehyeehye anaa? "
+        "Ɛyɛ a wobɔ ɛwa anaa? Woyɛm ɛyɛ wo ya anaa? Woti ɛyɛ wo ya anaa? "
+        "Me pɛ sɛ me kɔ sukuu no mu. Wo ho te sɛn? Me ho yɛ, meda wo ase. "
+        "Sɛ woayɛ krado sɛ wobɛhyɛ aseɛ a, mia ahabanmono no so. Yɛda wo ase."
+    ),
+    'Chichewa': (
+        "Takulandirani. Lembani chilichonse kuti mumve chikuyankhulidwa pa Chichewa. "
+        "Moni, muli bwanji? Ndili bwino, zikomo kwambiri. Dzina langa ndi Chikondi. "
+        "Ndikufuna kupita kusukulu lero. Anthu onse amabadwa omasuka ndi ofanana. "
+        "Madzi ndi ofunika kwambiri pa moyo wathu. Ana akusewera panja ndi anzawo."
+    ),
+    'Makhuwa': (
+        "Salaamu, mwaahaaleeleeni? Koxukhuru vanjene. Nihiku nno ninnaphwanya. "
+        "Atthu othene annayaria ootaphuwa. Muluku onnaphenta atthu othene. "
+        "Kinnaphavela orowa oxikola. Mwaana ookhala va nikhuni wira oxuxe. "
+        "Nlelo ninnaphwanya maasi ni yoolya wira atthu akhale saana."
+    ),
+}
+
+
+def script_of(char):
+    """Return the script name of a character, or None for digits, punctuation and space"""
+    code = ord(char)
+    if code < 0x80:
+        # ASCII fast path
+        return 'Latin' if char.isalpha() else None
+    i = bisect.bisect_right(_RANGE_STARTS, code) - 1
+    if i >= 0 and code <= SCRIPT_RANGES[i][1]:
+        return SCRIPT_RANGES[i][2]
+    return None
+
+
+def take_sample(text, sample_chars=SAMPLE_CHARS):
+    """Take a bounded sample from the start and the middle of a text"""
+    if len(text) <= sample_chars:
+        return text
+    head = sample_chars * 2 // 3
+    middle = len(text) // 2
+    return text[:head] + " " + text[middle:middle + sample_chars - head]
+
+
+def _trigram_counts(words):
+    """Count letter trigrams of lower-case words, with word boundaries marked by spaces"""
+    if not words:
+        return Counter()
+    text = '  ' + ' '.join(words) + ' '
+    return Counter(map(''.join, zip(text, text[1:], text[2:])))
+
+
+def _trigrams(text):
+    """Trigram counts of a text"""
+    return _trigram_counts(_NON_LETTERS.sub(' ', text.lower()).split())
+
+
+class LanguageProfile:
+    """Log-probabilities of the most common trigrams of one language"""
+
+    def __init__(self, text, size=PROFILE_SIZE):
+        counts = _trigrams(text).most_common(size)
+        total = sum(count for _, count in counts) or 1
+        vocabulary = len(counts) + 1
+        self.logprobs = {tri: math.log((count + 1) / (total + vocabulary)) for tri, count in counts}
+        self.unseen = math.log(1 / (total + vocabulary))
+
+    def score(self, trigram_counts):
+        """Log-likelihood of a bag of trigrams under this profile, and how many of them it knows"""
+        logprobs = self.logprobs
+        unseen = self.unseen
+        score = 0.0
+        known = 0
+        for tri, count in trigram_counts.items():
+            logprob = logprobs.get(tri)
+            if logprob is None:
+                score += count * unseen
+            else:
+                score += count * logprob
+                known += count
+        return score, known
+
+
+class LanguageDetector:
+    """Script and trigram based detector for the installed languages"""
+
+    def __init__(self, languages, sample_chars=SAMPLE_CHARS):
+        """languages maps folder name to its folder path (or None)"""
+        self.sample_chars = sample_chars
+        self.languages = set(languages)
+        self.profiles = {}
+        for name, folder in languages.items():
+            text = SEED_TEXTS.get(name, '')
+            if folder:
+                sample_path = Path(folder) / SAMPLE_FILENAME
+                if sample_path.exists():
+                    try:
+                        text += "\n" + sample_path.read_text(encoding='utf-8')
+                    except (OSError, UnicodeDecodeError):
+                        pass
+            if text.strip():
+                self.profiles[name] = LanguageProfile(text)
+
+    def detect(self, text, fallback=None):
+        """Return the folder name of the most likely installed language, or fallback"""
+        words = _NON_LETTERS.sub(' ', take_sample(text, self.sample_chars)).split()
+
+        # Scripts are counted per distinct letter, which is far cheaper than per character
+        scripts = {}
+        not_latin = {}
+        for char, count in Counter(''.join(words)).items():
+            script = 'Latin' if char.isascii() else script_of(char)
+            if script is not None:
+                scripts[script] = scripts.get(script, 0) + count
+            if script != 'Latin':
+                not_latin[ord(char)] = ' '
+
+        letters = sum(scripts.values())
+        if not letters:
+            return fallback
+
+        for script, language, threshold in SCRIPT_LANGUAGES:
+            if scripts.get(script, 0) / letters > threshold and language in self.languages:
+                return language
+
+        if scripts.get('Latin', 0) / letters > 0.3:
+            latin = ' '.join(words).lower()
+            if not_latin:
+                # Other scripts break words, as punctuation does
+                latin = latin.translate(not_latin)
+            trigrams = _trigram_counts(latin.split())
+            best, best_score, best_known = None, None, 0
+            for name, profile in self.profiles.items():
+                score, known = profile.score(trigrams)
+                if best_score is None or score > best_score:
+                    best, best_score, best_known = name, score, known
+            if best is not None:
+                if best_known >= MIN_COVERAGE * sum(trigrams.values()):
+                    return best
+                return fallback
+            if 'English' in self.languages:
+                return 'English'
+
+        return fallback
@@ -0,0 +1,282 @@
+"""
+Metrics
+A small, dependency-free set of Prometheus-style counters, gauges and
+histograms, rendered in the Prometheus text exposition format by
+/api/metrics. Values are per process; scrape each worker (or sum them)
+when running several gunicorn workers. Stage timings are also collected
+per request for the Server-Timing header.
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans quick cache hits to long document conversions
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """A value that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                result.append((f"{self.name}_bucket", key, (('le', _format_value(bound)),), cumulative))
+            result.append((f"{self.name}_sum", key, (), total))
+            result.append((f"{self.name}_count", key, (), count))
+        return result
+
+
+class RequestTimings:
+    """Stage durations of a single request, summed over its threads"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, seconds):
+        with self._lock:
+            total, count = self._stages.get(stage_name, (0.0, 0))
+            self._stages[stage_name] = (total + seconds, count + 1)
+
+    def server_timing(self):
+        """The stages as a Server-Timing header value, durations in milliseconds
+
+        Segments are synthesized in parallel, so stage totals can add up to
+        more than the request's own total.
+        """
+        with self._lock:
+            stages = list(self._stages.items())
+        entries = []
+        for name, (total, count) in stages:
+            entry = f"{name};dur={total * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count}x"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_request_timings = contextvars.ContextVar('kasanoma_request_timings', default=None)
+
+
+def start_request_timings():
+    """Collect stage timings for the current request from here on"""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def end_request_timings():
+    _request_timings.set(None)
+
+
+class StageHistogram(Histogram):
+    """Stage histogram that also reports to the current request's timings"""
+
+    def observe(self, value, **labels):
+        super().observe(value, **labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(labels.get('stage', ''), value)
+
+
+class Registry:
+    """Every metric of the process, plus collectors that report on scrape"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collect):
+        """collect() is called before each render to refresh derived gauges"""
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.label_names, key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = StageHistogram(
+    'kasanoma_stage_seconds',
+    'Time spent in each stage of handling a request',
+    ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'kasanoma_request_seconds',
+    'Total time to handle a request, by endpoint',
+    ['endpoint']
+)
+IN_FLIGHT = Gauge('kasanoma_requests_in_flight', 'Requests currently being handled')
+AUDIO_SECONDS = Counter('kasanoma_audio_seconds_total', 'Seconds of audio synthesized', ['voice'])
+SYNTHESIS_SECONDS = Counter('kasanoma_synthesis_seconds_total', 'Seconds spent synthesizing', ['voice'])
+REAL_TIME_FACTOR = Gauge('kasanoma_real_time_factor',
+                         'Synthesis time per second of audio produced, by voice', ['voice'])
+SYNTHESIS_FAILURES = Counter('kasanoma_synthesis_failures_total',
+                             'Failed synthesis calls, by reason (timeout or error)', ['reason'])
+REJECTED_REQUESTS = Counter('kasanoma_rejected_requests_total',
+                            'Requests turned away, by reason (queue_full, queue_timeout, rate_limited, too_large)',
+                            ['reason'])
+ADMISSION_REQUESTS = Gauge('kasanoma_admission_requests', 'Synthesis requests running or queued', ['state'])
+CACHE_LOOKUPS = Gauge('kasanoma_cache_lookups', 'Cache lookups by cache and result', ['cache', 'result'])
+CACHE_HIT_RATE = Gauge('kasanoma_cache_hit_ratio', 'Share of cache lookups that were hits', ['cache'])
+
+
+def stage(name):
+    """Time a with block as one stage of a request"""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def record_synthesis(voice, synthesis_seconds, audio_seconds):
+    """Account one finished synthesis towards the per-voice real-time factor"""
+    SYNTHESIS_SECONDS.inc(synthesis_seconds, voice=voice)
+    AUDIO_SECONDS.inc(audio_seconds, voice=voice)
+
+
+def record_failure(error):
+    """Count a failed synthesis call"""
+    SYNTHESIS_FAILURES.inc(reason='timeout' if 'timed out' in str(error) else 'error')
+
+
+def _update_real_time_factor():
+    with AUDIO_SECONDS._lock:
+        audio = dict(AUDIO_SECONDS._values)
+    for key, seconds in audio.items():
+        if seconds:
+            REAL_TIME_FACTOR.set(SYNTHESIS_SECONDS._values.get(key, 0) / seconds, voice=key[0])
+
+
+REGISTRY.add_collector(_update_real_time_factor)
+
+
+def timed_iter(iterable, name):
+    """Yield from iterable, timing each step as the given stage"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        yield item
@@ -0,0 +1,254 @@
+"""
+In-process ONNX Runtime synthesis
+An alternative to driving the piper binary: text is phonemized with
+piper_phonemize (espeak-ng), mapped to ids with the voice's
+phoneme_id_map, and run through the voice's .onnx model in this process.
+Each voice gets one cached InferenceSession, and audio comes back as a
+NumPy int16 array without touching the disk. Sentences can optionally be
+micro-batched so several utterances of a voice share one forward pass, and
+phoneme ids of texts seen before come from a PhonemeCache.
+
+Needs the optional packages numpy, onnxruntime and piper-phonemize.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import wave
+from pathlib import Path
+
+from batching import MicroBatcher
+from metrics import STAGE_SECONDS
+
+# Special symbols of Piper's phoneme_id_map
+PAD = "_"
+BOS = "^"
+EOS = "$"
+
+
+class OnnxVoice:
+    """A loaded voice: its model.onnx.json settings and inference session"""
+
+    def __init__(self, model_path, config, session):
+        self.model_path = str(model_path)
+        self.config = config
+        self.session = session
+        self.sample_rate = config.get('audio', {}).get('sample_rate', 22050)
+        self.espeak_voice = config.get('espeak', {}).get('voice', 'en-us')
+        self.phoneme_type = config.get('phoneme_type', 'espeak')
+        self.num_speakers = config.get('num_speakers', 1)
+        self.phoneme_id_map = config.get('phoneme_id_map', {})
+        # Voices sharing an espeak voice and id map can share phonemization results
+        self.id_map_digest = hashlib.sha1(
+            json.dumps(self.phoneme_id_map, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:12]
+        inference = config.get('inference', {})
+        self.noise_scale = inference.get('noise_scale', 0.667)
+        self.length_scale = inference.get('length_scale', 1.0)
+        self.noise_w = inference.get('noise_w', 0.8)
+        self.input_names = {i.name for i in session.get_inputs()}
+        # Some exports also return each row's audio length in samples, which lets
+        # padded rows of a batch be cut back to exactly their own audio
+        self.reports_lengths = len(session.get_outputs()) > 1
+
+    def phonemes_to_ids(self, phonemes):
+        """Map phonemes to ids the way Piper does: BOS, each phoneme followed by PAD, EOS"""
+        id_map = self.phoneme_id_map
+        ids = list(id_map[BOS])
+        for phoneme in phonemes:
+            if phoneme not in id_map:
+                # Piper skips phonemes the voice was not trained on
+                continue
+            ids.extend(id_map[phoneme])
+            ids.extend(id_map[PAD])
+        ids.extend(id_map[EOS])
+        return ids
+
+
+class OnnxEngine:
+    """Runs Piper voices in-process with onnxruntime's CPU provider"""
+
+    def __init__(self, intra_op_threads=1, inter_op_threads=1, espeak_data_path=None,
+                 sentence_silence=0.0, load_config=None, max_batch_size=1, max_batch_delay=0.005,
+                 batch_workers=1, phoneme_cache=None):
+        # Imported here so the server still starts without the optional packages
+        import numpy
+        import onnxruntime
+        from piper_phonemize import phonemize_espeak, phonemize_codepoints
+
+        self._np = numpy
+        self._ort = onnxruntime
+        # Part of synthesis cache keys, in place of the piper binary's version
+        self.version = f"onnxruntime-{onnxruntime.__version__}"
+        self._phonemize_espeak = phonemize_espeak
+        self._phonemize_codepoints = phonemize_codepoints
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.espeak_data_path = str(espeak_data_path) if espeak_data_path else None
+        self.sentence_silence = sentence_silence
+        self.load_config = load_config
+        self._voices = {}
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.phoneme_cache = phoneme_cache
+        # Batching only pays off once several sentences can share a pass
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(self._run_batch, max_batch_size=max_batch_size,
+                                        max_delay=max_batch_delay, workers=batch_workers)
+
+    def load_voice(self, model_path):
+        """Get the cached OnnxVoice for a model, creating its session on first use"""
+        model_path = str(model_path)
+        voice = self._voices.get(model_path)
+        if voice is not None:
+            return voice
+
+        with self._lock:
+            voice = self._voices.get(model_path)
+            if voice is None:
+                if self.load_config is not None:
+                    config = self.load_config(model_path)
+                else:
+                    with open(f"{model_path}.json", encoding='utf-8') as f:
+                        config = json.load(f)
+                load_started = time.perf_counter()
+                options = self._ort.SessionOptions()
+                options.intra_op_num_threads = self.intra_op_threads
+                options.inter_op_num_threads = self.inter_op_threads
+                options.graph_optimization_level = self._ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                session = self._ort.InferenceSession(model_path, sess_options=options,
+                                                     providers=['CPUExecutionProvider'])
+                voice = OnnxVoice(model_path, config, session)
+                STAGE_SECONDS.observe(time.perf_counter() - load_started, stage='model_load')
+                self._voices[model_path] = voice
+        return voice
+
+    def phonemize(self, voice, text):
+        """Phonemize text into one list of phonemes per sentence"""
+        if voice.phoneme_type == 'text':
+            return self._phonemize_codepoints(text)
+        if self.espeak_data_path:
+            return self._phonemize_espeak(text, voice.espeak_voice, data_path=self.espeak_data_path)
+        return self._phonemize_espeak(text, voice.espeak_voice)
+
+    def phoneme_ids(self, voice, text):
+        """Phoneme ids of each sentence of text, memoized when a cache is set"""
+        cache_key = None
+        if self.phoneme_cache is not None:
+            phonemizer = 'text' if voice.phoneme_type == 'text' else voice.espeak_voice
+            cache_key = self.phoneme_cache.make_key(phonemizer, text, voice.id_map_digest)
+            sentences = self.phoneme_cache.get(cache_key)
+            if sentences is not None:
+                return sentences
+        with STAGE_SECONDS.time(stage='phonemize'):
+            sentences = [voice.phonemes_to_ids(phonemes) for phonemes in self.phonemize(voice, text)]
+        if cache_key is not None:
+            self.phoneme_cache.put(cache_key, sentences)
+        return sentences
+
+    def synthesize_ids(self, voice, phoneme_ids, speaker_id=None):
+        """Run the model on one sentence of phoneme ids and return int16 PCM"""
+        return self.synthesize_batch(voice, [phoneme_ids], speaker_id)[0]
+
+    def synthesize_batch(self, voice, batch, speaker_id=None):
+        """Run the model once on several sentences of phoneme ids
+
+        Sequences are padded to the longest one and passed with their
+        lengths, and each row is cut back to the audio length the model
+        reports for it. How long a sentence's audio is depends on the
+        durations the model predicts, so with a model that reports no
+        lengths a padded row cannot be cut exactly and every sentence runs
+        on its own.
+        """
+        if voice.reports_lengths or len(batch) == 1:
+            return self._run_model(voice, batch, speaker_id)
+        return [self._run_model(voice, [ids], speaker_id)[0] for ids in batch]
+
+    def _run_model(self, voice, batch, speaker_id):
+        np = self._np
+        lengths = [len(ids) for ids in batch]
+        longest = max(lengths)
+        pad_id = voice.phoneme_id_map[PAD][0]
+        ids = np.full((len(batch), longest), pad_id, dtype=np.int64)
+        for row, phoneme_ids in enumerate(batch):
+            ids[row, :len(phoneme_ids)] = np.asarray(phoneme_ids)
+        inputs = {
+            'input': ids,
+            'input_lengths': np.array(lengths, dtype=np.int64),
+            'scales': np.array([voice.noise_scale, voice.length_scale, voice.noise_w], dtype=np.float32)
+        }
+        if 'sid' in voice.input_names:
+            inputs['sid'] = np.full(len(batch), speaker_id or 0, dtype=np.int64)
+
+        outputs = voice.session.run(None, inputs)
+        audio = outputs[0].reshape(len(batch), -1)
+        if voice.reports_lengths:
+            sample_counts = np.asarray(outputs[1]).reshape(-1)
+            return [self.to_int16(row[:int(count)]) for row, count in zip(audio, sample_counts)]
+        return [self.to_int16(row) for row in audio]
+
+    def _run_batch(self, key, batch):
+        model_path, speaker_id = key
+        return self.synthesize_batch(self.load_voice(model_path), batch, speaker_id)
+
+    def to_int16(self, audio):
+        """Normalize float audio to the int16 range the way Piper does"""
+        np = self._np
+        peak = max(0.01, float(np.max(np.abs(audio)))) if audio.size else 0.01
+        return np.clip(audio * (32767.0 / peak), -32767, 32767).astype(np.int16)
+
+    def synthesize_pcm(self, model_path, text, speaker_id=None):
+        """Synthesize text to (int16 NumPy array, sample rate) without a temp file"""
+        np = self._np
+        voice = self.load_voice(model_path)
+        gap = np.zeros(int(voice.sample_rate * self.sentence_silence), dtype=np.int16)
+        sentences = self.phoneme_ids(voice, text)
+        if self.batcher is not None:
+            # Queue every sentence first so they can join the same batches
+            futures = [self.batcher.submit((voice.model_path, speaker_id), ids) for ids in sentences]
+            audios = [future.result() for future in futures]
+        else:
+            audios = [self.synthesize_ids(voice, ids, speaker_id) for ids in sentences]
+        pieces = []
+        for sentence_audio in audios:
+            if pieces and gap.size:
+                pieces.append(gap)
+            pieces.append(sentence_audio)
+        audio = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.int16)
+        return audio, voice.sample_rate
+
+    def synthesize(self, model_path, text, output_path, timeout=None):
+        """Synthesize text to a WAV file; same contract as PiperPool.synthesize
+
+        timeout is accepted for compatibility; in-process inference cannot be interrupted.
+        """
+        try:
+            audio, sample_rate = self.synthesize_pcm(model_path, text)
+            with wave.open(str(output_path), 'wb') as out:
+                out.setnchannels(1)
+                out.setsampwidth(2)
+                out.setframerate(sample_rate)
+                out.writeframes(audio.tobytes())
+            return True, str(Path(output_path))
+        except Exception as e:
+            self.failures += 1
+            return False, f"TTS error: {str(e)}"
+
+    def stats(self):
+        """Get a summary of loaded voices for status reporting"""
+        return {
+            'backend': 'onnxruntime',
+            'intra_op_threads': self.intra_op_threads,
+            'inter_op_threads': self.inter_op_threads,
+            'loaded_voices': sorted(self._voices),
+            'failures': self.failures,
+            'batching': self.batcher.stats() if self.batcher else None,
+            'phoneme_cache': self.phoneme_cache.stats() if self.phoneme_cache else None
+        }
+
+    def shutdown(self):
+        """Stop the batch scheduler"""
+        if self.batcher is not None:
+            self.batcher.shutdown()
@@ -0,0 +1,170 @@
+"""
+Phonemization cache
+Memoizes phoneme ids per (espeak voice, normalized text) so repeated
+sentences skip espeak-ng. Ids are kept as compact unsigned 16-bit arrays,
+one per sentence espeak found in the text, in an in-memory LRU with an
+optional SQLite tier on disk that survives restarts and is shared by the
+workers on a host. The disk tier is capped by entry count; the least
+recently used entries are deleted first, with last access refreshed at most
+once a minute as in the synthesis cache.
+"""
+
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+from synthesis_cache import TOUCH_INTERVAL, normalize_text
+
+# Phoneme ids are small; 16 bits leaves room for any phoneme_id_map
+ID_TYPECODE = 'H'
+
+
+def pack_sentences(sentences):
+    """Flatten per-sentence id arrays into one array: count, lengths, then ids"""
+    packed = array(ID_TYPECODE, [len(sentences)])
+    packed.extend(len(ids) for ids in sentences)
+    for ids in sentences:
+        packed.extend(ids)
+    return packed
+
+
+def unpack_sentences(packed):
+    """Split an array built by pack_sentences back into per-sentence arrays"""
+    count = packed[0]
+    lengths = packed[1:count + 1]
+    sentences = []
+    start = count + 1
+    for length in lengths:
+        sentences.append(packed[start:start + length])
+        start += length
+    return sentences
+
+
+class PhonemeCache:
+    """LRU of phoneme id arrays with an optional persistent tier"""
+
+    def __init__(self, max_entries=10000, disk_dir=None, max_disk_entries=200000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.disk_evictions = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.db_path = None
+        if disk_dir:
+            Path(disk_dir).mkdir(parents=True, exist_ok=True)
+            self.db_path = Path(disk_dir) / "phonemes.sqlite3"
+            conn = self._connect()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS phonemes ("
+                "key TEXT PRIMARY KEY, ids BLOB NOT NULL, last_access REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(phonemes)")]
+            if 'last_access' not in columns:
+                # Caches written before the cap; their entries count as the oldest
+                try:
+                    conn.execute("ALTER TABLE phonemes ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+                except sqlite3.OperationalError:
+                    # Another worker added it first
+                    pass
+            conn.execute("CREATE INDEX IF NOT EXISTS phonemes_lru ON phonemes (last_access)")
+
+    def _connect(self):
+        """Get this thread's SQLite connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(espeak_voice, text, id_map_digest=''):
+        """Key for a text phonemized by an espeak voice with a given id map"""
+        return f"{espeak_voice}\x1f{id_map_digest}\x1f{normalize_text(text)}"
+
+    def get(self, key):
+        """Return the per-sentence id arrays for key, or None"""
+        with self._lock:
+            packed = self._entries.get(key)
+            if packed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return unpack_sentences(packed)
+
+        if self.db_path is not None:
+            conn = self._connect()
+            row = conn.execute("SELECT ids, last_access FROM phonemes WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                now = time.time()
+                if now - row[1] >= TOUCH_INTERVAL:
+                    conn.execute("UPDATE phonemes SET last_access = ? WHERE key = ?", (now, key))
+                packed = array(ID_TYPECODE)
+                packed.frombytes(row[0])
+                self._remember(key, packed)
+                with self._lock:
+                    self.disk_hits += 1
+                return unpack_sentences(packed)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, sentences):
+        """Store the per-sentence id arrays of a text"""
+        try:
+            packed = pack_sentences(sentences)
+        except OverflowError:
+            # Too long to pack into 16 bits; just don't cache it
+            return
+        self._remember(key, packed)
+        if self.db_path is not None:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO phonemes (key, ids, last_access) VALUES (?, ?, ?)",
+                         (key, packed.tobytes(), time.time()))
+            self._evict_disk(conn)
+
+    def _evict_disk(self, conn):
+        """Delete least-recently-used rows until the disk tier fits max_disk_entries"""
+        if self.max_disk_entries <= 0:
+            return
+        excess = conn.execute("SELECT COUNT(*) FROM phonemes").fetchone()[0] - self.max_disk_entries
+        if excess <= 0:
+            return
+        deleted = conn.execute(
+            "DELETE FROM phonemes WHERE key IN (SELECT key FROM phonemes ORDER BY last_access LIMIT ?)",
+            (excess,)
+        ).rowcount
+        with self._lock:
+            self.disk_evictions += deleted
+
+    def _remember(self, key, packed):
+        with self._lock:
+            self._entries[key] = packed
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Get cache counters"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'size_bytes': sum(packed.itemsize * len(packed) for packed in self._entries.values()),
+                'disk_path': str(self.db_path) if self.db_path else None,
+                'max_disk_entries': self.max_disk_entries,
+                'disk_evictions': self.disk_evictions,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
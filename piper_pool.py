@@ -0,0 +1,308 @@
+"""
+Persistent Piper worker pool
+Keeps long-lived Piper processes per voice model so the ONNX voice and
+espeak-ng are loaded once instead of on every request. Utterances are sent
+over stdin using Piper's --json-input mode.
+"""
+
+import json
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from metrics import STAGE_SECONDS
+
+
+class PiperWorker:
+    """A single long-lived Piper process bound to one voice model"""
+
+    def __init__(self, piper_path, model_path, work_dir):
+        self.piper_path = Path(piper_path)
+        self.model_path = str(model_path)
+        self.work_dir = Path(work_dir)
+        self.process = None
+        self.restarts = 0
+        self.requests_served = 0
+        self.served_since_start = 0
+        self.started_at = None
+        self._lines = None
+        self._closed = None
+        self._stderr_tail = deque(maxlen=20)
+        self.start()
+
+    def start(self):
+        """Spawn the Piper process and the threads draining its output"""
+        cmd = [
+            str(self.piper_path),
+            "--model", self.model_path,
+            "--json-input",
+            "--output_dir", str(self.work_dir)
+        ]
+        spawn_started = time.perf_counter()
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            bufsize=1
+        )
+        self.started_at = time.time()
+        self.served_since_start = 0
+        STAGE_SECONDS.observe(time.perf_counter() - spawn_started, stage='process_spawn')
+        # Each process gets its own line queue so a late line from a killed
+        # process can never be mistaken for a reply from its replacement
+        self._lines = queue.Queue()
+        self._closed = threading.Event()
+        threading.Thread(target=self._read_stdout, args=(self.process, self._lines, self._closed),
+                         daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.process,), daemon=True).start()
+
+    def _read_stdout(self, process, lines, closed):
+        """Forward each output path Piper prints to the line queue"""
+        for line in process.stdout:
+            lines.put(line.strip())
+        # Flag EOF before the process is reaped so is_alive() never lags behind
+        closed.set()
+        lines.put(None)
+
+    def _read_stderr(self, process):
+        """Keep the last few stderr lines for error reporting"""
+        for line in process.stderr:
+            self._stderr_tail.append(line.rstrip())
+
+    def is_alive(self):
+        """Check whether the Piper process is still running"""
+        return self.process is not None and not self._closed.is_set() and self.process.poll() is None
+
+    def stop(self):
+        """Terminate the Piper process"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def restart(self):
+        """Replace a dead or wedged Piper process with a fresh one"""
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def stderr_tail(self):
+        """Return recent stderr output as a single string"""
+        return "\n".join(self._stderr_tail)
+
+    def synthesize(self, text, output_path, timeout=30):
+        """Synthesize one utterance to output_path"""
+        if not self.is_alive():
+            return False, f"TTS failed: Piper worker exited ({self.stderr_tail()})"
+
+        output_file = Path(output_path)
+        request_line = json.dumps({"text": text, "output_file": str(output_file)}, ensure_ascii=False)
+
+        try:
+            self.process.stdin.write(request_line + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            return False, f"TTS failed: could not write to Piper ({e})"
+
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            # A wedged process cannot be trusted with the next request
+            self.stop()
+            return False, "TTS operation timed out"
+
+        if line is None:
+            return False, f"TTS failed: {self.stderr_tail()}"
+
+        self.requests_served += 1
+        self.served_since_start += 1
+        if output_file.exists():
+            return True, str(output_file)
+        return False, f"TTS failed: Piper reported {line} but no audio was written"
+
+
+class PiperPool:
+    """Pool of persistent Piper workers, keyed by voice model path"""
+
+    def __init__(self, piper_path, size=2, timeout=30, health_interval=30):
+        self.piper_path = Path(piper_path)
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.work_dir = Path(tempfile.mkdtemp(prefix="kasanoma-piper-"))
+        self._idle = {}       # model path -> LifoQueue of idle workers
+        self._workers = {}    # model path -> list of all workers
+        self._lock = threading.Lock()
+        self._closed = False
+        self._health_thread = None
+        self.failures = 0
+        self.timeouts = 0
+
+    def _acquire(self, model_path, timeout):
+        """Take an idle worker for the model, spawning one if under the size limit"""
+        spawn = False
+        with self._lock:
+            idle = self._idle.setdefault(model_path, queue.LifoQueue())
+            workers = self._workers.setdefault(model_path, [])
+            if idle.empty() and len(workers) < self.size:
+                # Reserve the slot now, spawn outside the lock
+                workers.append(None)
+                spawn = True
+
+        if spawn:
+            try:
+                worker = PiperWorker(self.piper_path, model_path, self.work_dir)
+            except Exception:
+                with self._lock:
+                    workers.remove(None)
+                raise
+            with self._lock:
+                workers[workers.index(None)] = worker
+            return worker
+
+        try:
+            worker = idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        if not worker.is_alive():
+            try:
+                worker.restart()
+            except Exception:
+                # Keep the slot; the next acquire or health check retries
+                idle.put(worker)
+                raise
+        return worker
+
+    def _count(self, counter):
+        """Increment a failure counter from any request thread"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _release(self, model_path, worker):
+        """Return a worker to the idle queue"""
+        self._idle[model_path].put(worker)
+
+    def synthesize(self, model_path, text, output_path, timeout=None):
+        """Synthesize text with a pooled worker for the given voice model"""
+        if self._closed:
+            return False, "Piper pool has been shut down"
+
+        timeout = timeout or self.timeout
+        model_path = str(model_path)
+        started = time.monotonic()
+
+        try:
+            worker = self._acquire(model_path, timeout)
+        except Exception as e:
+            self._count('failures')
+            return False, f"TTS error: could not start Piper ({e})"
+        finally:
+            STAGE_SECONDS.observe(time.monotonic() - started, stage='queue_wait')
+
+        if worker is None:
+            self._count('timeouts')
+            return False, "TTS operation timed out waiting for a free Piper worker"
+
+        try:
+            remaining = max(1, timeout - (time.monotonic() - started))
+            # A fresh process loads its model while answering its first request
+            stage = 'model_load' if worker.served_since_start == 0 else 'synthesis'
+            with STAGE_SECONDS.time(stage=stage):
+                success, result = worker.synthesize(text, output_path, timeout=remaining)
+            if not success:
+                if result == "TTS operation timed out":
+                    self._count('timeouts')
+                else:
+                    self._count('failures')
+            return success, result
+        finally:
+            # Dead workers are restarted on their next acquire or health check
+            self._release(model_path, worker)
+
+    def warm_up(self, model_paths):
+        """Start one worker per model ahead of the first request"""
+        for model_path in model_paths:
+            model_path = str(model_path)
+            worker = self._acquire(model_path, self.timeout)
+            if worker is not None:
+                self._release(model_path, worker)
+
+    def health_check(self):
+        """Restart any idle worker whose process has exited"""
+        restarted = 0
+        for model_path, idle in list(self._idle.items()):
+            checked = []
+            while True:
+                try:
+                    checked.append(idle.get_nowait())
+                except queue.Empty:
+                    break
+            for worker in checked:
+                if not worker.is_alive():
+                    try:
+                        worker.restart()
+                        restarted += 1
+                    except Exception:
+                        self._count('failures')
+                idle.put(worker)
+        return restarted
+
+    def _health_loop(self):
+        while not self._closed:
+            time.sleep(self.health_interval)
+            if not self._closed:
+                self.health_check()
+
+    def start_health_checks(self):
+        """Run health checks periodically in a background thread"""
+        if self._health_thread is None and self.health_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def stats(self):
+        """Get a summary of the pool for status reporting"""
+        with self._lock:
+            voices = {}
+            for model_path, workers in self._workers.items():
+                live = [w for w in workers if w is not None]
+                voices[model_path] = {
+                    'workers': len(live),
+                    'alive': sum(1 for w in live if w.is_alive()),
+                    'idle': self._idle[model_path].qsize(),
+                    'restarts': sum(w.restarts for w in live),
+                    'requests_served': sum(w.requests_served for w in live)
+                }
+        return {
+            'size_per_voice': self.size,
+            'timeout': self.timeout,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'voices': voices
+        }
+
+    def shutdown(self):
+        """Stop all workers and remove the pool's work directory"""
+        self._closed = True
+        with self._lock:
+            workers = [w for ws in self._workers.values() for w in ws if w is not None]
+        for worker in workers:
+            worker.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -0,0 +1,165 @@
+"""
+On-demand request profiling
+An admin switches profiling on for a number of requests; a random sample
+of them is profiled, one at a time, either with cProfile (pstats of the
+request thread) or with a stack sampler covering every thread, including
+the segment workers (collapsed stacks, as consumed by flamegraph.pl or
+speedscope). Results are written to a directory. While switched off the
+only cost per request is reading a flag.
+"""
+
+import cProfile
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from pathlib import Path
+
+MODES = ('cprofile', 'stacks')
+# Profile file names listed by stats()
+RECENT_FILES = 20
+
+
+class StackSampler:
+    """Periodically record the Python stack of every other thread"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='kasanoma-stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """Write the samples in the collapsed stack format, one 'frames count' per line"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class CProfiler:
+    """cProfile of the thread handling the request"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+class RequestProfiler:
+    """Profile a sample of requests while enabled, dumping each to output_dir"""
+
+    def __init__(self, output_dir, interval=0.005):
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.enabled = False
+        self.mode = 'cprofile'
+        self.sample_rate = 1.0
+        self.remaining = 0
+        self.written = 0
+        # Newest profiles first, for whoever turned profiling on
+        self.recent_files = deque(maxlen=RECENT_FILES)
+        self._lock = threading.Lock()
+        # Only one profiler can be attached at a time, so requests are profiled one by one
+        self._active = threading.Lock()
+
+    def configure(self, enabled, mode=None, sample_rate=None, count=None):
+        """Switch profiling on for the next count sampled requests, or off"""
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Invalid mode. Use: {', '.join(MODES)}")
+        if sample_rate is not None and not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if count is not None and count < 1:
+            raise ValueError("count must be at least 1")
+        with self._lock:
+            if mode is not None:
+                self.mode = mode
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if enabled:
+                self.output_dir.mkdir(parents=True, exist_ok=True)
+                self.remaining = count or 20
+            else:
+                self.remaining = 0
+            self.enabled = enabled
+
+    def start(self, name):
+        """Start profiling the current request if it is sampled; returns a handle for finish()"""
+        if not self.enabled:
+            return None
+        if random.random() >= self.sample_rate or not self._active.acquire(blocking=False):
+            return None
+        with self._lock:
+            if self.remaining <= 0:
+                self.enabled = False
+                self._active.release()
+                return None
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.enabled = False
+            mode = self.mode
+        profiler = StackSampler(self.interval) if mode == 'stacks' else CProfiler()
+        try:
+            profiler.start()
+        except Exception:
+            self._active.release()
+            raise
+        return name, mode, profiler
+
+    def finish(self, handle):
+        """Stop a profile started by start() and write it out, returning the file name"""
+        name, mode, profiler = handle
+        try:
+            profiler.stop()
+            suffix = 'folded' if mode == 'stacks' else 'pstats'
+            filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}.{suffix}"
+            profiler.dump(self.output_dir / filename)
+        finally:
+            self._active.release()
+        with self._lock:
+            self.written += 1
+            self.recent_files.appendleft(filename)
+        return filename
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'mode': self.mode,
+                'sample_rate': self.sample_rate,
+                'remaining': self.remaining,
+                'written': self.written,
+                'recent_files': list(self.recent_files),
+                'output_dir': str(self.output_dir)
+            }
@@ -0,0 +1,97 @@
+"""
+Text segmentation
+Splits input text into sentence-sized segments so long texts can be
+synthesized, streamed and cached one piece at a time.
+"""
+
+import re
+
+# Sentence-final punctuation across the scripts we ship voices for, followed by space
+SENTENCE_END = re.compile(r'(?<=[.!?;…։।。！？])["\'”’)\]]*\s+')
+CLAUSE_BREAK = re.compile(r'(?<=[,:;،、，])\s+')
+
+DEFAULT_MAX_CHARS = 400
+DEFAULT_MIN_CHARS = 20
+
+
+def _split_long(sentence, max_chars):
+    """Break an over-long sentence at clause boundaries, then at whitespace"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+
+    pieces = []
+    current = ""
+    for clause in CLAUSE_BREAK.split(sentence):
+        if len(clause) > max_chars:
+            words = clause.split()
+        else:
+            words = [clause]
+        for word in words:
+            candidate = f"{current} {word}" if current else word
+            if len(candidate) > max_chars and current:
+                pieces.append(current)
+                current = word
+            else:
+                current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sentences(text, max_chars=DEFAULT_MAX_CHARS, min_chars=DEFAULT_MIN_CHARS):
+    """Split text into sentence segments of at most max_chars characters
+
+    Very short sentences are merged with the following one so Piper is not
+    invoked for a lone "Yes." or a heading fragment.
+    """
+    segments = []
+    pending = ""
+    for block in re.split(r'\n\s*\n|\r?\n', text):
+        block = block.strip()
+        if not block:
+            continue
+        for sentence in SENTENCE_END.split(block):
+            sentence = re.sub(r'\s+', ' ', sentence).strip()
+            if not sentence:
+                continue
+            for piece in _split_long(sentence, max_chars):
+                candidate = f"{pending} {piece}" if pending else piece
+                if len(candidate) < min_chars:
+                    pending = candidate
+                    continue
+                if pending and len(candidate) > max_chars:
+                    segments.append(pending)
+                    candidate = piece
+                segments.append(candidate)
+                pending = ""
+    if pending:
+        if segments and len(segments[-1]) + len(pending) < max_chars:
+            segments[-1] = f"{segments[-1]} {pending}"
+        else:
+            segments.append(pending)
+    return segments
+
+
+def iter_sentences(chunks, max_chars=DEFAULT_MAX_CHARS, min_chars=DEFAULT_MIN_CHARS):
+    """Split a stream of text chunks (pages, paragraphs) into sentence segments
+
+    Only the unfinished tail of the previous chunk is carried over, so memory
+    stays bounded by the chunk size however long the document is.
+    """
+    carry = ""
+    for chunk in chunks:
+        buffer = carry + chunk
+        segments = split_sentences(buffer, max_chars, min_chars)
+        if not segments:
+            carry = ""
+            continue
+        if buffer.endswith('\n'):
+            # Lines are segment boundaries, so nothing continues past a newline
+            yield from segments
+            carry = ""
+            continue
+        # The last segment may continue in the next chunk
+        yield from segments[:-1]
+        carry = segments[-1] + (" " if buffer[-1].isspace() else "")
+    if carry:
+        yield from split_sentences(carry, max_chars, min_chars)
@@ -0,0 +1,123 @@
+"""
+Sharded dataset archives
+Packs samples into fixed-size tar shards in the WebDataset layout: each
+sample is a run of consecutive members sharing a key, such as
+audio_42.wav and audio_42.txt. Shards are written as a stream and only
+renamed to their final name once complete; reading maps a shard into
+memory and walks the tar headers, so a whole corpus can be read
+sequentially without opening millions of small files.
+"""
+
+import io
+import mmap
+import os
+import tarfile
+import time
+from pathlib import Path
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+PARTIAL_SUFFIX = '.partial'
+
+
+def shard_name(prefix, number):
+    return f"{prefix}-{number:06d}.tar"
+
+
+class TarShardWriter:
+    """Stream samples into numbered tar shards of roughly shard_bytes each"""
+
+    def __init__(self, output_dir, shard_bytes=256 * 1024 * 1024, prefix='shard', on_shard_closed=None):
+        """on_shard_closed(path, keys) is called once a shard is complete on disk"""
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_bytes = shard_bytes
+        self.prefix = prefix
+        self.on_shard_closed = on_shard_closed
+        self._tar = None
+        self._file = None
+        self._path = None
+        self._keys = []
+        # Shards cut off by a crash are never renamed, so they can simply be dropped
+        for partial in self.output_dir.glob(f"{prefix}-*.tar{PARTIAL_SUFFIX}"):
+            partial.unlink()
+        self._number = len(self.shards())
+
+    def shards(self):
+        """Completed shards, in order"""
+        return sorted(self.output_dir.glob(f"{self.prefix}-*.tar"))
+
+    def _open(self):
+        self._path = self.output_dir / shard_name(self.prefix, self._number)
+        self._file = open(f"{self._path}{PARTIAL_SUFFIX}", 'wb')
+        self._tar = tarfile.open(fileobj=self._file, mode='w', format=tarfile.USTAR_FORMAT)
+        self._keys = []
+
+    def add(self, key, members):
+        """Append one sample; members maps an extension such as 'wav' to its bytes"""
+        if self._tar is None:
+            self._open()
+        now = time.time()
+        for extension, data in members.items():
+            info = tarfile.TarInfo(f"{key}.{extension}")
+            info.size = len(data)
+            info.mtime = now
+            self._tar.addfile(info, io.BytesIO(data))
+        self._keys.append(key)
+        if self._file.tell() >= self.shard_bytes:
+            self.close_shard()
+
+    def close_shard(self):
+        """Finish the current shard and move it to its final name"""
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(f"{self._path}{PARTIAL_SUFFIX}", self._path)
+        path, keys = self._path, self._keys
+        self._tar = self._file = self._path = None
+        self._keys = []
+        self._number += 1
+        if self.on_shard_closed is not None:
+            self.on_shard_closed(path, keys)
+
+    def close(self):
+        self.close_shard()
+
+
+def iter_members(path):
+    """Yield (name, memoryview of data) for each file in a tar shard via mmap
+
+    The views point into the mapping, so nothing is copied; they stay valid
+    as long as the caller holds on to them.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    offset = 0
+    while offset + BLOCK_SIZE <= len(view):
+        header = view[offset:offset + BLOCK_SIZE]
+        if not any(header):
+            break  # end-of-archive blocks
+        info = tarfile.TarInfo.frombuf(bytes(header), tarfile.ENCODING, 'surrogateescape')
+        start = offset + BLOCK_SIZE
+        if info.isreg():
+            yield info.name, view[start:start + info.size]
+        offset = start + -(-info.size // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def iter_samples(path):
+    """Yield (key, {extension: memoryview}) for each sample of a shard"""
+    key, sample = None, {}
+    for name, data in iter_members(path):
+        member_key, _, extension = name.partition('.')
+        if member_key != key and sample:
+            yield key, sample
+            sample = {}
+        key = member_key
+        sample[extension] = data
+    if sample:
+        yield key, sample
@@ -0,0 +1,235 @@
+"""
+Content-addressed synthesis cache
+Stores synthesized WAV files on disk keyed by a hash of the normalized text,
+the voice and everything else that affects the audio. Entries are evicted
+least-recently-used once the cache grows past a byte cap. The index lives in
+SQLite so several gunicorn workers on one host can share the same cache.
+Lookups only read the index; the last-access time of an entry is refreshed
+at most once a minute and hit/miss counters are written in batches, so
+cache hits from many workers do not queue behind one write lock.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+# An entry's last access is rewritten at most this often, so LRU order is this coarse
+TOUCH_INTERVAL = 60
+# Seconds between writes of the hit/miss counters kept in memory meanwhile
+COUNTER_FLUSH_INTERVAL = 1.0
+
+
+def normalize_text(text):
+    """Normalize text so trivially different inputs share a cache entry"""
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class SynthesisCache:
+    """Disk-backed LRU cache of synthesized audio, shared across processes"""
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.db_path = self.cache_dir / "index.sqlite3"
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connection(self):
+        """Get this thread's SQLite connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        """Open a write transaction on this thread's connection"""
+        return _Transaction(self._connection())
+
+    def _entry_path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.wav"
+
+    @staticmethod
+    def make_key(text, voice_path, inference=None, piper_version=None):
+        """Build the cache key for a synthesis request"""
+        payload = json.dumps({
+            'text': normalize_text(text),
+            'voice': str(voice_path),
+            'inference': inference or {},
+            'piper_version': piper_version or ''
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _bump(self, conn, name, amount=1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _count(self, name):
+        """Count a hit or miss in memory, writing the counts out once a second"""
+        with self._counter_lock:
+            self._pending[name] = self._pending.get(name, 0) + 1
+            due = time.monotonic() - self._last_flush >= COUNTER_FLUSH_INTERVAL
+        if due:
+            with self._connect() as conn:
+                self._flush_counts(conn)
+
+    def _flush_counts(self, conn):
+        """Add the counts kept in memory to the shared counters"""
+        with self._counter_lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        for name, amount in pending.items():
+            self._bump(conn, name, amount)
+
+    def get(self, key, output_path):
+        """Copy a cached entry to output_path; return True on a hit"""
+        entry_path = self._lookup(key)
+        if entry_path is None:
+            return False
+        try:
+            shutil.copyfile(entry_path, output_path)
+        except OSError:
+            # Evicted by another worker between the lookup and the copy
+            return False
+        return True
+
+    def _lookup(self, key):
+        """Return the path of an entry, or None on a miss"""
+        entry_path = self._entry_path(key)
+        row = self._connection().execute("SELECT last_access FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or not entry_path.exists():
+            if row is not None:
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count('misses')
+            return None
+        now = time.time()
+        if now - row[0] >= TOUCH_INTERVAL:
+            with self._connect() as conn:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        self._count('hits')
+        return entry_path
+
+    def read(self, key):
+        """Return the bytes of a cached entry, or None on a miss"""
+        entry_path = self._lookup(key)
+        if entry_path is None:
+            return None
+        try:
+            return entry_path.read_bytes()
+        except OSError:
+            return None
+
+    def put(self, key, source_path):
+        """Store a copy of source_path under key and evict down to the byte cap"""
+        size = os.path.getsize(source_path)
+        return self._store(key, size, lambda tmp_path: shutil.copyfile(source_path, tmp_path))
+
+    def put_bytes(self, key, data):
+        """Store WAV bytes under key and evict down to the byte cap"""
+        return self._store(key, len(data), lambda tmp_path: Path(tmp_path).write_bytes(data))
+
+    def _store(self, key, size, write):
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(exist_ok=True)
+        if size > self.max_bytes:
+            return False
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return False
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                (key, size, time.time())
+            )
+            self._bump(conn, 'stores')
+            self._flush_counts(conn)
+            self._evict(conn)
+        return True
+
+    def _evict(self, conn):
+        """Drop least-recently-used entries until the cache fits max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                self._entry_path(key).unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self._bump(conn, 'evictions')
+
+    def stats(self):
+        """Get cache counters and current size"""
+        with self._connect() as conn:
+            self._flush_counts(conn)
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'cache_dir': str(self.cache_dir),
+            'entries': entries,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'stores': counters.get('stores', 0),
+            'evictions': counters.get('evictions', 0),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0
+        }
+
+
+class _Transaction:
+    """Run a block inside BEGIN IMMEDIATE so workers serialize their writes"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# The server modules live at the repository root
+sys.path.insert(0, str(REPO_DIR))
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The app module, running on the benchmarks' fake piper in scratch directories"""
+    sys.path.insert(0, str(REPO_DIR / 'benchmarks'))
+    from run_benchmarks import prepare_environment
+
+    os.environ['FAKE_PIPER_LOAD_SECONDS'] = '0'
+    os.environ['KASANOMA_AUTO_DETECT'] = 'false'
+    prepare_environment(argparse.Namespace(cache=False, pool_size=2, piper='fake'),
+                        tmp_path_factory.mktemp('server'))
+    import app
+    yield app
+    app.tts_engine.shutdown()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
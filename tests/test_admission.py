@@ -0,0 +1,199 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, RateLimiter, Overloaded
+
+
+def acquire_in_thread(controller, key, results):
+    """Start a thread that waits for a slot and records its release function or error"""
+    def run():
+        try:
+            results.append((key, controller.acquire(key)))
+        except Overloaded as e:
+            results.append((key, e))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+def test_admits_immediately_below_the_limit():
+    controller = AdmissionController(max_active=2)
+    first = controller.acquire('a')
+    second = controller.acquire('b')
+    assert controller.stats()['active'] == 2
+    first()
+    second()
+    assert controller.stats()['active'] == 0
+    assert controller.stats()['admitted'] == 2
+
+
+def test_rejects_when_the_queue_is_full():
+    controller = AdmissionController(max_active=1, max_queued=0)
+    release = controller.acquire('a')
+    with pytest.raises(Overloaded) as error:
+        controller.acquire('a')
+    assert error.value.reason == 'queue_full'
+    assert 1 <= error.value.retry_after <= 120
+    assert controller.stats()['rejected'] == 1
+    release()
+
+
+def test_times_out_waiting_in_the_queue():
+    controller = AdmissionController(max_active=1, max_queued=1, max_wait=0.05)
+    release = controller.acquire('a')
+    with pytest.raises(Overloaded) as error:
+        controller.acquire('a')
+    assert error.value.reason == 'queue_timeout'
+    stats = controller.stats()
+    assert (stats['timed_out'], stats['queued']) == (1, 0)
+    release()
+
+
+def test_release_is_idempotent():
+    controller = AdmissionController(max_active=1)
+    release = controller.acquire('a')
+    release()
+    release()
+    assert controller.stats()['active'] == 0
+    controller.acquire('a')
+    assert controller.stats()['active'] == 1
+
+
+def test_waiting_requests_are_admitted_in_order():
+    controller = AdmissionController(max_active=1, max_queued=2)
+    release = controller.acquire('first')
+    results = []
+    second = acquire_in_thread(controller, 'second', results)
+    wait_until(lambda: controller.stats()['queued'] == 1)
+    third = acquire_in_thread(controller, 'third', results)
+    wait_until(lambda: controller.stats()['queued'] == 2)
+
+    release()
+    second.join(5)
+    assert [key for key, _ in results] == ['second']
+    results[0][1]()
+    third.join(5)
+    assert [key for key, _ in results] == ['second', 'third']
+    results[1][1]()
+    assert controller.stats()['active'] == 0
+
+
+def test_per_key_limit_lets_other_keys_through():
+    controller = AdmissionController(max_active=3, max_active_per_key=1, max_queued=2)
+    release = controller.acquire('twi')
+    results = []
+    waiting = acquire_in_thread(controller, 'twi', results)
+    wait_until(lambda: controller.stats()['queued'] == 1)
+
+    # A different voice skips past the request held back by its own voice's limit
+    other = controller.acquire('chichewa')
+    assert controller.stats()['active'] == 2
+    assert results == []
+
+    release()
+    waiting.join(5)
+    assert [key for key, _ in results] == ['twi']
+    results[0][1]()
+    other()
+    assert controller.stats()['active'] == 0
+
+
+def test_rate_limiter_allows_a_burst_then_limits():
+    limiter = RateLimiter(rate=0.01, burst=3)
+    for _ in range(3):
+        limiter.check('client')
+    with pytest.raises(Overloaded) as error:
+        limiter.check('client')
+    assert error.value.reason == 'rate_limited'
+    assert error.value.retry_after >= 1
+    assert limiter.limited == 1
+    # Buckets are per client
+    limiter.check('another client')
+
+
+def test_rate_limiter_refills_over_time():
+    limiter = RateLimiter(rate=50, burst=1)
+    limiter.check('client')
+    with pytest.raises(Overloaded):
+        limiter.check('client')
+    time.sleep(0.05)
+    limiter.check('client')
+
+
+def test_rate_limiter_charges_a_cost_as_debt():
+    limiter = RateLimiter(rate=1, burst=3)
+    limiter.check('client', cost=5)
+    with pytest.raises(Overloaded) as error:
+        limiter.check('client')
+    # The two tokens owed are paid back before the next request
+    assert error.value.retry_after == 3
+
+
+def test_rate_limiter_is_off_with_no_rate():
+    limiter = RateLimiter(rate=0, burst=1)
+    for _ in range(10):
+        limiter.check('client')
+
+
+def test_api_turns_requests_away_when_busy(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'admission', AdmissionController(max_active=1, max_queued=0))
+    release = server.admission.acquire('held')
+    try:
+        response = client.post('/api/tts', json={'text': "Hello there.", 'language': 'Twi'})
+    finally:
+        release()
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.json['success'] is False
+
+
+def test_api_rate_limits_each_client(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'rate_limiter', RateLimiter(rate=0.01, burst=1))
+    assert client.post('/api/tts', json={'text': "Hello there.", 'language': 'Twi'}).status_code == 200
+    response = client.post('/api/tts', json={'text': "Hello there.", 'language': 'Twi'})
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+
+
+def test_api_charges_a_batch_per_item(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'rate_limiter', RateLimiter(rate=0.01, burst=3))
+    items = [{'text': "Akwaaba.", 'language': 'Twi'}] * 5
+    assert client.post('/api/tts/batch', json={'items': items}).status_code == 200
+    response = client.post('/api/tts', json={'text': "Hello there.", 'language': 'Twi'})
+    assert response.status_code == 429
+
+
+def test_api_admits_batch_items_like_single_requests(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'admission', AdmissionController(max_active=1, max_queued=0))
+    items = [{'text': "Akwaaba.", 'language': 'Twi'}, {'text': "Meda wo ase.", 'language': 'Twi'}]
+    release = server.admission.acquire('held')
+    try:
+        response = client.post('/api/tts/batch', json={'items': items})
+    finally:
+        release()
+    assert response.status_code == 200
+    assert [item['success'] for item in response.json['items']] == [False, False]
+    assert response.json['items'][0]['error'] == "Server is busy, try again later"
+
+    # With room to queue, the items wait for the slot in turn
+    monkeypatch.setattr(server, 'admission', AdmissionController(max_active=1, max_queued=1))
+    response = client.post('/api/tts/batch', json={'items': items})
+    assert [item['success'] for item in response.json['items']] == [True, True]
+    stats = server.admission.stats()
+    assert (stats['active'], stats['admitted']) == (0, 2)
+
+
+def test_api_rejects_text_over_the_limit(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'MAX_TEXT_CHARS', 10)
+    response = client.post('/api/tts', json={'text': "This is far too long.", 'language': 'Twi'})
+    assert response.status_code == 413
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(server):
+    import asgi
+    return asgi
+
+
+async def call(app, method, path, body=b'', headers=()):
+    """Run one request through an ASGI app; returns (status, headers, body)"""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'http_version': '1.1',
+             'headers': [(b'content-type', b'application/json'), *headers], 'client': ('127.0.0.1', 5000)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_wsgi_requests_run_at_the_same_time(asgi):
+    running = []
+    peak = 0
+    lock = threading.Lock()
+
+    def slow_app(environ, start_response):
+        nonlocal peak
+        with lock:
+            running.append(environ['PATH_INFO'])
+            peak = max(peak, len(running))
+        time.sleep(0.3)
+        with lock:
+            running.remove(environ['PATH_INFO'])
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [environ['PATH_INFO'].encode()]
+
+    app = asgi.ThreadedWsgi(slow_app, threads=4)
+
+    async def main():
+        return await asyncio.gather(*(call(app, 'GET', f'/{n}') for n in range(4)))
+
+    started = time.perf_counter()
+    try:
+        responses = asyncio.run(main())
+    finally:
+        app.shutdown()
+    assert time.perf_counter() - started < 1.0
+    assert peak == 4
+    assert [body for _, _, body in responses] == [f'/{n}'.encode() for n in range(4)]
+
+
+def test_wsgi_response_is_closed_after_sending(asgi):
+    closed = threading.Event()
+
+    class Body:
+        def __iter__(self):
+            yield b'one '
+            yield b'two'
+
+        def close(self):
+            closed.set()
+
+    def app(environ, start_response):
+        start_response('201 Created', [('X-Test', environ['QUERY_STRING'] or 'none')])
+        return Body()
+
+    wrapper = asgi.ThreadedWsgi(app, threads=1)
+    try:
+        status, headers, body = asyncio.run(call(wrapper, 'POST', '/'))
+    finally:
+        wrapper.shutdown()
+    assert (status, headers[b'x-test'], body) == (201, b'none', b'one two')
+    assert closed.is_set()
+
+
+def test_flask_routes_are_served_through_the_pool(server, asgi):
+    status, headers, body = asyncio.run(call(asgi.app, 'GET', '/api/voices'))
+    assert status == 200
+    assert json.loads(body)
+
+    # A streamed archive releases its admission slot once it has been sent
+    payload = json.dumps({'items': [{'text': "Akwaaba.", 'language': 'Twi'}], 'format': 'zip'}).encode()
+    status, headers, body = asyncio.run(call(asgi.app, 'POST', '/api/tts/batch', payload))
+    assert status == 200
+    assert body.startswith(b'PK')
+    assert server.admission.stats()['active'] == 0
@@ -0,0 +1,123 @@
+import argparse
+import csv
+import io
+import multiprocessing
+import signal
+from pathlib import Path
+
+import pytest
+
+from batch_synthesize import METADATA_FIELDS, WavDirectoryWriter, main, run
+from shards import iter_samples
+from wav_utils import read_wav
+
+FAKE_PIPER = Path(__file__).resolve().parent.parent / 'benchmarks' / 'fake_piper.py'
+
+SENTENCES = ["Akwaaba.", "", "Me din de Ama.", "Wo ho te sen?", "Meda wo ase.", "Yebehyia bio."]
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """A CSV of sentences (one blank) and a model for the fake piper"""
+    monkeypatch.setenv('FAKE_PIPER_LOAD_SECONDS', '0')
+    csv_path = tmp_path / 'sentences.csv'
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sentence'])
+        writer.writerows([sentence] for sentence in SENTENCES)
+    model = tmp_path / 'model.onnx'
+    model.write_bytes(b'')
+    (tmp_path / 'model.onnx.json').write_text('{"audio": {"sample_rate": 16000}}')
+    return csv_path, model
+
+
+def arguments(dataset, output_dir, *extra):
+    csv_path, model = dataset
+    return [str(csv_path), '--model', str(model), '--piper', str(FAKE_PIPER), '--workers', '2',
+            '--output-dir', str(output_dir), *extra]
+
+
+def read_metadata(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_writes_a_wav_and_metadata_row_per_sentence(dataset, tmp_path):
+    output_dir = tmp_path / 'wavs'
+    assert main(arguments(dataset, output_dir)) == 0
+
+    rows = read_metadata(output_dir / 'metadata.csv')
+    expected = {index: text for index, text in enumerate(SENTENCES, start=1) if text}
+    assert {int(Path(row['wav_filename']).stem[6:]): row['text'] for row in rows} == expected
+    for row in rows:
+        params, pcm = read_wav(row['wav_filename'])
+        assert params.framerate == 16000 and pcm
+    assert not list(output_dir.glob('.*.tmp'))
+
+
+def test_rerun_skips_rows_already_done(dataset, tmp_path, capsys):
+    output_dir = tmp_path / 'wavs'
+    main(arguments(dataset, output_dir))
+    (output_dir / 'audio_4.wav').unlink()
+    metadata = output_dir / 'metadata.csv'
+    rows = read_metadata(metadata)
+    with open(metadata, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=METADATA_FIELDS)
+        writer.writeheader()
+        writer.writerows(row for row in rows if Path(row['wav_filename']).name not in ('audio_4.wav', 'audio_5.wav'))
+        # A line cut short by a crash is dropped and its row redone
+        f.write(f"{output_dir / 'audio_5.wav'},Meda")
+    capsys.readouterr()
+
+    assert main(arguments(dataset, output_dir)) == 0
+    assert 'Resuming: 3 rows already done' in capsys.readouterr().out
+    rows = read_metadata(metadata)
+    assert sorted(Path(row['wav_filename']).name for row in rows) == [
+        'audio_1.wav', 'audio_3.wav', 'audio_4.wav', 'audio_5.wav', 'audio_6.wav']
+    assert (output_dir / 'audio_4.wav').exists()
+
+
+def test_tar_format_packs_rows_into_shards(dataset, tmp_path):
+    output_dir = tmp_path / 'shards'
+    assert main(arguments(dataset, output_dir, '--format', 'tar')) == 0
+
+    samples = {}
+    for shard in sorted(output_dir.glob('shard-*.tar')):
+        for key, members in iter_samples(shard):
+            samples[key] = bytes(members['txt']).decode('utf-8')
+            assert read_wav(io.BytesIO(members['wav']))[1]
+    expected = {f"audio_{index}": text for index, text in enumerate(SENTENCES, start=1) if text}
+    assert samples == expected
+    rows = read_metadata(output_dir / 'metadata.csv')
+    assert {row['wav_filename'] for row in rows} == {f"{key}.wav" for key in expected}
+    assert all(row['shard'] == 'shard-000000.tar' for row in rows)
+
+
+class FailingWriter(WavDirectoryWriter):
+    def __init__(self, output_dir, error):
+        super().__init__(output_dir, output_dir / 'metadata.csv')
+        self.error = error
+
+    def write(self, index, text, sample_rate, pcm):
+        raise self.error
+
+
+@pytest.mark.parametrize('error', [OSError("No space left on device"), KeyboardInterrupt()])
+def test_writer_errors_stop_the_pool_and_propagate(dataset, tmp_path, error):
+    csv_path, model = dataset
+    # More rows than the in-flight window, so rows are still waiting when the writer fails
+    with open(csv_path, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows([f"Sentence number {n}."] for n in range(40))
+    args = argparse.Namespace(
+        csv=str(csv_path), column='sentence', workers=2, backend='piper', piper=str(FAKE_PIPER),
+        model=str(model), timeout=10)
+    writer = FailingWriter(tmp_path / 'wavs', error)
+    handler = signal.getsignal(signal.SIGINT)
+    try:
+        with pytest.raises(type(error)) as raised:
+            run(args, writer)
+    finally:
+        writer.close()
+    assert raised.value is error
+    assert not multiprocessing.active_children()
+    assert signal.getsignal(signal.SIGINT) is handler
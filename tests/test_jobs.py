@@ -0,0 +1,195 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from jobs import JobStore, JobQueue, QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Claims a job and exits without releasing it, as a crashed server would
+CLAIM_AND_EXIT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from jobs import JobStore
+assert JobStore(sys.argv[2]).claim(sys.argv[3])
+"""
+
+
+def wait_for(store, job_id, states, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.load(job_id)
+        if job['status'] in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job stayed {store.load(job_id)['status']}")
+
+
+def test_records_round_trip(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create(filename='report.pdf')
+    assert job['status'] == QUEUED
+
+    store.update(job['id'], status=RUNNING, segments_done=3)
+    loaded = store.load(job['id'])
+    assert (loaded['status'], loaded['segments_done'], loaded['filename']) == (RUNNING, 3, 'report.pdf')
+    assert loaded['cancel_requested'] is False
+
+    store.request_cancel(job['id'])
+    assert store.load(job['id'])['cancel_requested'] is True
+
+
+def test_load_rejects_ids_that_are_not_job_ids(tmp_path):
+    store = JobStore(tmp_path / 'jobs')
+    (tmp_path / 'secret.json').write_text('{}')
+    assert store.load('../secret') is None
+    assert store.load('') is None
+    assert store.load('0123abcd') is None
+
+
+def test_claim_is_exclusive_until_released(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create()
+    assert store.claim(job['id'])
+    assert not store.claim(job['id'])
+    store.release(job['id'])
+    assert store.claim(job['id'])
+
+
+def test_claim_of_a_dead_process_is_taken_over(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create()
+    # No process has this pid
+    store._claim_path(job['id']).write_text('999999999')
+    assert store.claim(job['id'])
+
+
+def test_claim_left_by_a_previous_run_with_our_pid_is_taken_over(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create()
+    # After a restart in a container the new server often gets the same pid
+    store._claim_path(job['id']).write_text(str(os.getpid()))
+    assert store.claim(job['id'])
+    assert not JobStore(tmp_path).claim(job['id'])
+    store.release(job['id'])
+    assert not store._claim_path(job['id']).exists()
+
+
+def test_claim_is_freed_when_its_owner_exits(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create()
+    child = subprocess.run([sys.executable, '-c', CLAIM_AND_EXIT, str(REPO_DIR), str(tmp_path), job['id']])
+    assert child.returncode == 0
+    assert store._claim_path(job['id']).exists()
+    assert store.claim(job['id'])
+
+
+def test_unfinished_lists_queued_and_running_jobs_oldest_first(tmp_path):
+    store = JobStore(tmp_path)
+    first, second, done = store.create(), store.create(), store.create()
+    store.update(first['id'], created_at=1.0, status=RUNNING)
+    store.update(second['id'], created_at=2.0)
+    store.update(done['id'], status=COMPLETED)
+    assert [job['id'] for job in store.unfinished()] == [first['id'], second['id']]
+
+
+def test_sweep_removes_only_expired_finished_jobs(tmp_path):
+    store = JobStore(tmp_path, ttl=60)
+    expired, recent, running = store.create(), store.create(), store.create()
+    store.update(expired['id'], status=COMPLETED, finished_at=time.time() - 120)
+    store.request_cancel(expired['id'])
+    store.input_path(expired['id'], '.pdf').write_bytes(b'%PDF')
+    store.update(recent['id'], status=FAILED, finished_at=time.time())
+    store.update(running['id'], status=RUNNING, created_at=time.time() - 120)
+
+    assert store.sweep() == 1
+    assert store.load(expired['id']) is None
+    assert not list(tmp_path.glob(f"{expired['id']}.*"))
+    assert store.load(recent['id']) is not None
+    assert store.load(running['id']) is not None
+
+
+def test_sweep_keeps_everything_without_a_ttl(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create()
+    store.update(job['id'], status=COMPLETED, finished_at=0)
+    assert store.sweep() == 0
+    assert store.load(job['id']) is not None
+
+
+def test_queue_runs_jobs_and_records_the_outcome(tmp_path):
+    store = JobStore(tmp_path)
+
+    def handler(job, report):
+        report(1, 2)
+        if job.get('fail'):
+            return False, 'bad input'
+        report(2, 2)
+        return True, {'audio_file': 'out.wav'}
+
+    job_queue = JobQueue(store, handler)
+    good, bad = store.create(), store.create(fail=True)
+    assert job_queue.submit(good['id']) and job_queue.submit(bad['id'])
+
+    done = wait_for(store, good['id'], {COMPLETED})
+    assert done['result'] == {'audio_file': 'out.wav'}
+    assert (done['segments_done'], done['segments_total']) == (2, 2)
+    assert wait_for(store, bad['id'], {FAILED})['error'] == 'bad input'
+    assert not store._claim_path(good['id']).exists()
+
+
+def test_progress_without_a_known_total(tmp_path):
+    store = JobStore(tmp_path)
+    seen = []
+
+    def handler(job, report):
+        report(1, None)
+        seen.append(store.load(job['id']))
+        report(3, 3)
+        return True, 'done'
+
+    job_queue = JobQueue(store, handler)
+    job = store.create()
+    job_queue.submit(job['id'])
+    assert wait_for(store, job['id'], {COMPLETED, FAILED})['status'] == COMPLETED
+    assert (seen[0]['segments_done'], seen[0]['segments_total'], seen[0]['eta_seconds']) == (1, None, None)
+
+
+def test_cancel_stops_a_running_job(tmp_path):
+    store = JobStore(tmp_path)
+    started = threading.Event()
+
+    def handler(job, report):
+        started.set()
+        done = 0
+        while report(done, None):
+            done += 1
+            time.sleep(0.01)
+        return False, 'Conversion cancelled'
+
+    job_queue = JobQueue(store, handler)
+    job = store.create()
+    job_queue.submit(job['id'])
+    assert started.wait(5)
+    store.request_cancel(job['id'])
+    assert wait_for(store, job['id'], {COMPLETED, FAILED, CANCELLED})['status'] == CANCELLED
+
+
+def test_resume_requeues_unfinished_jobs(tmp_path):
+    store = JobStore(tmp_path)
+    job = store.create()
+    store.update(job['id'], status=RUNNING)
+    job_queue = JobQueue(store, lambda job, report: (True, 'done'))
+    assert job_queue.resume() == 1
+    assert wait_for(store, job['id'], {COMPLETED})['result'] == 'done'
+
+
+def test_api_rejects_job_fields_that_are_not_strings(client):
+    for body in ({'text': 5}, {'text': "Akwaaba.", 'language': ['Twi']}, {'text': "Akwaaba.", 'voice': 1}):
+        response = client.post('/api/jobs', json=body)
+        assert response.status_code == 400
+        assert response.json['success'] is False
+    assert client.post('/api/jobs', json=["Akwaaba."]).status_code == 400
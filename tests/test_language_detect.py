@@ -0,0 +1,52 @@
+import pytest
+
+from language_detect import SAMPLE_CHARS, LanguageDetector, take_sample
+
+INSTALLED = {'Twi': None, 'Chichewa': None, 'Makhuwa': None}
+
+
+@pytest.fixture(scope='module')
+def detector():
+    return LanguageDetector(INSTALLED)
+
+
+@pytest.mark.parametrize('text, language', [
+    ("Ɔkyerɛkyerɛfo no kɔɔ sukuu anɔpa yi. Mmofra no redi agorɔ wɔ abɔnten so.", 'Twi'),
+    ("Aphunzitsi anapita kusukulu m'mawa uno. Ana akusewera panja.", 'Chichewa'),
+    ("Mwaana aarowa oxikola nihiku nno. Atthu annalima mmatta.", 'Makhuwa'),
+])
+def test_detects_installed_languages(detector, text, language):
+    assert detector.detect(text, fallback='default') == language
+
+
+@pytest.mark.parametrize('text', [
+    "The teacher went to school this morning and the children are playing outside.",
+    "Uthisha uye esikoleni namhlanje ekuseni. Izingane zidlala ngaphandle.",
+    "Учитель пошёл в школу сегодня утром.",
+    "12345 !!! ...",
+])
+def test_languages_without_a_profile_get_the_fallback(detector, text):
+    assert detector.detect(text, fallback='default') == 'default'
+
+
+def test_english_is_detected_once_installed():
+    detector = LanguageDetector({**INSTALLED, 'English': None})
+    assert detector.detect("The teacher went to school this morning.", fallback='default') == 'English'
+
+
+def test_sample_txt_adds_a_profile(tmp_path):
+    (tmp_path / 'sample.txt').write_text(
+        "Mwalimu alikwenda shuleni asubuhi hii. Watoto wanacheza nje ya nyumba. "
+        "Habari za asubuhi? Nzuri sana, asante. Ninapenda kusoma vitabu shuleni.", encoding='utf-8')
+    detector = LanguageDetector({**INSTALLED, 'Swahili': tmp_path})
+    assert detector.detect("Watoto wanasoma vitabu shuleni asubuhi.", fallback='default') == 'Swahili'
+
+
+def test_non_latin_scripts_are_recognised():
+    detector = LanguageDetector({**INSTALLED, 'Russian': None})
+    assert detector.detect("Учитель пошёл в школу сегодня утром.") == 'Russian'
+
+
+def test_only_a_bounded_sample_is_read():
+    text = "Akwaaba. " * 100000
+    assert len(take_sample(text)) <= SAMPLE_CHARS + 1
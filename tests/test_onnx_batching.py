@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('onnxruntime')
+pytest.importorskip('piper_phonemize')
+
+from onnx_engine import OnnxEngine, OnnxVoice  # noqa: E402
+
+HOP = 4
+CONFIG = {'phoneme_id_map': {'_': [0], '^': [1], '$': [2], 'a': [3], 'b': [4], 'c': [5]}}
+
+
+class FakeVitsSession:
+    """Stands in for a Piper model: each phoneme id lasts a few frames of its own signal
+
+    Like VITS, the length of a row's audio depends on its phonemes rather
+    than their number, padded rows go on with the decoder's output for
+    silence, and the last phoneme of a sentence is very quiet.
+    """
+
+    def __init__(self, report_lengths):
+        self.report_lengths = report_lengths
+        self.calls = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name=name) for name in ('input', 'input_lengths', 'scales')]
+
+    def get_outputs(self):
+        names = ['output', 'output_lengths'] if self.report_lengths else ['output']
+        return [SimpleNamespace(name=name) for name in names]
+
+    def run(self, output_names, inputs):
+        self.calls.append(len(inputs['input']))
+        rows = []
+        for ids, length in zip(inputs['input'], inputs['input_lengths']):
+            ids = ids[:length]
+            row = []
+            for position, phoneme_id in enumerate(ids):
+                level = 0.0005 if position == len(ids) - 1 else 1.0
+                frames = int(phoneme_id) % 3 + 1
+                row.extend(level * np.sin(np.arange(frames * HOP) + phoneme_id))
+            rows.append(np.array(row, dtype=np.float32))
+        longest = max(len(row) for row in rows)
+        audio = np.full((len(rows), 1, 1, longest), 1e-4, dtype=np.float32)
+        for index, row in enumerate(rows):
+            audio[index, 0, 0, :len(row)] = row
+        if self.report_lengths:
+            return [audio, np.array([len(row) for row in rows], dtype=np.int64)]
+        return [audio]
+
+
+SENTENCES = [[1, 3, 0, 4, 0, 5, 0, 2], [1, 5, 0, 2], [1, 4, 0, 4, 0, 2], [1, 3, 0, 3, 0, 2]]
+
+
+@pytest.mark.parametrize('report_lengths', [True, False])
+def test_batched_output_matches_single_sentences(report_lengths):
+    engine = OnnxEngine()
+    session = FakeVitsSession(report_lengths)
+    voice = OnnxVoice('fake.onnx', CONFIG, session)
+
+    singles = [engine.synthesize_ids(voice, ids) for ids in SENTENCES]
+    session.calls.clear()
+    batched = engine.synthesize_batch(voice, SENTENCES)
+
+    for single, row in zip(singles, batched):
+        assert np.array_equal(single, row)
+    # Without the model's row lengths a padded row cannot be cut exactly, so nothing is padded
+    assert session.calls == ([4] if report_lengths else [1, 1, 1, 1])
@@ -0,0 +1,43 @@
+import sqlite3
+from array import array
+
+import phoneme_cache
+from phoneme_cache import PhonemeCache
+
+IDS = [array('H', [1, 3, 0, 2]), array('H', [1, 4, 2])]
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    PhonemeCache(disk_dir=tmp_path).put('a', IDS)
+    cache = PhonemeCache(disk_dir=tmp_path)
+    assert cache.get('a') == IDS
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_disk_tier_deletes_least_recently_used_down_to_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(phoneme_cache, 'TOUCH_INTERVAL', 0)
+    cache = PhonemeCache(disk_dir=tmp_path, max_disk_entries=2)
+    cache.put('old', IDS)
+    cache.put('used', IDS)
+    # Reading 'old' from disk makes 'used' the least recently used entry
+    assert PhonemeCache(disk_dir=tmp_path).get('old') == IDS
+    cache.put('new', IDS)
+
+    fresh = PhonemeCache(disk_dir=tmp_path)
+    assert fresh.get('used') is None
+    assert fresh.get('old') == IDS
+    assert fresh.get('new') == IDS
+    assert cache.stats()['disk_evictions'] == 1
+
+
+def test_caches_from_before_the_cap_are_upgraded(tmp_path):
+    with sqlite3.connect(tmp_path / 'phonemes.sqlite3') as conn:
+        conn.execute("CREATE TABLE phonemes (key TEXT PRIMARY KEY, ids BLOB NOT NULL)")
+        conn.execute("INSERT INTO phonemes VALUES (?, ?)", ('old', phoneme_cache.pack_sentences(IDS).tobytes()))
+    conn.close()
+
+    cache = PhonemeCache(disk_dir=tmp_path, max_disk_entries=1)
+    cache.put('new', IDS)
+    fresh = PhonemeCache(disk_dir=tmp_path)
+    assert fresh.get('old') is None
+    assert fresh.get('new') == IDS
@@ -0,0 +1,138 @@
+import importlib.util
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+HEALTH_APP_DIR = Path(__file__).resolve().parent.parent / 'example_scripts' / 'Health-survey-app'
+sys.path.insert(0, str(HEALTH_APP_DIR))
+
+from prompt_pack import PAGE_SIZE, PromptPack, read_index, write_pack  # noqa: E402
+
+PROMPTS = {
+    'welcome': ('key-welcome', b'RIFF' + bytes(range(256)) * 20),
+    'end': ('key-end', b'RIFF' + b'end of survey'),
+}
+
+
+@pytest.fixture
+def pack_path(tmp_path):
+    prompts = {}
+    for name, (key, data) in PROMPTS.items():
+        audio_path = tmp_path / f'{name}.wav'
+        audio_path.write_bytes(data)
+        prompts[name] = (key, audio_path)
+    return write_pack(tmp_path / 'prompts.pack', prompts)
+
+
+def test_index_records_each_prompt_on_a_page_boundary(pack_path):
+    entries = read_index(pack_path)
+    assert set(entries) == set(PROMPTS)
+    for name, entry in entries.items():
+        assert entry.offset % PAGE_SIZE == 0
+        assert (entry.key, entry.length) == (PROMPTS[name][0], len(PROMPTS[name][1]))
+    assert len({entry.etag for entry in entries.values()}) == len(PROMPTS)
+
+
+def test_read_index_rejects_files_that_are_not_packs(tmp_path):
+    (tmp_path / 'other.pack').write_bytes(b'not a pack at all')
+    assert read_index(tmp_path / 'other.pack') is None
+    assert read_index(tmp_path / 'missing.pack') is None
+    with pytest.raises(ValueError):
+        PromptPack(tmp_path / 'other.pack')
+
+
+def test_open_reads_a_prompt_or_a_range_of_it(pack_path):
+    pack = PromptPack(pack_path)
+    data = PROMPTS['welcome'][1]
+    assert pack.open('welcome').read() == data
+    part = pack.open('welcome', 10, 100)
+    assert part.read(50) + part.read() == data[10:100]
+    assert part.read() == b''
+    # Ranges past the end stop at the prompt's own audio
+    assert pack.open('end', 0, 10_000).read() == PROMPTS['end'][1]
+
+
+def test_fileno_is_positioned_at_the_start_of_the_range(pack_path):
+    pack = PromptPack(pack_path)
+    part = pack.open('welcome', 4, 20)
+    try:
+        assert os.read(part.fileno(), 16) == PROMPTS['welcome'][1][4:20]
+    finally:
+        part.close()
+
+
+@pytest.fixture(scope='module')
+def health_app(tmp_path_factory):
+    """The Health survey app, imported without a piper so no prompts are synthesized"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('HEALTH_PROMPT_BUNDLE_DIR', str(tmp_path_factory.mktemp('prompt_audio')))
+        spec = importlib.util.spec_from_file_location('health_app', HEALTH_APP_DIR / 'app.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def audio_client(health_app, pack_path, monkeypatch):
+    monkeypatch.setattr(health_app, 'PROMPT_PACK', PromptPack(pack_path))
+    return health_app.app.test_client()
+
+
+def test_audio_is_served_whole_with_an_etag(audio_client):
+    response = audio_client.get('/audio/welcome')
+    assert response.status_code == 200
+    assert response.get_data() == PROMPTS['welcome'][1]
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    etag = response.headers['ETag']
+    revalidated = audio_client.get('/audio/welcome', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+
+
+def test_audio_ranges(audio_client):
+    data = PROMPTS['welcome'][1]
+    response = audio_client.get('/audio/welcome', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    assert response.get_data() == data[100:200]
+
+    response = audio_client.get('/audio/welcome', headers={'Range': 'bytes=-16'})
+    assert response.status_code == 206
+    assert response.get_data() == data[-16:]
+
+    response = audio_client.get('/audio/welcome', headers={'Range': f'bytes={len(data)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(data)}'
+
+
+def test_unknown_audio_is_not_found(audio_client):
+    assert audio_client.get('/audio/nothing').status_code == 404
+
+
+def test_a_rebuilt_pack_does_not_change_what_is_served(tmp_path, pack_path):
+    pack = PromptPack(pack_path)
+    replacement = tmp_path / 'replacement.wav'
+    replacement.write_bytes(b'RIFF' + b'a different prompt' * 100)
+    write_pack(pack_path, {'end': ('key-new', replacement), 'welcome': ('key-new', replacement)})
+
+    part = pack.open('welcome', 0, 64)
+    try:
+        assert os.read(part.fileno(), 64) == PROMPTS['welcome'][1][:64]
+    finally:
+        part.close()
+    assert pack.open('end').read() == PROMPTS['end'][1]
+
+
+def test_without_proc_a_rebuilt_pack_falls_back_to_reading_the_mapping(tmp_path, pack_path, monkeypatch):
+    pack = PromptPack(pack_path)
+    write_pack(pack_path, {'end': ('key-new', pack_path)})
+    monkeypatch.setattr(os.path, 'exists', lambda path: False)
+    part = pack.open('welcome')
+    with pytest.raises(io.UnsupportedOperation):
+        part.fileno()
+    assert part.read() == PROMPTS['welcome'][1]
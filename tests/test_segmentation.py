@@ -0,0 +1,59 @@
+from segmentation import split_sentences, iter_sentences
+
+
+def test_splits_at_sentence_ends_and_lines():
+    text = "The clinic opens at eight o'clock. Is it far from here?\nBring your health card!"
+    assert split_sentences(text) == [
+        "The clinic opens at eight o'clock.",
+        "Is it far from here?",
+        "Bring your health card!"
+    ]
+
+
+def test_merges_short_sentences_with_the_next():
+    assert split_sentences("Yes. The results came back negative.") == [
+        "Yes. The results came back negative."
+    ]
+    # A short last sentence joins the one before it
+    assert split_sentences("The results came back negative. Good.") == [
+        "The results came back negative. Good."
+    ]
+
+
+def test_breaks_long_sentences_at_clauses_then_words():
+    clauses = ", ".join(f"clause number {i} of a long sentence" for i in range(20)) + "."
+    segments = split_sentences(clauses, max_chars=100)
+    assert all(len(segment) <= 100 for segment in segments)
+    assert " ".join(segments) == clauses
+
+    words = " ".join(["word"] * 100)
+    segments = split_sentences(words, max_chars=50)
+    assert all(len(segment) <= 50 for segment in segments)
+    assert " ".join(segments) == words
+
+
+def test_normalizes_whitespace_and_skips_blank_text():
+    assert split_sentences("  The   first\tsentence is here.  \n\n  ") == ["The first sentence is here."]
+    assert split_sentences(" \n\n ") == []
+
+
+def test_iter_sentences_matches_split_sentences_across_chunk_boundaries():
+    text = ("The clinic opens at eight o'clock. Is it far from the market? Bring your health card.\n"
+            "Doctors see patients until noon. Yes. Children are seen first, then the elderly.")
+    expected = split_sentences(text)
+    for size in (7, 16, 40, len(text)):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert list(iter_sentences(chunks)) == expected, size
+
+
+def test_iter_sentences_consumes_chunks_lazily():
+    consumed = []
+
+    def pages():
+        for page in ("First page sentence one. First page sentence two. ", "Second page sentence."):
+            consumed.append(page)
+            yield page
+
+    segments = iter_sentences(pages())
+    assert next(segments) == "First page sentence one."
+    assert len(consumed) == 1
@@ -0,0 +1,72 @@
+import synthesis_cache
+from synthesis_cache import SynthesisCache
+
+
+def test_read_and_get_return_stored_entries(tmp_path):
+    cache = SynthesisCache(tmp_path / 'cache')
+    cache.put_bytes('a', b'RIFF-a')
+    source = tmp_path / 'b.wav'
+    source.write_bytes(b'RIFF-b')
+    cache.put('b', source)
+
+    assert cache.read('a') == b'RIFF-a'
+    output = tmp_path / 'out.wav'
+    assert cache.get('b', output)
+    assert output.read_bytes() == b'RIFF-b'
+    assert cache.read('missing') is None
+    assert not cache.get('missing', tmp_path / 'none.wav')
+
+
+def test_make_key_ignores_whitespace_but_not_voice():
+    key = SynthesisCache.make_key("Hello  world.\n", 'voices/Twi/model.onnx')
+    assert key == SynthesisCache.make_key("Hello world.", 'voices/Twi/model.onnx')
+    assert key != SynthesisCache.make_key("Hello world.", 'voices/English/model.onnx')
+    assert key != SynthesisCache.make_key("Hello world.", 'voices/Twi/model.onnx', piper_version='2')
+
+
+def test_evicts_least_recently_used_down_to_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(synthesis_cache, 'TOUCH_INTERVAL', 0)
+    cache = SynthesisCache(tmp_path, max_bytes=250)
+    cache.put_bytes('old', b'x' * 100)
+    cache.put_bytes('used', b'x' * 100)
+    # Reading 'old' makes 'used' the least recently used entry
+    assert cache.read('old') is not None
+    cache.put_bytes('new', b'x' * 100)
+
+    assert cache.read('used') is None
+    assert cache.read('old') is not None
+    assert cache.read('new') is not None
+    stats = cache.stats()
+    assert stats['size_bytes'] == 200
+    assert stats['evictions'] == 1
+
+
+def test_entries_larger_than_the_cap_are_not_stored(tmp_path):
+    cache = SynthesisCache(tmp_path, max_bytes=10)
+    assert not cache.put_bytes('big', b'x' * 11)
+    assert cache.read('big') is None
+
+
+def test_entry_deleted_from_disk_is_a_miss(tmp_path):
+    cache = SynthesisCache(tmp_path)
+    cache.put_bytes('a', b'data')
+    cache._entry_path('a').unlink()
+
+    assert cache.read('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_instances_share_entries_and_counters(tmp_path):
+    # Two gunicorn workers open the same directory
+    first = SynthesisCache(tmp_path)
+    second = SynthesisCache(tmp_path)
+    first.put_bytes('a', b'data')
+
+    assert second.read('a') == b'data'
+    assert second.read('b') is None
+    assert first.read('a') == b'data'
+
+    first.stats()
+    stats = second.stats()
+    assert (stats['hits'], stats['misses'], stats['stores']) == (2, 1, 1)
+    assert stats['hit_rate'] == 2 / 3
@@ -0,0 +1,49 @@
+import io
+import wave
+
+from wav_utils import read_wav
+
+
+def synthesize(client, text):
+    """PCM of text synthesized on its own by /api/tts"""
+    response = client.post('/api/tts', json={'text': text, 'language': 'Twi'})
+    assert response.status_code == 200, response.json
+    audio = client.get(f"/api/audio/{response.json['audio_file'].rsplit('/', 1)[-1]}")
+    params, pcm = read_wav(io.BytesIO(audio.get_data()))
+    return params, pcm
+
+
+def test_stream_sends_each_sentence_with_silence_between(server, client):
+    sentences = ["The clinic opens at eight o'clock.", "Is it far from the market?", "Bring your health card."]
+    segments = [synthesize(client, sentence) for sentence in sentences]
+    params = segments[0][0]
+    gap = b'\x00' * (int(params.framerate * server.SEGMENT_SILENCE) * params.sampwidth)
+
+    response = client.post('/api/tts?stream=1', json={'text': " ".join(sentences), 'language': 'Twi',
+                                                      'format': 'pcm'})
+    body = response.get_data()
+    response.close()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/L16'
+    assert response.headers['X-Sample-Rate'] == str(params.framerate)
+    assert body == gap.join(pcm for _, pcm in segments)
+
+
+def test_stream_wav_starts_with_an_open_ended_header(client):
+    response = client.post('/api/tts', json={'text': "One sentence. And then another one.", 'stream': True,
+                                             'language': 'Twi'})
+    body = response.get_data()
+    response.close()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/wav'
+    with wave.open(io.BytesIO(body)) as wav_file:
+        assert wav_file.getnchannels() == 1
+        assert wav_file.getframerate() == int(response.headers['X-Sample-Rate'])
+
+
+def test_stream_rejects_unknown_formats_and_empty_text(client):
+    response = client.post('/api/tts?stream=1', json={'text': "Hello there.", 'format': 'mp3'})
+    assert response.status_code == 400
+    assert client.post('/api/tts?stream=1', json={'text': "  "}).status_code == 400
@@ -0,0 +1,76 @@
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from wav_utils import read_wav
+
+ITEMS = [
+    {'text': "Akwaaba.", 'language': 'Twi', 'id': 'greeting'},
+    {'text': "   "},
+    {'text': 42},
+    {'text': "Me din de Ama.", 'voice': 'no-such-voice'},
+    "not an object",
+    {'text': "Meda wo ase.", 'language': 'Twi'},
+]
+
+
+def check_manifest(manifest):
+    items = manifest['items']
+    assert [item['index'] for item in items] == list(range(len(ITEMS)))
+    assert [item['success'] for item in items] == [True, False, False, False, False, True]
+    assert (manifest['succeeded'], manifest['failed']) == (2, 4)
+    assert items[0]['id'] == 'greeting'
+    assert "'text' must be a string" in items[2]['error']
+    assert items[4]['error'] == 'Item must be an object'
+
+
+def test_manifest_reports_each_item(client):
+    response = client.post('/api/tts/batch', json={'items': ITEMS})
+    assert response.status_code == 200
+    manifest = response.json
+    check_manifest(manifest)
+    for item in manifest['items']:
+        if item['success']:
+            audio = client.get(item['audio_url'])
+            assert audio.status_code == 200
+            assert read_wav(io.BytesIO(audio.get_data()))[1]
+
+
+def read_archive(output_format, body):
+    if output_format == 'zip':
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+
+
+@pytest.mark.parametrize('output_format', ['zip', 'tar'])
+def test_archive_holds_the_audio_and_manifest(server, client, output_format):
+    response = client.post('/api/tts/batch', json={'items': ITEMS, 'format': output_format})
+    body = response.get_data()
+    response.close()
+    assert response.status_code == 200
+    # The batch's admission slot is released once the archive has been sent
+    assert server.admission.stats()['active'] == 0
+
+    members = read_archive(output_format, body)
+    assert sorted(members) == ['0000.wav', '0005.wav', 'manifest.json']
+    manifest = json.loads(members['manifest.json'])
+    check_manifest(manifest)
+    assert [item.get('file') for item in manifest['items'] if item['success']] == ['0000.wav', '0005.wav']
+    for name in ('0000.wav', '0005.wav'):
+        assert read_wav(io.BytesIO(members[name]))[1]
+
+
+def test_rejects_bad_batches(server, client, monkeypatch):
+    assert client.post('/api/tts/batch', json={'items': []}).status_code == 400
+    assert client.post('/api/tts/batch', json=[{'text': "Akwaaba."}]).status_code == 400
+    response = client.post('/api/tts/batch', json={'items': ITEMS, 'format': 'rar'})
+    assert response.status_code == 400
+
+    monkeypatch.setattr(server, 'BATCH_MAX_ITEMS', 2)
+    response = client.post('/api/tts/batch', json={'items': ITEMS})
+    assert response.status_code == 413
@@ -0,0 +1,240 @@
+"""
+Voice registry
+Indexes the voices tree by language and voice name, caching each model's
+model.onnx.json settings. A background watcher picks up added, removed or
+updated voices by comparing mtimes and swaps in a new index atomically, so
+lookups never block. The scan is persisted to disk so startup only rescans
+folders that changed.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+INDEX_VERSION = 1
+
+
+def _display_name(name):
+    return name.replace('_', ' ').replace('-', ' ').title()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_voice_config(config_path):
+    """Read the settings we need from a model.onnx.json file"""
+    try:
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return config
+
+
+def summarize_config(config):
+    """Pick the fields of a voice config that are exposed and indexed"""
+    return {
+        'sample_rate': config.get('audio', {}).get('sample_rate'),
+        'num_speakers': config.get('num_speakers', 1),
+        'speaker_id_map': config.get('speaker_id_map', {}),
+        'inference': config.get('inference', {}),
+        'espeak_voice': config.get('espeak', {}).get('voice'),
+        'phoneme_type': config.get('phoneme_type'),
+        'piper_version': config.get('piper_version')
+    }
+
+
+class VoiceIndex:
+    """Immutable snapshot of the voices tree with O(1) lookups"""
+
+    def __init__(self, folders):
+        # folders: scanned language folders, {folder path: folder record}
+        self.folders = folders
+        self.languages = {}
+        self.voices = {}
+        self.by_path = {}
+        self.by_name = {}
+        self.by_language_name = {}
+        self.configs = {}
+
+        for folder in sorted(folders.values(), key=lambda f: f['language']):
+            language = folder['language']
+            voices = []
+            for record in sorted(folder['voices'], key=lambda v: v['name']):
+                voice = {
+                    'name': record['name'],
+                    'path': record['path'],
+                    'display_name': _display_name(record['name']),
+                    'language': language
+                }
+                voice.update({k: v for k, v in record['summary'].items() if k != 'speaker_id_map'})
+                voices.append(voice)
+                self.by_path[voice['path']] = voice
+                self.by_name.setdefault(voice['name'], []).append(voice)
+                self.by_language_name[(language, voice['name'])] = voice
+                self.configs[voice['path']] = record['config']
+            if voices and language not in self.languages:
+                self.languages[language] = {
+                    'folder_name': language,
+                    'display_name': _display_name(language) if language != 'Default' else 'Default',
+                    'path': folder['path'],
+                    'voice_count': len(voices)
+                }
+                self.voices[language] = voices
+
+    def voice(self, language=None, name=None):
+        """Look up a voice by language and/or name"""
+        if language and name:
+            return self.by_language_name.get((language, name))
+        if name:
+            matches = self.by_name.get(name)
+            return matches[0] if matches else None
+        if language:
+            voices = self.voices.get(language)
+            return voices[0] if voices else None
+        return None
+
+
+class VoiceRegistry:
+    """Hot-reloadable registry of voice models under a voices directory"""
+
+    def __init__(self, voice_base_path, index_path=None, reload_interval=10, on_change=None):
+        self.voice_base_path = Path(voice_base_path)
+        self.index_path = Path(index_path) if index_path else None
+        self.reload_interval = reload_interval
+        self.on_change = on_change
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+
+        folders = self._load_persisted()
+        self.index = VoiceIndex(self._scan(folders))
+        self._persist()
+
+    def _folder_paths(self):
+        """Language folders to index, plus the base folder for loose voices"""
+        paths = []
+        if self.voice_base_path.exists():
+            paths.append(self.voice_base_path)
+            for entry in os.scandir(self.voice_base_path):
+                if entry.is_dir():
+                    paths.append(Path(entry.path))
+        return paths
+
+    def _scan_folder(self, folder_path, previous):
+        """Scan one folder, reusing parsed configs whose files are unchanged"""
+        old_voices = {v['path']: v for v in previous['voices']} if previous else {}
+        voices = []
+        for model_path in sorted(folder_path.glob("*.onnx")):
+            path = str(model_path)
+            config_path = f"{path}.json"
+            model_mtime = _mtime(path)
+            config_mtime = _mtime(config_path)
+            old = old_voices.get(path)
+            if old and old['model_mtime'] == model_mtime and old['config_mtime'] == config_mtime:
+                voices.append(old)
+                continue
+            config = read_voice_config(config_path) if config_mtime is not None else {}
+            voices.append({
+                'name': model_path.stem,
+                'path': path,
+                'model_mtime': model_mtime,
+                'config_mtime': config_mtime,
+                'config': config,
+                'summary': summarize_config(config)
+            })
+        is_base = folder_path == self.voice_base_path
+        return {
+            'path': str(folder_path),
+            'language': 'Default' if is_base else folder_path.name,
+            'mtime': _mtime(folder_path),
+            'voices': voices
+        }
+
+    def _folder_changed(self, record):
+        """Check a previously scanned folder for added, removed or edited files"""
+        if _mtime(record['path']) != record['mtime']:
+            return True
+        for voice in record['voices']:
+            if (_mtime(voice['path']) != voice['model_mtime'] or
+                    _mtime(f"{voice['path']}.json") != voice['config_mtime']):
+                return True
+        return False
+
+    def _scan(self, previous):
+        """Build folder records, rescanning only folders that changed"""
+        folders = {}
+        for folder_path in self._folder_paths():
+            key = str(folder_path)
+            old = previous.get(key)
+            if old is not None and not self._folder_changed(old):
+                folders[key] = old
+            else:
+                folders[key] = self._scan_folder(folder_path, old)
+        return folders
+
+    def _load_persisted(self):
+        """Load the folder records saved by a previous run"""
+        if not self.index_path or not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION or data.get('voice_base_path') != str(self.voice_base_path):
+            return {}
+        return data.get('folders', {})
+
+    def _persist(self):
+        """Save folder records so the next startup can skip unchanged folders"""
+        if not self.index_path:
+            return
+        data = {
+            'version': INDEX_VERSION,
+            'voice_base_path': str(self.voice_base_path),
+            'folders': self.index.folders
+        }
+        tmp_path = self.index_path.with_name(f".{self.index_path.name}.{os.getpid()}.tmp")
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def reload(self):
+        """Rescan changed folders and swap in a new index; returns True if anything changed"""
+        with self._lock:
+            current = self.index
+            folders = self._scan(current.folders)
+            if folders == current.folders:
+                return False
+            # Readers keep using the old snapshot until this single assignment
+            self.index = VoiceIndex(folders)
+            self.reloads += 1
+            self._persist()
+        if self.on_change is not None:
+            self.on_change(self.index)
+        return True
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except OSError:
+                pass
+
+    def start_watching(self):
+        """Poll the voices tree for changes in a background thread"""
+        if self._watcher is None and self.reload_interval:
+            self._watcher = threading.Thread(target=self._watch_loop, name='kasanoma-voice-watcher', daemon=True)
+            self._watcher.start()
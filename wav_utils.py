@@ -0,0 +1,56 @@
+"""
+WAV helpers
+Small utilities for reading PCM out of Piper's WAV files and writing
+streamed or concatenated audio back out.
+"""
+
+import struct
+import wave
+from collections import namedtuple
+
+# Placeholder sizes for a WAV whose length is not known up front
+STREAMING_DATA_SIZE = 0xFFFFFFFF - 36
+
+# Same fields as wave's getparams(), for PCM that never went through a file
+WavParams = namedtuple('WavParams', ['nchannels', 'sampwidth', 'framerate', 'nframes', 'comptype', 'compname'])
+
+
+def read_wav(path):
+    """Read a WAV file or file object, returning (params, pcm_bytes)"""
+    source = path if hasattr(path, 'read') else str(path)
+    with wave.open(source, 'rb') as wav_file:
+        params = wav_file.getparams()
+        frames = wav_file.readframes(params.nframes)
+    return params, frames
+
+
+def wav_header(sample_rate, channels=1, sample_width=2, data_size=STREAMING_DATA_SIZE):
+    """Build a 44-byte PCM WAV header
+
+    With the default data_size the header describes an open-ended stream,
+    which browsers and most players accept for progressive playback.
+    """
+    byte_rate = sample_rate * channels * sample_width
+    block_align = channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', min(data_size + 36, 0xFFFFFFFF), b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, byte_rate, block_align, sample_width * 8,
+        b'data', data_size
+    )
+
+
+def pcm_params(sample_rate, pcm, channels=1, sample_width=2):
+    """Describe raw PCM bytes with the same params read_wav returns"""
+    nframes = len(pcm) // (channels * sample_width)
+    return WavParams(channels, sample_width, sample_rate, nframes, 'NONE', 'not compressed')
+
+
+def wav_bytes(params, pcm):
+    """Wrap PCM bytes in a complete WAV file"""
+    return wav_header(params.framerate, params.nchannels, params.sampwidth, data_size=len(pcm)) + pcm
+
+
+def silence(sample_rate, seconds, channels=1, sample_width=2):
+    """Return PCM bytes of digital silence"""
+    return b'\x00' * (int(sample_rate * seconds) * channels * sample_width)